@@ -0,0 +1,30 @@
+"""Image blob storage
+
+Revision ID: 5e2d3bc73d62
+Revises: 64455fb43d6d
+Create Date: 2026-10-18 08:01:03.187260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2d3bc73d62'
+down_revision = '64455fb43d6d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("image", sa.Column("digest", sa.String(length=64), nullable=True))
+    op.add_column("image", sa.Column("size", sa.BigInteger(), nullable=True))
+    op.add_column(
+        "image", sa.Column("mime_type", sa.String(length=255), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("image", "mime_type")
+    op.drop_column("image", "size")
+    op.drop_column("image", "digest")
@@ -0,0 +1,42 @@
+"""Image (user_id, id) index
+
+Revision ID: 568b07bc350a
+Revises: 5e2d3bc73d62
+Create Date: 2026-10-18 08:08:32.697533
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '568b07bc350a'
+down_revision = '5e2d3bc73d62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Built concurrently, so listing and uploads keep working during the build
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_image_user_id_id",
+            "image",
+            ["user_id", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        # Primary key is already indexed
+        op.drop_index(
+            "ix_image_id", table_name="image", postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_image_id", "image", ["id"], unique=False, postgresql_concurrently=True
+        )
+        op.drop_index(
+            "ix_image_user_id_id", table_name="image", postgresql_concurrently=True
+        )
@@ -0,0 +1,40 @@
+"""Image payload table
+
+Revision ID: 9a9d32f9b3e6
+Revises: 568b07bc350a
+Create Date: 2026-10-18 08:09:04.145776
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a9d32f9b3e6'
+down_revision = '568b07bc350a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "image_payload",
+        sa.Column("image_id", sa.Integer(), nullable=False),
+        sa.Column("base64", sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(["image_id"], ["image.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("image_id"),
+    )
+    op.execute(
+        "INSERT INTO image_payload (image_id, base64) "
+        "SELECT id, base64 FROM image WHERE base64 IS NOT NULL"
+    )
+    op.drop_column("image", "base64")
+
+
+def downgrade():
+    op.add_column("image", sa.Column("base64", sa.Text(), nullable=True))
+    op.execute(
+        "UPDATE image SET base64 = image_payload.base64 "
+        "FROM image_payload WHERE image_payload.image_id = image.id"
+    )
+    op.drop_table("image_payload")
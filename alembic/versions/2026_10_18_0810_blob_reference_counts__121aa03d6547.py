@@ -0,0 +1,40 @@
+"""Blob reference counts
+
+Revision ID: 121aa03d6547
+Revises: 9a9d32f9b3e6
+Create Date: 2026-10-18 08:10:10.759631
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '121aa03d6547'
+down_revision = '9a9d32f9b3e6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "blob",
+        sa.Column("digest", sa.String(length=64), nullable=False),
+        sa.Column("size", sa.BigInteger(), nullable=False),
+        sa.Column("refcount", sa.Integer(), nullable=False),
+        sa.Column("released_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("digest"),
+    )
+    op.execute(
+        "INSERT INTO blob (digest, size, refcount) "
+        "SELECT digest, max(size), count(*) FROM image "
+        "WHERE digest IS NOT NULL GROUP BY digest"
+    )
+    op.create_foreign_key(
+        "image_digest_fkey", "image", "blob", ["digest"], ["digest"]
+    )
+
+
+def downgrade():
+    op.drop_constraint("image_digest_fkey", "image", type_="foreignkey")
+    op.drop_table("blob")
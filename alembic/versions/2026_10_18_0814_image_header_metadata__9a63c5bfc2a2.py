@@ -0,0 +1,46 @@
+"""Image header metadata
+
+Revision ID: 9a63c5bfc2a2
+Revises: 121aa03d6547
+Create Date: 2026-10-18 08:14:37.875532
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "9a63c5bfc2a2"
+down_revision = "121aa03d6547"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("image", sa.Column("width", sa.Integer(), nullable=True))
+    op.add_column("image", sa.Column("height", sa.Integer(), nullable=True))
+    op.add_column("image", sa.Column("orientation", sa.SmallInteger(), nullable=True))
+    op.add_column(
+        "image", sa.Column("taken_at", sa.DateTime(timezone=True), nullable=True)
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_image_user_id_taken_at",
+            "image",
+            ["user_id", "taken_at"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_image_user_id_taken_at",
+            table_name="image",
+            postgresql_concurrently=True,
+        )
+    op.drop_column("image", "taken_at")
+    op.drop_column("image", "orientation")
+    op.drop_column("image", "height")
+    op.drop_column("image", "width")
@@ -0,0 +1,53 @@
+"""Resumable uploads
+
+Revision ID: 0af14b8bf5dc
+Revises: 764f0dbdaa41
+Create Date: 2026-10-18 08:29:00.550692
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from fastapi_users_db_sqlalchemy import guid
+
+# revision identifiers, used by Alembic.
+revision = "0af14b8bf5dc"
+down_revision = "764f0dbdaa41"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "upload",
+        sa.Column("id", sa.String(length=32), nullable=False),
+        sa.Column("user_id", guid.GUID(), nullable=False),
+        sa.Column("length", sa.BigInteger(), nullable=False),
+        sa.Column("received", sa.BigInteger(), server_default="0", nullable=False),
+        sa.Column("filename", sa.String(), nullable=True),
+        sa.Column("mime_type", sa.String(length=255), nullable=False),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("checksum", sa.String(length=64), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_upload_updated_at"), "upload", ["updated_at"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_upload_updated_at"), table_name="upload")
+    op.drop_table("upload")
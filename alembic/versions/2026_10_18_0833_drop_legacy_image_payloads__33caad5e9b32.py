@@ -0,0 +1,43 @@
+"""Drop legacy image payloads
+
+Revision ID: 33caad5e9b32
+Revises: 0af14b8bf5dc
+Create Date: 2026-10-18 08:33:11.204581
+
+Cutover of `python -m app.payload_backfill`, refuses to run while
+`image_payload` still has rows, nothing is converted here.
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "33caad5e9b32"
+down_revision = "0af14b8bf5dc"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    connection = op.get_bind()
+    left = connection.execute(sa.text("SELECT count(*) FROM image_payload")).scalar()
+    if left:
+        raise RuntimeError(
+            f"{left} images still have inline payloads,"
+            " run python -m app.payload_backfill first"
+        )
+    # Fail fast rather than queue every query on image behind this lock
+    op.execute("SET LOCAL lock_timeout = '5s'")
+    op.drop_table("image_payload")
+
+
+def downgrade():
+    # Content stays in the blob store, only the empty table comes back
+    op.create_table(
+        "image_payload",
+        sa.Column("image_id", sa.Integer(), nullable=False),
+        sa.Column("base64", sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(["image_id"], ["image.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("image_id"),
+    )
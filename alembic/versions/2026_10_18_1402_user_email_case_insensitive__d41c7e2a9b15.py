@@ -0,0 +1,51 @@
+"""User email unique regardless of case
+
+Revision ID: d41c7e2a9b15
+Revises: 33caad5e9b32
+Create Date: 2026-10-18 14:02:37.518204
+
+FastAPI Users looks users up by `lower(email)`, the unique index on `email`
+alone lets `foo@x.com` and `Foo@x.com` both sign up. Refuses to run while
+such duplicates exist, they have to be merged by hand first.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d41c7e2a9b15"
+down_revision = "33caad5e9b32"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    connection = op.get_bind()
+    duplicates = connection.execute(
+        sa.text(
+            'SELECT count(*) FROM (SELECT lower(email) FROM "user"'
+            " GROUP BY lower(email) HAVING count(*) > 1) AS duplicate"
+        )
+    ).scalar()
+    if duplicates:
+        raise RuntimeError(
+            f"{duplicates} emails belong to more than one user when compared"
+            " without case, merge those users first"
+        )
+    # Built concurrently, so signups and logins keep working during the build
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_user_email_lower",
+            "user",
+            [sa.text("lower(email)")],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_user_email_lower", table_name="user", postgresql_concurrently=True
+        )
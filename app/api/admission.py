@@ -0,0 +1,250 @@
+"""
+Admission control for uploads.
+
+Every upload request takes a slot before its body is read:
+
+- at most `UPLOAD_MAX_CONCURRENT` uploads run per process, up to
+  `UPLOAD_MAX_QUEUED` more wait `UPLOAD_QUEUE_TIMEOUT_SECONDS` for a slot,
+  anything beyond is rejected with 503 right away
+- a user runs at most `UPLOAD_MAX_CONCURRENT_PER_USER` uploads, 429 otherwise
+- a user uploads `UPLOAD_USER_BYTES_PER_SECOND` on average with bursts of
+  `UPLOAD_USER_BURST_BYTES` (token bucket). Bytes over the budget slow the
+  body down, a user already over budget is rejected with 429.
+
+`UploadTicket.stream` reads the request body through these limits and fails
+with 413 as soon as it goes over `UPLOAD_MAX_BODY_BYTES`, nothing is buffered
+first. Rejections carry `Retry-After`. Limits are per process.
+"""
+
+import asyncio
+import math
+import time
+from collections import defaultdict
+from typing import Any, AsyncGenerator, AsyncIterator, Optional
+
+from fastapi import Depends, HTTPException, Request, status
+
+from app import schemas
+from app.api.deps import get_current_active_user
+from app.core import config, metrics
+from app.core.cache import TTLCache
+
+rejected = metrics.REGISTRY.register(
+    metrics.Counter(
+        "upload_admission_rejected_total",
+        "Upload requests rejected by admission control, by reason",
+        ("reason",),
+    )
+)
+
+
+def _reject(
+    status_code: int, reason: str, detail: str, retry_after: Optional[float] = None
+) -> HTTPException:
+    rejected.inc(reason)
+    headers = None
+    if retry_after is not None:
+        headers = {"Retry-After": str(max(math.ceil(retry_after), 1))}
+    return HTTPException(status_code=status_code, detail=detail, headers=headers)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+        return self.tokens
+
+    def take(self, amount: float) -> float:
+        """
+        Take `amount`, going into debt if needed, returns seconds until the
+        bucket is out of debt again
+        """
+        self.tokens = self.refill() - amount
+        return max(-self.tokens / self.rate, 0.0)
+
+
+class UploadAdmission:
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_queued: int,
+        queue_timeout: float,
+        max_per_user: int,
+        user_bytes_per_second: float,
+        user_burst_bytes: float,
+        max_body_bytes: int,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.max_per_user = max_per_user
+        self.user_bytes_per_second = user_bytes_per_second
+        self.user_burst_bytes = user_burst_bytes
+        self.max_body_bytes = max_body_bytes
+        self.active = 0
+        self.queued = 0
+        # Created on first use, on the running event loop
+        self._condition: Optional[asyncio.Condition] = None
+        self._per_user: defaultdict[Any, int] = defaultdict(int)
+        # A bucket left alone this long is full again, same as a new one
+        self._buckets: TTLCache[Any, TokenBucket] = TTLCache(
+            maxsize=100_000,
+            ttl=user_burst_bytes / user_bytes_per_second,
+        )
+
+    @property
+    def _free(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def bucket(self, user_id: Any) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_bytes_per_second, self.user_burst_bytes)
+        # Re-set on every use to push the expiry back
+        self._buckets.set(user_id, bucket)
+        return bucket
+
+    async def acquire(self, user_id: Any) -> None:
+        if self._per_user[user_id] >= self.max_per_user:
+            raise _reject(
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                "user_concurrency",
+                "Too many concurrent uploads",
+                1,
+            )
+        # Reserved before queueing, requests of a user waiting side by side
+        # count against the user's limit too
+        self._per_user[user_id] += 1
+        try:
+            await self._acquire_global(user_id)
+        except BaseException:
+            self._release_user(user_id)
+            raise
+
+    async def _acquire_global(self, user_id: Any) -> None:
+        debt = -self.bucket(user_id).refill()
+        if debt > 0:
+            raise _reject(
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                "user_rate",
+                "Upload quota exceeded",
+                debt / self.user_bytes_per_second,
+            )
+
+        if self.active >= self.max_concurrent:
+            if self.queued >= self.max_queued:
+                raise _reject(
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    "queue_full",
+                    "Too many concurrent uploads",
+                    self.queue_timeout,
+                )
+            self.queued += 1
+            try:
+                async with self._free:
+                    await asyncio.wait_for(
+                        self._free.wait_for(lambda: self.active < self.max_concurrent),
+                        self.queue_timeout,
+                    )
+            except asyncio.TimeoutError:
+                raise _reject(
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    "queue_timeout",
+                    "Too many concurrent uploads",
+                    self.queue_timeout,
+                )
+            finally:
+                self.queued -= 1
+
+        self.active += 1
+
+    def _release_user(self, user_id: Any) -> None:
+        self._per_user[user_id] -= 1
+        if not self._per_user[user_id]:
+            del self._per_user[user_id]
+
+    async def release(self, user_id: Any) -> None:
+        self.active -= 1
+        self._release_user(user_id)
+        async with self._free:
+            self._free.notify()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+        }
+
+
+class UploadTicket:
+    def __init__(self, admission: UploadAdmission, user_id: Any) -> None:
+        self.admission = admission
+        self.user_id = user_id
+        self.received = 0
+
+    async def stream(self, request: Request) -> AsyncIterator[bytes]:
+        """
+        Request body within the size limit and the user's byte rate
+        """
+        bucket = self.admission.bucket(self.user_id)
+        async for chunk in request.stream():
+            self.received += len(chunk)
+            if self.received > self.admission.max_body_bytes:
+                raise _reject(
+                    status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    "body_size",
+                    "Request body too large",
+                )
+            delay = bucket.take(len(chunk))
+            if delay:
+                # Reading slower lets TCP push back on the client
+                await asyncio.sleep(delay)
+            yield chunk
+
+
+admission = UploadAdmission(
+    max_concurrent=config.settings.UPLOAD_MAX_CONCURRENT,
+    max_queued=config.settings.UPLOAD_MAX_QUEUED,
+    queue_timeout=config.settings.UPLOAD_QUEUE_TIMEOUT_SECONDS,
+    max_per_user=config.settings.UPLOAD_MAX_CONCURRENT_PER_USER,
+    user_bytes_per_second=config.settings.UPLOAD_USER_BYTES_PER_SECOND,
+    user_burst_bytes=config.settings.UPLOAD_USER_BURST_BYTES,
+    max_body_bytes=config.settings.UPLOAD_MAX_BODY_BYTES,
+)
+
+for name, documentation, read in [
+    ("upload_admission_active", "Uploads running", lambda: admission.active),
+    ("upload_admission_queued", "Uploads waiting for a slot", lambda: admission.queued),
+]:
+    metrics.REGISTRY.register(metrics.Gauge(name, documentation, function=read))
+
+
+async def admit_upload(
+    request: Request,
+    user: schemas.UserDB = Depends(get_current_active_user),
+) -> AsyncGenerator[UploadTicket, None]:
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit():
+        if int(content_length) > admission.max_body_bytes:
+            raise _reject(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                "body_size",
+                "Request body too large",
+            )
+
+    await admission.acquire(user.id)
+    try:
+        yield UploadTicket(admission, user.id)
+    finally:
+        await admission.release(user.id)
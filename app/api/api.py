@@ -8,22 +8,25 @@ fastapi_users in defined in deps, because it also
 includes useful dependencies.
 """
 
-from typing import Any
-from fastapi import APIRouter, Depends, Form, status
+from fastapi import APIRouter, Depends, Form, HTTPException, Request, status
 from fastapi.responses import RedirectResponse
-
-from fastapi_users.password import get_password_hash
-
-from httpx import AsyncClient
-
-from app.api.deps import fastapi_users, get_session, get_current_user
-from app.core import security
-from app.schemas import Image, UserDB
-from app.tests import utils
+from fastapi.security import OAuth2PasswordRequestForm
+
+from fastapi_users.router import ErrorCode
+from pydantic import EmailStr
+
+from app.api.deps import fastapi_users, get_session, get_user_manager
+from app.api.endpoints import export, images, metrics, stats, uploads
+from app.api.responses import FastJSONResponse
+from app.core import passwords, security
+from app.models import UserTable
+from app.schemas import UserDB
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-
-api_router = APIRouter()
+# Applies to the included routers too, FastAPI Users ones included
+api_router = APIRouter(default_response_class=FastJSONResponse)
 api_router.include_router(
     fastapi_users.get_auth_router(security.AUTH_BACKEND),
     prefix="/auth/jwt",
@@ -40,59 +43,73 @@ api_router.include_router(
     tags=["users"],
 )
 
-client = AsyncClient(base_url="http://localhost:8000/")
+api_router.include_router(images.router, tags=["images"])
+api_router.include_router(export.router, tags=["images"])
+api_router.include_router(uploads.router, tags=["uploads"])
+api_router.include_router(stats.router, tags=["stats"])
+api_router.include_router(metrics.router, tags=["metrics"])
 
 
-# TODO:  
-# Please use multipart/form-data instead of JSON
-@api_router.post("/image", response_model=Image)
-async def post_image(
-    file: Any = Form(...),
-    session: AsyncSession = Depends(get_session),
+def _home(access_token: str) -> RedirectResponse:
+    return RedirectResponse(
+        url=f"/home?token={access_token}", status_code=status.HTTP_303_SEE_OTHER
+    )
+
+
+@api_router.post("/login")
+async def login(
+    email: EmailStr = Form(...),
+    password: str = Form(...),
+    user_manager: security.UserManager = Depends(get_user_manager),
 ):
     """
-    Insert image in db
+    Login an existing user, form counterpart of `/auth/jwt/login`
     """
 
-    raise NotImplementedError("Please remove this statement after implementing this function")
+    user = await user_manager.authenticate(
+        OAuth2PasswordRequestForm(username=email, password=password, scope="")
+    )
+    if user is None or not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorCode.LOGIN_BAD_CREDENTIALS,
+        )
+
+    access_token = await security.get_jwt_strategy().write_token(user)
+    return _home(access_token)
 
-@api_router.post("/login", response_model=UserDB)
-async def login():
-    """
-    Login an existing user
-    """
-    
-    raise NotImplementedError("Please remove this statement after implementing this function")
 
 @api_router.post("/signup")
 async def signup(
-    email: Any = Form(...),
-    password: Any = Form(...),
+    request: Request,
+    email: EmailStr = Form(...),
+    password: str = Form(...),
     session: AsyncSession = Depends(get_session),
+    user_manager: security.UserManager = Depends(get_user_manager),
 ):
     """
     Create a user and login
-    """
-    
-    try:
-        await utils.create_db_user(email=email, hashed_password=get_password_hash(password), session=session)
-    except Exception as e:
-        pass
-    
-    access_token_res = await client.post(
-        "/auth/jwt/login",
-        data={
-            "username": email,
-            "password": password,
-        },
-        headers={"Content-Type": "application/x-www-form-urlencoded"},
-    )
-
-    token = access_token_res.json()
-    access_token = token["access_token"]
-
-    return RedirectResponse(url=f'/home?token={access_token}', status_code=status.HTTP_303_SEE_OTHER,)
-
-
 
+    The user is written with a single INSERT .. ON CONFLICT DO NOTHING, on
+    the email without case as FastAPI Users compares it, and the access
+    token is issued in-process, there is no second trip through
+    `/auth/jwt/login`.
+    """
 
+    user = UserDB(email=email, hashed_password=await passwords.hash_password(password))
+    result = await session.execute(
+        insert(UserTable)
+        .values(**user.dict())
+        .on_conflict_do_nothing(index_elements=[func.lower(UserTable.email)])
+        .returning(UserTable.id)
+    )
+    if result.scalar() is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ErrorCode.REGISTER_USER_ALREADY_EXISTS,
+        )
+    await session.commit()
+    await user_manager.on_after_register(user, request)
+
+    access_token = await security.get_jwt_strategy().write_token(user)
+    return _home(access_token)
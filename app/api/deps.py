@@ -1,26 +1,79 @@
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Awaitable, Optional, TypeVar
 
-from fastapi import Depends
+from fastapi import Depends, Request
 from fastapi.security import OAuth2PasswordBearer
 from fastapi_users.fastapi_users import FastAPIUsers
 from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
-from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import schemas
+from app.api.middleware import PRIMARY_UNTIL_COOKIE
 from app.core import security
 from app.models import UserTable
-from app.session import async_session
+from app.session import EngineRouter, ReleasingSession, async_session, get_router
+
+T = TypeVar("T")
 
 reusable_oauth2 = OAuth2PasswordBearer(tokenUrl="auth/access-token")
 
+READ_ONLY_METHODS = frozenset(["GET", "HEAD"])
+
+
+def primary_until(request: Request) -> float:
+    try:
+        return float(request.cookies.get(PRIMARY_UNTIL_COOKIE, 0))
+    except ValueError:
+        return 0
 
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session() as session:
+
+async def get_session(
+    request: Request, router: EngineRouter = Depends(get_router)
+) -> AsyncGenerator[ReleasingSession, None]:
+    """
+    Session on a replica for GET and HEAD, unless the client wrote recently,
+    on the primary for everything else
+    """
+    if request.method in READ_ONLY_METHODS:
+        bind = router.reader(primary_until(request))
+    else:
+        bind = router.primary
+        if router.replicas:
+            # Sent back in the cookie, see ReadYourWritesMiddleware
+            request.state.read_your_writes_seconds = router.read_your_writes_seconds
+    # No connection is checked out until the first statement
+    async with async_session(bind=bind) as session:
         yield session
 
 
-async def get_user_db(session: AsyncSession = Depends(get_session)):
-    yield SQLAlchemyUserDatabase(schemas.UserDB, session, UserTable)
+class ReleasingUserDatabase(SQLAlchemyUserDatabase):
+    """
+    User lookups (authentication of every request) give the connection back
+    right away instead of holding it until the end of the request.
+    """
+
+    session: ReleasingSession
+
+    async def _lookup(self, lookup: Awaitable[T]) -> T:
+        owns_transaction = not self.session.in_transaction()
+        try:
+            return await lookup
+        finally:
+            if owns_transaction:
+                await self.session.release()
+
+    async def get(self, id) -> Optional[schemas.UserDB]:
+        return await self._lookup(super().get(id))
+
+    async def get_by_email(self, email: str) -> Optional[schemas.UserDB]:
+        return await self._lookup(super().get_by_email(email))
+
+    async def get_by_oauth_account(
+        self, oauth: str, account_id: str
+    ) -> Optional[schemas.UserDB]:
+        return await self._lookup(super().get_by_oauth_account(oauth, account_id))
+
+
+async def get_user_db(session: ReleasingSession = Depends(get_session)):
+    yield ReleasingUserDatabase(schemas.UserDB, session, UserTable)
 
 
 async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
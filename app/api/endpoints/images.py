@@ -0,0 +1,387 @@
+"""
+Image upload and retrieval.
+
+Image bytes are kept in the content-addressed blob store
+(see `app/core/storage.py`), `image` rows only hold metadata, including
+dimensions and capture time read from the file headers at upload.
+Resized variants are rendered and cached by `app/core/transform.py`.
+"""
+
+import asyncio
+from datetime import datetime
+from enum import Enum
+from typing import Any, Optional
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from sqlalchemy import delete, insert, select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import schemas
+from app.api.admission import UploadTicket, admit_upload
+from app.api.deps import get_current_active_user, get_session
+from app.api.multipart import ChunkPipe, MultipartStream
+from app.api.responses import (
+    BLOB_CACHE_CONTROL,
+    FastJSONResponse,
+    blob_response,
+    etag_matches,
+)
+from app.blobs import add_references, release_reference, reserve_blob
+from app.core import config
+from app.core.imageinfo import HeaderSniffer, ImageInfo
+from app.core.storage import BlobStore, StoredBlob, get_blob_store
+from app.core.transform import (
+    MAX_DIMENSION,
+    Fit,
+    OutputFormat,
+    TransformError,
+    TransformSpec,
+    derivatives,
+    negotiate_format,
+)
+from app.jobs import enqueue
+from app.models import Image
+from app.session import ReleasingSession
+from app.tasks import PRERENDER
+
+router = APIRouter()
+
+IMAGE_COLUMNS = (
+    Image.id,
+    Image.title,
+    Image.digest,
+    Image.size,
+    Image.mime_type,
+    Image.width,
+    Image.height,
+    Image.orientation,
+    Image.taken_at,
+    Image.user_id,
+)
+
+
+class Shape(str, Enum):
+    landscape = "landscape"
+    portrait = "portrait"
+    square = "square"
+
+
+async def _put_piped(
+    store: BlobStore, pipe: ChunkPipe, semaphore: asyncio.Semaphore
+) -> tuple[StoredBlob, Optional[ImageInfo]]:
+    sniffer = HeaderSniffer()
+    try:
+        # A part failing later leaves the earlier ones to the garbage collection
+        blob = await store.put(sniffer.tap(pipe.chunks()), reserve=reserve_blob)
+    except Exception:
+        await pipe.discard()
+        raise
+    finally:
+        semaphore.release()
+    return blob, sniffer.info()
+
+
+def new_image(
+    title: Optional[str],
+    mime_type: str,
+    blob: StoredBlob,
+    info: Optional[ImageInfo],
+) -> schemas.ImageCreate:
+    return schemas.ImageCreate(
+        title=title,
+        timestamp=info.taken_at if info else None,
+        digest=blob.digest,
+        size=blob.size,
+        # Trust the content over the client declared type
+        mime_type=info.mime_type if info else mime_type,
+        width=info.width if info else None,
+        height=info.height if info else None,
+        orientation=info.orientation if info else None,
+    )
+
+
+async def insert_images(
+    session: AsyncSession, user_id: Any, images: list[schemas.ImageCreate]
+) -> list[Row]:
+    """
+    Insert images of stored blobs with one statement and queue their
+    post-upload jobs, in the caller's transaction
+    """
+    # Identical content is stored once, images share it by digest
+    sizes = {image.digest: image.size for image in images}
+    await add_references(
+        session,
+        [StoredBlob(digest=image.digest, size=image.size) for image in images],
+    )
+    result = await session.execute(
+        insert(Image)
+        .values(
+            [
+                {
+                    "title": image.title,
+                    "digest": image.digest,
+                    "size": image.size,
+                    "mime_type": image.mime_type,
+                    "width": image.width,
+                    "height": image.height,
+                    "orientation": image.orientation,
+                    "taken_at": image.timestamp,
+                    "user_id": user_id,
+                }
+                for image in images
+            ]
+        )
+        .returning(*IMAGE_COLUMNS)
+    )
+    if config.settings.TRANSFORM_PRERENDER_WIDTHS:
+        # Rendered by app/worker.py, after the response
+        await enqueue(
+            session,
+            [
+                (PRERENDER, {"digest": digest, "size": size})
+                for digest, size in sizes.items()
+            ],
+        )
+    return result.all()
+
+
+@router.post("/image", response_model=list[schemas.Image])
+async def post_image(
+    request: Request,
+    user: schemas.UserDB = Depends(get_current_active_user),
+    ticket: UploadTicket = Depends(admit_upload),
+    session: AsyncSession = Depends(get_session),
+    store: BlobStore = Depends(get_blob_store),
+):
+    """
+    Insert images, expects multipart/form-data with one or more `file`
+    parts and optional `title`.
+
+    Every file is streamed straight into the blob store, while one file is
+    being flushed the next one is already read (up to `UPLOAD_CONCURRENCY`
+    files in flight). Rows for all files are inserted with one statement,
+    files whose content is already stored only add a reference to it.
+
+    Format, dimensions, EXIF orientation and capture time are parsed from
+    the first bytes of each file as it streams by, pixels are never decoded.
+    Resized variants are rendered later by a background job.
+
+    Subject to upload admission control (`app/api/admission.py`).
+    """
+
+    title: Optional[str] = None
+    semaphore = asyncio.Semaphore(config.settings.UPLOAD_CONCURRENCY)
+    uploads: list[tuple[str, str, asyncio.Task]] = []
+
+    try:
+        async for part in MultipartStream(request, ticket.stream(request)):
+            if part.name == "title" and part.filename is None:
+                title = await part.text()
+            elif part.name == "file" and part.filename is not None:
+                if not part.content_type.startswith("image/"):
+                    raise HTTPException(
+                        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                        detail=f"Unsupported file type: {part.content_type}",
+                    )
+                await semaphore.acquire()
+                pipe = ChunkPipe()
+                task = asyncio.create_task(_put_piped(store, pipe, semaphore))
+                uploads.append((part.filename, part.content_type, task))
+                await pipe.feed(part)
+        stored = await asyncio.gather(*(task for _, _, task in uploads))
+    except BaseException:
+        for _, _, task in uploads:
+            task.cancel()
+        raise
+
+    if not stored:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="No file uploaded"
+        )
+
+    images = await insert_images(
+        session,
+        user.id,
+        [
+            new_image(title or filename, mime_type, blob, info)
+            for (filename, mime_type, _), (blob, info) in zip(uploads, stored)
+        ],
+    )
+    await session.commit()
+    # Rows already have the response_model shape
+    return FastJSONResponse(images)
+
+
+@router.api_route("/image/{image_id}", methods=["GET", "HEAD"])
+async def get_image(
+    image_id: int,
+    request: Request,
+    user: schemas.UserDB = Depends(get_current_active_user),
+    session: ReleasingSession = Depends(get_session),
+    store: BlobStore = Depends(get_blob_store),
+):
+    """
+    Image bytes, supports Range requests and If-None-Match revalidation
+    """
+
+    result = await session.execute(
+        select(Image.user_id, Image.digest, Image.size, Image.mime_type).where(
+            Image.id == image_id
+        )
+    )
+    image = result.first()
+    # Do not hold the connection while the bytes are being sent
+    await session.release()
+    if image is None or (image.user_id != user.id and not user.is_superuser):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if image.digest is None:
+        # Never had content
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    return blob_response(request, store, image.digest, image.size, image.mime_type)
+
+
+@router.get("/image/{image_id}/transform")
+async def transform_image(
+    image_id: int,
+    request: Request,
+    width: Optional[int] = Query(None, ge=1, le=MAX_DIMENSION),
+    height: Optional[int] = Query(None, ge=1, le=MAX_DIMENSION),
+    fit: Fit = Query(Fit.contain),
+    format: Optional[OutputFormat] = Query(
+        None, description="Negotiated from `Accept` when omitted"
+    ),
+    user: schemas.UserDB = Depends(get_current_active_user),
+    session: ReleasingSession = Depends(get_session),
+    store: BlobStore = Depends(get_blob_store),
+):
+    """
+    Image resized to `width` and/or `height` and encoded as `format`.
+
+    Renders run in a process pool, results are cached in memory and on disk
+    so every variant is encoded once.
+    """
+
+    if width is None and height is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Expected width and/or height",
+        )
+
+    result = await session.execute(
+        select(Image.user_id, Image.digest, Image.size, Image.mime_type).where(
+            Image.id == image_id
+        )
+    )
+    image = result.first()
+    await session.release()
+    if image is None or (image.user_id != user.id and not user.is_superuser):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if image.digest is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    headers = {"cache-control": BLOB_CACHE_CONTROL}
+    if format is None:
+        format = negotiate_format(request.headers.get("accept", ""), image.mime_type)
+        if format is None:
+            raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE)
+        headers["vary"] = "Accept"
+
+    spec = TransformSpec(width=width, height=height, fit=fit, format=format)
+    key = spec.cache_key(image.digest)
+    headers["etag"] = f'"{key}"'
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(headers["etag"], if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        content = await derivatives.get(
+            key,
+            lambda: derivatives.render_blob(store, image.digest, image.size, spec),
+        )
+    except TransformError:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Image can not be decoded",
+        )
+    return Response(content, media_type=format.media_type, headers=headers)
+
+
+@router.delete("/image/{image_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_image(
+    image_id: int,
+    user: schemas.UserDB = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Delete image, its content goes away once no other image shares it
+    """
+
+    query = delete(Image).where(Image.id == image_id)
+    if not user.is_superuser:
+        query = query.where(Image.user_id == user.id)
+    result = await session.execute(query.returning(Image.digest))
+    image = result.first()
+    if image is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    if image.digest is not None:
+        await release_reference(session, image.digest)
+    await session.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get("/images", response_model=schemas.ImagePage)
+async def list_images(
+    before: Optional[int] = Query(None, description="`next_cursor` of previous page"),
+    limit: int = Query(50, ge=1, le=200),
+    taken_since: Optional[datetime] = Query(None),
+    taken_until: Optional[datetime] = Query(None),
+    shape: Optional[Shape] = Query(None),
+    user: schemas.UserDB = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Metadata of the current user's images, newest first, optionally only
+    those captured in [`taken_since`, `taken_until`) and of a given shape.
+
+    Keyset pagination on (user_id, id), every page is a range scan of
+    `ix_image_user_id_id` no matter how deep it is. Capture time filters
+    can use `ix_image_user_id_taken_at` instead.
+    """
+
+    query = (
+        select(*IMAGE_COLUMNS)
+        .where(Image.user_id == user.id)
+        .order_by(Image.id.desc())
+        .limit(limit + 1)
+    )
+    if before is not None:
+        query = query.where(Image.id < before)
+    if taken_since is not None:
+        query = query.where(Image.taken_at >= taken_since)
+    if taken_until is not None:
+        query = query.where(Image.taken_at < taken_until)
+    if shape == Shape.landscape:
+        query = query.where(Image.width > Image.height)
+    elif shape == Shape.portrait:
+        query = query.where(Image.width < Image.height)
+    elif shape == Shape.square:
+        query = query.where(Image.width == Image.height)
+
+    rows = (await session.execute(query)).all()
+    items = rows[:limit]
+    # Encoded straight from the rows, validating every item against
+    # schemas.Image would cost more than the query
+    return FastJSONResponse(
+        {"items": items, "next_cursor": items[-1].id if len(rows) > limit else None}
+    )
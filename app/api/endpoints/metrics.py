@@ -0,0 +1,75 @@
+"""
+Prometheus scrape endpoint.
+
+Off unless `METRICS_ENABLED` is set. It does not take user tokens, so
+Prometheus can scrape it: set `METRICS_TOKEN` (Prometheus `bearer_token`)
+or restrict the path in the proxy in front of the app.
+"""
+
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+
+from app.core import config
+from app.core.metrics import REGISTRY, Counter, Gauge
+from app.core.passwords import hasher
+from app.core.security import user_cache
+from app.session import pool_stats
+
+router = APIRouter()
+
+for name, documentation, read in [
+    (
+        "db_pool_checked_out",
+        "Connections in use",
+        lambda: pool_stats()["checked_out"],
+    ),
+    ("db_pool_size", "Connections kept open", lambda: pool_stats()["size"]),
+    ("password_hash_queued", "Password operations waiting", lambda: hasher.queued),
+]:
+    REGISTRY.register(Gauge(name, documentation, function=read))
+
+for name, documentation, read in [
+    (
+        "db_pool_checkout_timeouts_total",
+        "Checkouts that timed out waiting for a connection",
+        lambda: pool_stats()["timeouts"],
+    ),
+    (
+        "password_hash_rejected_total",
+        "Password operations rejected with 503",
+        lambda: hasher.rejected,
+    ),
+    (
+        "auth_cache_hits_total",
+        "Token lookups served from cache",
+        lambda: user_cache.hits,
+    ),
+    (
+        "auth_cache_misses_total",
+        "Token lookups missing the cache",
+        lambda: user_cache.misses,
+    ),
+]:
+    REGISTRY.register(Counter(name, documentation, function=read))
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """
+    Metrics of this process in the Prometheus text format
+    """
+
+    if not config.settings.METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    token = config.settings.METRICS_TOKEN
+    if token and not secrets.compare_digest(
+        (authorization or "").encode(), f"Bearer {token}".encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
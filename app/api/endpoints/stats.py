@@ -0,0 +1,31 @@
+"""
+Live runtime statistics of this process, for superusers.
+"""
+
+from fastapi import APIRouter, Depends
+
+from app import schemas
+from app.api.admission import admission
+from app.api.deps import get_current_superuser
+from app.core.passwords import hasher
+from app.core.security import user_cache
+from app.core.transform import derivatives
+from app.session import pool_stats
+
+router = APIRouter()
+
+
+@router.get("/stats")
+async def get_stats(user: schemas.UserDB = Depends(get_current_superuser)):
+    """
+    Database pool, password hasher, auth cache, image transform and upload
+    admission usage
+    """
+
+    return {
+        "db_pool": pool_stats(),
+        "password_hasher": hasher.stats(),
+        "auth_cache": user_cache.stats(),
+        "image_transforms": derivatives.stats(),
+        "upload_admission": admission.stats(),
+    }
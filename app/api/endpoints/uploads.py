@@ -0,0 +1,380 @@
+"""
+Resumable uploads, following the tus 1.0 protocol (https://tus.io):
+
+- `POST /uploads` with `Upload-Length` and `Upload-Metadata` (`filename`,
+  `filetype`, optional `title` and `sha256`, the hex digest of the whole
+  file) creates an upload, its URL is in `Location`
+- `PATCH /uploads/{id}` with `Upload-Offset` appends the body at that offset,
+  `HEAD /uploads/{id}` tells how much arrived so far
+- `POST /uploads/{id}/finalize` turns a complete upload into an image
+
+A dropped `PATCH` keeps what arrived, the client asks `HEAD` for the offset
+and sends only the rest. With `Upload-Checksum: sha256 <base64>` a `PATCH` is
+kept only if it arrived whole and matches. Bytes are appended to the upload
+staging area (`app/core/storage.py`), idle uploads expire, see `app/uploads.py`.
+"""
+
+import base64
+import binascii
+import string
+import uuid
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.engine import Row
+
+from app import schemas
+from app.api.admission import UploadTicket, admit_upload
+from app.api.deps import get_current_active_user, get_session
+from app.api.endpoints.images import insert_images, new_image
+from app.api.responses import FastJSONResponse
+from app.blobs import reserve_blob
+from app.core import config
+from app.core.imageinfo import HeaderSniffer
+from app.core.storage import (
+    BlobStore,
+    ChecksumMismatch,
+    StagingLocked,
+    UploadStaging,
+    get_blob_store,
+    get_upload_staging,
+)
+from app.models import Upload
+from app.session import ReleasingSession
+
+router = APIRouter()
+
+TUS_VERSION = "1.0.0"
+# Not a registered status, defined by the tus checksum extension
+HTTP_460_CHECKSUM_MISMATCH = 460
+
+
+def _expires(updated_at: datetime) -> str:
+    return format_datetime(
+        updated_at + timedelta(seconds=config.settings.UPLOAD_EXPIRE_SECONDS),
+        usegmt=True,
+    )
+
+
+def _headers(upload: Row) -> dict[str, str]:
+    return {
+        "Tus-Resumable": TUS_VERSION,
+        "Upload-Offset": str(upload.received),
+        "Upload-Length": str(upload.length),
+        "Upload-Expires": _expires(upload.updated_at),
+        "Cache-Control": "no-store",
+    }
+
+
+def parse_metadata(header: str) -> dict[str, str]:
+    """
+    `Upload-Metadata`, comma separated keys each followed by a space and
+    the base64 of its value
+    """
+    metadata = {}
+    for pair in header.split(","):
+        key, _, value = pair.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value, validate=True).decode()
+        except (binascii.Error, UnicodeDecodeError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid Upload-Metadata value for {key}",
+            )
+    return metadata
+
+
+def parse_checksum(header: str) -> bytes:
+    algorithm, _, value = header.partition(" ")
+    if algorithm != "sha256":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload-Checksum supports sha256 only",
+        )
+    try:
+        return base64.b64decode(value, validate=True)
+    except binascii.Error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Upload-Checksum"
+        )
+
+
+async def _get_upload(
+    session: ReleasingSession, upload_id: str, user: schemas.UserDB
+) -> Row:
+    result = await session.execute(
+        select(
+            Upload.user_id,
+            Upload.length,
+            Upload.received,
+            Upload.filename,
+            Upload.mime_type,
+            Upload.title,
+            Upload.checksum,
+            Upload.updated_at,
+        ).where(Upload.id == upload_id)
+    )
+    upload = result.first()
+    # Uploads are short lived and the client's own, nothing for superusers
+    if upload is None or upload.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return upload
+
+
+@router.post("/uploads", status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    upload_length: int = Header(...),
+    upload_metadata: str = Header(""),
+    user: schemas.UserDB = Depends(get_current_active_user),
+    session: ReleasingSession = Depends(get_session),
+    staging: UploadStaging = Depends(get_upload_staging),
+):
+    """
+    Start a resumable upload of `Upload-Length` bytes
+    """
+
+    if not 0 < upload_length <= config.settings.UPLOAD_RESUMABLE_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Invalid Upload-Length",
+        )
+    metadata = parse_metadata(upload_metadata)
+    mime_type = metadata.get("filetype", "")
+    if not mime_type.startswith("image/"):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported file type: {mime_type}",
+        )
+    checksum = metadata.get("sha256")
+    if checksum is not None and (
+        len(checksum) != 64 or not set(checksum) <= set(string.hexdigits)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid sha256"
+        )
+
+    upload_id = uuid.uuid4().hex
+    # File first, a file without a row is cleaned up, a row without one is not
+    await staging.create(upload_id)
+    result = await session.execute(
+        insert(Upload)
+        .values(
+            id=upload_id,
+            user_id=user.id,
+            length=upload_length,
+            filename=metadata.get("filename"),
+            mime_type=mime_type,
+            title=metadata.get("title"),
+            checksum=checksum and checksum.lower(),
+        )
+        .returning(Upload.length, Upload.received, Upload.updated_at)
+    )
+    upload = result.one()
+    await session.commit()
+    return Response(
+        status_code=status.HTTP_201_CREATED,
+        headers={**_headers(upload), "Location": f"/uploads/{upload_id}"},
+    )
+
+
+@router.head("/uploads/{upload_id}")
+async def get_upload_offset(
+    upload_id: str,
+    user: schemas.UserDB = Depends(get_current_active_user),
+    session: ReleasingSession = Depends(get_session),
+):
+    """
+    Bytes received so far in `Upload-Offset`
+    """
+
+    upload = await _get_upload(session, upload_id, user)
+    return Response(headers=_headers(upload))
+
+
+@router.patch("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    upload_checksum: Optional[str] = Header(None),
+    content_type: str = Header(...),
+    user: schemas.UserDB = Depends(get_current_active_user),
+    ticket: UploadTicket = Depends(admit_upload),
+    session: ReleasingSession = Depends(get_session),
+    staging: UploadStaging = Depends(get_upload_staging),
+):
+    """
+    Append the body, expects `application/offset+octet-stream` and
+    `Upload-Offset` equal to the bytes received so far.
+
+    Subject to upload admission control (`app/api/admission.py`).
+    """
+
+    if content_type != "application/offset+octet-stream":
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    expected_digest = parse_checksum(upload_checksum) if upload_checksum else None
+    upload = await _get_upload(session, upload_id, user)
+    await session.release()
+
+    try:
+        async with staging.open(upload_id) as staged:
+            # Only now is the offset stable, appends commit it before unlocking
+            result = await session.execute(
+                select(Upload.received).where(Upload.id == upload_id)
+            )
+            received = result.scalar()
+            await session.release()
+            if received is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+            if received != upload_offset:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Upload-Offset does not match",
+                    headers={"Upload-Offset": str(received)},
+                )
+
+            # Drops bytes a crashed request wrote but did not commit
+            await staged.seek(upload_offset)
+            complete = False
+            try:
+                async for chunk in ticket.stream(request):
+                    if staged.offset + len(chunk) > upload.length:
+                        raise HTTPException(
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail="Body goes past Upload-Length",
+                        )
+                    await staged.write(chunk)
+                await staged.flush()
+                if (
+                    expected_digest is not None
+                    and staged.hasher.digest() != expected_digest
+                ):
+                    raise HTTPException(
+                        status_code=HTTP_460_CHECKSUM_MISMATCH,
+                        detail="Checksum mismatch",
+                    )
+                complete = True
+            finally:
+                if complete or expected_digest is None:
+                    # Keep what arrived, the client resumes from there
+                    await staged.flush()
+                else:
+                    await staged.seek(upload_offset)
+                result = await session.execute(
+                    update(Upload)
+                    .where(Upload.id == upload_id)
+                    .values(received=staged.offset, updated_at=func.now())
+                    .returning(Upload.length, Upload.received, Upload.updated_at)
+                )
+                upload = result.first()
+                await session.commit()
+    except StagingLocked:
+        raise HTTPException(
+            status_code=status.HTTP_423_LOCKED,
+            detail="Upload is being written by another request",
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    if upload is None:
+        # Deleted while appending
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    headers = _headers(upload)
+    del headers["Upload-Length"]
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=headers)
+
+
+@router.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_upload(
+    upload_id: str,
+    user: schemas.UserDB = Depends(get_current_active_user),
+    session: ReleasingSession = Depends(get_session),
+    staging: UploadStaging = Depends(get_upload_staging),
+):
+    """
+    Abandon an upload and drop what was received
+    """
+
+    result = await session.execute(
+        delete(Upload)
+        .where(Upload.id == upload_id, Upload.user_id == user.id)
+        .returning(Upload.id)
+    )
+    if result.scalar() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    await session.commit()
+    await staging.delete(upload_id)
+    return Response(
+        status_code=status.HTTP_204_NO_CONTENT,
+        headers={"Tus-Resumable": TUS_VERSION},
+    )
+
+
+@router.post("/uploads/{upload_id}/finalize", response_model=schemas.Image)
+async def finalize_upload(
+    upload_id: str,
+    user: schemas.UserDB = Depends(get_current_active_user),
+    session: ReleasingSession = Depends(get_session),
+    staging: UploadStaging = Depends(get_upload_staging),
+    store: BlobStore = Depends(get_blob_store),
+):
+    """
+    Move a complete upload into the blob store and insert its image.
+
+    The content is hashed on the way, an upload created with `sha256` that
+    does not match is dropped with 422.
+    """
+
+    upload = await _get_upload(session, upload_id, user)
+    await session.release()
+    if upload.received != upload.length:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload is incomplete",
+            headers={"Upload-Offset": str(upload.received)},
+        )
+
+    sniffer = HeaderSniffer()
+    try:
+        blob = await store.put(
+            sniffer.tap(staging.stream(upload_id, upload.length)),
+            upload.checksum,
+            reserve=reserve_blob,
+        )
+    except ChecksumMismatch:
+        await session.execute(delete(Upload).where(Upload.id == upload_id))
+        await session.commit()
+        await staging.delete(upload_id)
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Checksum mismatch, upload the file again",
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    # Whoever deletes the row finalizes, a concurrent finalize gets 404
+    result = await session.execute(
+        delete(Upload).where(Upload.id == upload_id).returning(Upload.id)
+    )
+    if result.scalar() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    [image] = await insert_images(
+        session,
+        user.id,
+        [
+            new_image(
+                upload.title or upload.filename,
+                upload.mime_type,
+                blob,
+                sniffer.info(),
+            )
+        ],
+    )
+    await session.commit()
+    await staging.delete(upload_id)
+    return FastJSONResponse(image)
@@ -0,0 +1,103 @@
+"""
+ASGI middleware timing every HTTP request, and the read-your-writes cookie.
+
+Adds a `Server-Timing` header with the auth / db / serialization breakdown
+and the total time until the response started, and records the request in
+the Prometheus metrics of `app/core/metrics.py`. Routes are labelled by
+their path template (`/image/{image_id}`), unmatched paths all share the
+`unmatched` label.
+
+`ReadYourWritesMiddleware` sets the `primary_until` cookie on responses to
+requests that had a session on the primary while read replicas are in use,
+the client's reads go to the primary until then (see `app/session.py`).
+The cookie is shared by all processes, unlike anything kept in one of them.
+"""
+
+import math
+import time
+from typing import Callable
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core import metrics
+
+PRIMARY_UNTIL_COOKIE = "primary_until"
+
+
+class TimingMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._route_paths: dict[Callable, str] = {}
+
+    def route_label(self, scope: Scope) -> str:
+        # Set by the router once a route matched
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if not self._route_paths:
+            self._route_paths = {
+                route.endpoint: route.path
+                for route in scope["app"].routes
+                if hasattr(route, "endpoint")
+            }
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        timing = metrics.RequestTiming()
+        token = metrics.current_timing.set(timing)
+        start = time.perf_counter()
+        status = 500
+        metrics.requests_in_progress.inc(method)
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - start
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timing.server_timing(elapsed))
+
+                route = self.route_label(scope)
+                metrics.request_duration.observe(elapsed, method, route)
+                for phase, seconds in timing.phases.items():
+                    metrics.request_phase_duration.observe(seconds, route, phase)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            metrics.requests_in_progress.dec(method)
+            metrics.requests_total.inc(method, self.route_label(scope), str(status))
+            metrics.current_timing.reset(token)
+
+
+class ReadYourWritesMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            # Set by app.api.deps.get_session
+            seconds = scope.get("state", {}).get("read_your_writes_seconds")
+            if message["type"] == "http.response.start" and seconds:
+                # Counted from the response, the write is committed by now
+                until = time.time() + seconds
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Set-Cookie",
+                    f"{PRIMARY_UNTIL_COOKIE}={until:.3f}; Max-Age={math.ceil(seconds)};"
+                    " Path=/; HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -0,0 +1,238 @@
+"""
+Streaming `multipart/form-data` reader.
+
+FastAPI `Form(...)` / `File(...)` parameters make Starlette parse the whole
+body (spooling files to temporary storage) before the endpoint runs.
+`MultipartStream` instead feeds `request.stream()` chunks to the
+`python-multipart` push parser and hands every part to the caller as soon
+as its headers are known, so file contents can be consumed chunk by chunk:
+
+    async for part in MultipartStream(request):
+        if part.filename is None:
+            title = await part.text()
+        else:
+            blob = await store.put(part.chunks())
+
+Parts that are not consumed are skipped automatically.
+
+`ChunkPipe` lets a part be consumed by another task, so the reader can move
+on to the next part while the previous one is still being stored.
+"""
+
+import asyncio
+from enum import Enum
+from typing import AsyncGenerator, AsyncIterator, Optional
+
+from fastapi import HTTPException, Request, status
+from multipart import multipart
+
+# Plain form fields are read into memory, so keep them small
+MAX_FIELD_SIZE = 64 * 1024
+# Chunks buffered between the request reader and a pipe consumer
+PIPE_DEPTH = 16
+
+
+class _Message(Enum):
+    PART_BEGIN = 1
+    PART_DATA = 2
+    PART_END = 3
+    HEADER_FIELD = 4
+    HEADER_VALUE = 5
+    HEADER_END = 6
+    HEADERS_FINISHED = 7
+    END = 8
+
+
+def _safe_decode(src: bytes, codec: str) -> str:
+    try:
+        return src.decode(codec)
+    except (UnicodeDecodeError, LookupError):
+        return src.decode("latin-1")
+
+
+class FormPart:
+    """
+    Single part of a multipart body. `filename` is None for plain fields.
+    """
+
+    def __init__(
+        self,
+        stream: "MultipartStream",
+        name: str,
+        filename: Optional[str],
+        content_type: str,
+    ) -> None:
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self._stream = stream
+        self._finished = False
+
+    async def chunks(self) -> AsyncGenerator[bytes, None]:
+        """
+        Yield the part body as it arrives from the client
+        """
+        if self._finished:
+            return
+        async for message_type, data in self._stream._events:
+            if message_type == _Message.PART_DATA:
+                yield data
+            elif message_type == _Message.PART_END:
+                self._finished = True
+                return
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Truncated multipart body",
+        )
+
+    async def read(self, limit: int = MAX_FIELD_SIZE) -> bytes:
+        data = bytearray()
+        async for chunk in self.chunks():
+            data += chunk
+            if len(data) > limit:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Form field '{self.name}' is too large",
+                )
+        return bytes(data)
+
+    async def text(self, limit: int = MAX_FIELD_SIZE) -> str:
+        return _safe_decode(await self.read(limit), self._stream.charset)
+
+    async def drain(self) -> None:
+        async for _ in self.chunks():
+            pass
+
+
+class MultipartStream:
+    def __init__(
+        self, request: Request, stream: Optional[AsyncIterator[bytes]] = None
+    ) -> None:
+        content_type, params = multipart.parse_options_header(
+            request.headers.get("Content-Type", "")
+        )
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail="Expected multipart/form-data",
+            )
+        charset = params.get(b"charset", b"utf-8")
+        self.charset = charset.decode("latin-1")
+        self.boundary = params[b"boundary"]
+        self.request = request
+        # Body chunks, e.g. through admission control limits
+        self.stream = request.stream() if stream is None else stream
+        self._messages: list[tuple[_Message, bytes]] = []
+        self._events = self._iter_events()
+
+    def _callbacks(self) -> dict:
+        def emit(message_type: _Message):
+            def on_event() -> None:
+                self._messages.append((message_type, b""))
+
+            return on_event
+
+        def emit_data(message_type: _Message):
+            def on_data(data: bytes, start: int, end: int) -> None:
+                self._messages.append((message_type, data[start:end]))
+
+            return on_data
+
+        return {
+            "on_part_begin": emit(_Message.PART_BEGIN),
+            "on_part_data": emit_data(_Message.PART_DATA),
+            "on_part_end": emit(_Message.PART_END),
+            "on_header_field": emit_data(_Message.HEADER_FIELD),
+            "on_header_value": emit_data(_Message.HEADER_VALUE),
+            "on_header_end": emit(_Message.HEADER_END),
+            "on_headers_finished": emit(_Message.HEADERS_FINISHED),
+            "on_end": emit(_Message.END),
+        }
+
+    async def _iter_events(self) -> AsyncGenerator[tuple[_Message, bytes], None]:
+        parser = multipart.MultipartParser(self.boundary, self._callbacks())
+        async for chunk in self.stream:
+            try:
+                parser.write(chunk)
+            except multipart.MultipartParseError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Malformed multipart body: {e}",
+                )
+            messages = list(self._messages)
+            self._messages.clear()
+            for message in messages:
+                yield message
+        parser.finalize()
+
+    async def __aiter__(self) -> AsyncGenerator[FormPart, None]:
+        header_field = b""
+        header_value = b""
+        content_disposition = b""
+        content_type = b""
+
+        async for message_type, data in self._events:
+            if message_type == _Message.PART_BEGIN:
+                content_disposition = b""
+                content_type = b""
+            elif message_type == _Message.HEADER_FIELD:
+                header_field += data
+            elif message_type == _Message.HEADER_VALUE:
+                header_value += data
+            elif message_type == _Message.HEADER_END:
+                field = header_field.lower()
+                if field == b"content-disposition":
+                    content_disposition = header_value
+                elif field == b"content-type":
+                    content_type = header_value
+                header_field = b""
+                header_value = b""
+            elif message_type == _Message.HEADERS_FINISHED:
+                _, options = multipart.parse_options_header(content_disposition)
+                filename = options.get(b"filename")
+                part = FormPart(
+                    self,
+                    name=_safe_decode(options.get(b"name", b""), self.charset),
+                    filename=(
+                        None
+                        if filename is None
+                        else _safe_decode(filename, self.charset)
+                    ),
+                    content_type=content_type.decode("latin-1"),
+                )
+                yield part
+                await part.drain()
+
+
+class ChunkPipe:
+    """
+    Bounded queue of chunks between the request reader and a consumer task.
+    `close` marks the end of the part.
+    """
+
+    def __init__(self, maxsize: int = PIPE_DEPTH) -> None:
+        self._queue: asyncio.Queue[Optional[bytes]] = asyncio.Queue(maxsize)
+        self._eof = False
+
+    async def feed(self, part: FormPart) -> None:
+        async for chunk in part.chunks():
+            await self._queue.put(chunk)
+        await self.close()
+
+    async def close(self) -> None:
+        await self._queue.put(None)
+
+    async def chunks(self) -> AsyncGenerator[bytes, None]:
+        while not self._eof:
+            chunk = await self._queue.get()
+            if chunk is None:
+                self._eof = True
+                return
+            yield chunk
+
+    async def discard(self) -> None:
+        """
+        Consume what is left, so a failed consumer does not block the reader
+        """
+        async for _ in self.chunks():
+            pass
@@ -6,31 +6,98 @@ You can include more of them + oauth login endplpoints.
 
 fastapi_users in defined in deps, because it also
 includes useful dependencies.
+
+HTML pages do not depend on the request, every template is rendered and
+compressed (gzip, and brotli when installed) once per process, on startup
+(see `app/main.py`), Jinja is not even imported before that.
+Requests only pick the variant matching `Accept-Encoding` and answer
+`If-None-Match` revalidation with 304.
 """
 
-from fastapi import APIRouter, Depends, Request
-from fastapi_users import models
-from fastapi.templating import Jinja2Templates
+import gzip
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
+from fastapi import APIRouter, Request, Response, status
+
+from app.api.responses import etag_matches, negotiate_encoding
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
 
-from app.api.deps import fastapi_users, get_session, get_current_user
-from app.core import security
-from app.schemas import ImageCreate, Image
-from sqlalchemy.ext.asyncio import AsyncSession
+TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
 
-templates = Jinja2Templates(directory="app/templates")
+# Pages change with deployments only, clients revalidate after a few minutes
+PAGE_CACHE_CONTROL = "public, max-age=300"
 
 page_router = APIRouter()
 
 
-# TODO:  
-# Please use multipart/form-data instead of JSON
+class StaticPage:
+    def __init__(self, body: bytes) -> None:
+        # In order of preference, smallest first
+        self.variants: dict[str, bytes] = {}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, mode=brotli.MODE_TEXT)
+        self.variants["gzip"] = gzip.compress(body, mtime=0)
+        self.variants["identity"] = body
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+
+    def response(self, request: Request) -> Response:
+        encoding = negotiate_encoding(
+            request.headers.get("accept-encoding", ""), list(self.variants)
+        )
+        if encoding is None:
+            return Response(status_code=status.HTTP_406_NOT_ACCEPTABLE)
+
+        # Strong ETags are per representation, so per encoding
+        etag = (
+            f'"{self.digest}"'
+            if encoding == "identity"
+            else f'"{self.digest}-{encoding}"'
+        )
+        headers = {
+            "etag": etag,
+            "cache-control": PAGE_CACHE_CONTROL,
+            "vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["content-encoding"] = encoding
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(etag, if_none_match):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(
+            self.variants[encoding], media_type="text/html", headers=headers
+        )
+
+
+@lru_cache(maxsize=None)
+def get_templates():
+    from fastapi.templating import Jinja2Templates
+
+    return Jinja2Templates(directory=str(TEMPLATES_DIR))
+
+
+@lru_cache(maxsize=None)
+def get_page(template: str) -> StaticPage:
+    body = get_templates().get_template(template).render()
+    return StaticPage(body.encode())
+
+
+def render_pages() -> None:
+    for template in get_templates().env.list_templates():
+        get_page(template)
+
+
 @page_router.get("/home")
-async def home():
-    return templates.TemplateResponse("image_upload.html", {"request": {}})
+async def home(request: Request):
+    return get_page("image_upload.html").response(request)
 
 
-# TODO:  
-# Please use multipart/form-data instead of JSON
 @page_router.get("/login-page")
-async def home():
-    return templates.TemplateResponse("login.html", {"request": {}})
+async def login_page(request: Request):
+    return get_page("login.html").response(request)
@@ -0,0 +1,239 @@
+"""
+Responses serving blob store content.
+
+`blob_response` handles the conditional and partial request headers
+(`If-None-Match`, `Range`, `If-Range`) for content addressed by digest.
+The digest doubles as a strong ETag, a blob under a given digest never changes.
+
+`BlobResponse` hands the file to the server with the ASGI zero-copy send
+extension when it is available (`http.response.zerocopysend`), otherwise it
+streams positional reads from the blob store.
+
+`etag_matches` and `negotiate_encoding` are shared with other cached
+responses (see `app/api/pages.py`).
+
+`FastJSONResponse` is the default response class of `api_router`, see its
+docstring for the fast path it offers to endpoints.
+"""
+
+from typing import Any, Optional
+
+import orjson
+from fastapi import Request, status
+from pydantic import BaseModel
+from sqlalchemy.engine import Row
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from app.core.metrics import measure
+from app.core.storage import BlobStore, LocalBlobStore
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+# Blob content is immutable, clients never have to revalidate
+BLOB_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+def _encode(value: Any) -> Any:
+    # orjson handles dicts, lists, UUIDs, datetimes etc. natively
+    if isinstance(value, Row):
+        return dict(value._mapping)
+    if isinstance(value, BaseModel):
+        return value.dict()
+    raise TypeError
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON encoded with orjson.
+
+    As a default response class it only speeds up encoding, content still
+    goes through `response_model` validation and `jsonable_encoder`.
+    Endpoints returning it directly skip both: SQLAlchemy rows, pydantic
+    models and whatever orjson supports are encoded as is, so the content
+    must already match the declared `response_model`.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with measure("serialization"):
+            return orjson.dumps(content, default=_encode)
+
+
+class BlobResponse(Response):
+    def __init__(
+        self,
+        store: BlobStore,
+        digest: str,
+        start: int,
+        end: int,
+        status_code: int = status.HTTP_200_OK,
+        headers: Optional[dict[str, str]] = None,
+        media_type: Optional[str] = None,
+        send_body: bool = True,
+    ) -> None:
+        self.store = store
+        self.digest = digest
+        self.start = start
+        self.end = end
+        self.status_code = status_code
+        self.media_type = media_type
+        self.send_body = send_body
+        self.background = None
+        self.init_headers(headers)
+        self.headers["content-length"] = str(end - start)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if not self.send_body or self.start == self.end:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if isinstance(self.store, LocalBlobStore) and ZEROCOPY_EXTENSION in scope.get(
+            "extensions", {}
+        ):
+            file = await run_in_threadpool(open, self.store.path(self.digest), "rb")
+            try:
+                await send(
+                    {
+                        "type": ZEROCOPY_EXTENSION,
+                        "file": file,
+                        "offset": self.start,
+                        "count": self.end - self.start,
+                    }
+                )
+            finally:
+                file.close()
+            return
+
+        async for chunk in self.store.stream(self.digest, self.start, self.end):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def etag_matches(etag: str, header: str) -> bool:
+    # If-None-Match uses weak comparison, W/ prefixes are ignored
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag == "*" or tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def negotiate_encoding(accept_encoding: str, available: list[str]) -> Optional[str]:
+    """
+    Content coding from `available` the client prefers, in order of
+    `available` on ties. None when even `identity` is refused.
+    """
+    accepted: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        name, _, value = params.partition("=")
+        try:
+            quality = float(value) if name.strip() == "q" else 1.0
+        except ValueError:
+            quality = 0.0
+        if coding.strip():
+            accepted[coding.strip().lower()] = quality
+
+    def q(coding: str) -> float:
+        if coding in accepted:
+            return accepted[coding]
+        if "*" in accepted:
+            return accepted["*"]
+        # identity is acceptable unless refused explicitly
+        return 1.0 if coding == "identity" else 0.0
+
+    best = max(available, key=q)
+    return best if q(best) > 0 else None
+
+
+def parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Parse single `bytes=` range into half-open (start, end) offsets.
+
+    Returns None when the header should be ignored (other units, several
+    ranges, syntax errors), raises RangeNotSatisfiable when it is out of bounds.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first or last):
+        return None
+    if (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+
+    if first:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+        if last and int(last) < start:
+            return None
+    else:
+        start = max(size - int(last), 0)
+        end = size
+    if start >= end:
+        raise RangeNotSatisfiable(header)
+    return start, end
+
+
+def blob_response(
+    request: Request,
+    store: BlobStore,
+    digest: str,
+    size: int,
+    media_type: Optional[str],
+) -> Response:
+    etag = f'"{digest}"'
+    headers = {
+        "etag": etag,
+        "cache-control": BLOB_CACHE_CONTROL,
+        "accept-ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(etag, if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    send_body = request.method != "HEAD"
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header is not None and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            headers["content-range"] = f"bytes */{size}"
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers=headers,
+            )
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+            return BlobResponse(
+                store,
+                digest,
+                start,
+                end,
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                headers=headers,
+                media_type=media_type,
+                send_body=send_body,
+            )
+
+    return BlobResponse(
+        store,
+        digest,
+        0,
+        size,
+        headers=headers,
+        media_type=media_type,
+        send_body=send_body,
+    )
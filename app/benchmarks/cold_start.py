@@ -0,0 +1,91 @@
+"""
+Cold start of a worker process: import time of `app.main` and time to the
+first response, each measured in fresh interpreters.
+
+    python -m app.benchmarks.cold_start --runs 5 --top 15
+
+Import time comes from `python -X importtime -c 'import app.main'`, the
+modules with the largest cumulative time are listed to see what to defer.
+Time to first response is measured from spawning the interpreter until
+`GET /login-page` (no database needed) has been answered after the startup
+handlers ran.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+FIRST_RESPONSE = """
+import asyncio
+from httpx import AsyncClient
+from app.main import app
+
+async def main():
+    await app.router.startup()
+    async with AsyncClient(app=app, base_url="http://cold.start") as client:
+        res = await client.get("/login-page")
+    assert res.status_code == 200, res.status_code
+    await app.router.shutdown()
+
+asyncio.run(main())
+"""
+
+
+def import_times() -> dict[str, int]:
+    """
+    Cumulative import time in microseconds of every module imported by app.main
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def first_response_time() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", FIRST_RESPONSE], check=True)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.runs)]
+    totals = [times["app.main"] / 1000 for times in runs]
+    print(f"import app.main over {args.runs} runs")
+    print(f"  median {statistics.median(totals):.1f} ms, min {min(totals):.1f} ms")
+
+    print("slowest modules (median cumulative ms):")
+    medians = {
+        module: statistics.median(times.get(module, 0) for times in runs) / 1000
+        for module in runs[0]
+        if module != "app.main"
+    }
+    slowest = sorted(medians.items(), key=lambda item: -item[1])[: args.top]
+    for module, ms in slowest:
+        print(f"  {ms:>8.1f} {module}")
+
+    first = [first_response_time() for _ in range(args.runs)]
+    print("time to first response (process start to GET /login-page)")
+    print(
+        f"  median {statistics.median(first) * 1000:.1f} ms,"
+        f" min {min(first) * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Encoding throughput of a large `GET /images` page, default FastAPI path
+against `FastJSONResponse` returned directly.
+
+    python -m app.benchmarks.json_responses --items 200 --pages 500
+
+`fastapi` validates the content against `response_model`, runs
+`jsonable_encoder` and encodes with stdlib `json`, as for any endpoint
+returning plain data. `orjson-default` is the same with `FastJSONResponse`
+as default response class, `orjson-direct` is what the image endpoints do.
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app import schemas
+from app.api.responses import FastJSONResponse
+
+
+def make_page(items: int) -> dict[str, Any]:
+    user_id = uuid.uuid4()
+    return {
+        "items": [
+            {
+                "id": 1_000_000 - i,
+                "title": f"IMG_{i:05}.jpg",
+                "digest": f"{i:064x}",
+                "size": 2_500_000 + i,
+                "mime_type": "image/jpeg",
+                "width": 4032,
+                "height": 3024,
+                "orientation": 1,
+                "taken_at": datetime(2022, 3, 20, 17, 59, tzinfo=timezone.utc),
+                "user_id": user_id,
+            }
+            for i in range(items)
+        ],
+        "next_cursor": 1_000_000 - items,
+    }
+
+
+def fastapi_path(response_class: type[JSONResponse]) -> Callable[[Any], bytes]:
+    field = create_response_field(name="bench", type_=schemas.ImagePage)
+    loop = asyncio.new_event_loop()
+
+    def encode(content: Any) -> bytes:
+        value = loop.run_until_complete(
+            serialize_response(field=field, response_content=content)
+        )
+        return response_class(value).body
+
+    return encode
+
+
+def direct_path(content: Any) -> bytes:
+    return FastJSONResponse(content).body
+
+
+def bench(
+    encode: Callable[[Any], bytes], content: Any, pages: int
+) -> tuple[float, float]:
+    encoded = 0
+    start = time.perf_counter()
+    for _ in range(pages):
+        encoded += len(encode(content))
+    elapsed = time.perf_counter() - start
+    return pages / elapsed, encoded / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    content = make_page(args.items)
+    paths = {
+        "fastapi": fastapi_path(JSONResponse),
+        "orjson-default": fastapi_path(FastJSONResponse),
+        "orjson-direct": direct_path,
+    }
+
+    print(f"items per page: {args.items}, pages: {args.pages}")
+    print(f"{'path':>15} {'pages/s':>10} {'MB/s':>8}")
+    for name, encode in paths.items():
+        per_second, bytes_per_second = bench(encode, content, args.pages)
+        print(f"{name:>15} {per_second:>10.1f} {bytes_per_second / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
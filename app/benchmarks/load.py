@@ -0,0 +1,223 @@
+"""
+Throughput and latency of the auth and image hot paths, driving the ASGI
+app in-process with concurrent `httpx.AsyncClient` workers.
+
+    docker-compose up -d
+    python -m app.benchmarks.load --concurrency 16 --requests 500 --json out.json
+    python -m app.benchmarks.load --baseline out.json
+
+Runs against the default database (the one `alembic upgrade head` set up)
+and leaves the users and images it created there, `--test-database`
+switches to the test one. Every scenario sends
+`--requests` requests from `--concurrency` workers and reports requests/s
+and p50/p95/p99 latency. `--json` writes the results together with the
+current commit, `--baseline` prints the change against such a file.
+
+Uploads are `--image-size` random bytes, different for every request, so
+`image_upload` measures storing new content, not the shortcut taken when
+identical content is already stored.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from httpx import AsyncClient, Response
+
+SCENARIOS = ["signup", "login", "users_me", "image_upload", "image_fetch"]
+
+
+@dataclass
+class Result:
+    requests: int
+    errors: int
+    seconds: float
+    requests_per_second: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+async def run_scenario(
+    request: Callable[[AsyncClient, int], Awaitable[Response]],
+    client: AsyncClient,
+    requests: int,
+    concurrency: int,
+    expected_status: int,
+) -> Result:
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            res = await request(client, i)
+            latencies.append(time.perf_counter() - start)
+            if res.status_code != expected_status:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+    percentile = (lambda p: cuts[p - 1] * 1000) if cuts else (lambda p: 0.0)
+    return Result(
+        requests=len(latencies),
+        errors=errors,
+        seconds=seconds,
+        requests_per_second=len(latencies) / seconds,
+        p50_ms=percentile(50),
+        p95_ms=percentile(95),
+        p99_ms=percentile(99),
+        max_ms=max(latencies, default=0) * 1000,
+    )
+
+
+async def run(args: argparse.Namespace) -> dict[str, Result]:
+    from app.main import app
+
+    password = "benchmark-password"
+    # Random bytes rather than an image, the first 16 differ per upload so
+    # that no upload (of this run or an earlier one) shares a blob
+    filler = os.urandom(max(args.image_size - 16, 0))
+
+    def signup(client: AsyncClient, email: str) -> Awaitable[Response]:
+        return client.post("/signup", data={"email": email, "password": password})
+
+    def login(client: AsyncClient, email: str) -> Awaitable[Response]:
+        return client.post(
+            "/auth/jwt/login", data={"username": email, "password": password}
+        )
+
+    def upload(
+        client: AsyncClient, headers: dict[str, str], i: int
+    ) -> Awaitable[Response]:
+        content = uuid.uuid4().bytes + filler
+        return client.post(
+            "/image",
+            # Uploads only take image/*, the sniffer finds no known format
+            files={"file": (f"bench-{i}.bin", content, "image/x-benchmark")},
+            headers=headers,
+        )
+
+    await app.router.startup()
+    try:
+        async with AsyncClient(app=app, base_url="http://benchmark") as client:
+            email = f"bench-{uuid.uuid4().hex}@example.com"
+            await signup(client, email)
+            token = (await login(client, email)).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            image_id = (await upload(client, headers, -1)).json()[0]["id"]
+
+            scenarios: dict[str, tuple[Callable, int]] = {
+                "signup": (
+                    lambda c, i: signup(c, f"bench-{uuid.uuid4().hex}@example.com"),
+                    303,
+                ),
+                "login": (lambda c, i: login(c, email), 200),
+                "users_me": (lambda c, i: c.get("/users/me", headers=headers), 200),
+                "image_upload": (lambda c, i: upload(c, headers, i), 200),
+                "image_fetch": (
+                    lambda c, i: c.get(f"/image/{image_id}", headers=headers),
+                    200,
+                ),
+            }
+            results = {}
+            for name in args.scenarios:
+                request, expected_status = scenarios[name]
+                results[name] = await run_scenario(
+                    request, client, args.requests, args.concurrency, expected_status
+                )
+                print_result(name, results[name])
+            return results
+    finally:
+        await app.router.shutdown()
+
+
+def print_result(name: str, result: Result) -> None:
+    print(
+        f"{name:>13} {result.requests:>6} {result.errors:>6}"
+        f" {result.requests_per_second:>9.1f} {result.p50_ms:>8.1f}"
+        f" {result.p95_ms:>8.1f} {result.p99_ms:>8.1f}"
+    )
+
+
+def print_comparison(results: dict[str, Result], baseline: dict[str, Any]) -> None:
+    print(f"\nagainst {baseline.get('commit') or 'baseline'}:")
+    for name, result in results.items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+
+        def change(key: str) -> str:
+            old, new = before[key], getattr(result, key)
+            return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+        print(
+            f"{name:>13} req/s {change('requests_per_second'):>8}"
+            f"  p50 {change('p50_ms'):>8}  p99 {change('p99_ms'):>8}"
+        )
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--image-size", type=int, default=256 * 1024)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--test-database", action="store_true")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    args = parser.parse_args()
+
+    if args.test_database:
+        # Read by app.core.config on import
+        os.environ["ENVIRONMENT"] = "PYTEST"
+
+    print(f"concurrency: {args.concurrency}, requests per scenario: {args.requests}")
+    print(
+        f"{'scenario':>13} {'reqs':>6} {'errors':>6} {'req/s':>9}"
+        f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    results = asyncio.run(run(args))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            print_comparison(results, json.load(file))
+    if args.json:
+        output = {
+            "commit": current_commit(),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "image_size": args.image_size,
+            "scenarios": {name: asdict(result) for name, result in results.items()},
+        }
+        with open(args.json, "w") as file:
+            json.dump(output, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
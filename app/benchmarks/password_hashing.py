@@ -0,0 +1,50 @@
+"""
+bcrypt throughput per cost factor, to choose `PASSWORD_HASH_ROUNDS` and
+`PASSWORD_HASH_WORKERS` for the machine the app runs on.
+
+    python -m app.benchmarks.password_hashing --min-rounds 10 --max-rounds 13
+
+Every cost level hashes `--hashes` passwords on `--workers` threads,
+the same way `app/core/passwords.py` does.
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core import config
+from app.core.passwords import make_context
+
+
+def bench_rounds(rounds: int, hashes: int, workers: int) -> tuple[float, float]:
+    context = make_context(rounds)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        list(executor.map(context.hash, (f"password-{i}" for i in range(hashes))))
+        elapsed = time.perf_counter() - start
+    return hashes / elapsed, elapsed / hashes * workers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-rounds", type=int, default=8)
+    parser.add_argument("--max-rounds", type=int, default=14)
+    parser.add_argument("--hashes", type=int, default=20)
+    parser.add_argument(
+        "--workers", type=int, default=config.settings.PASSWORD_HASH_WORKERS
+    )
+    args = parser.parse_args()
+
+    print(f"workers: {args.workers}, hashes per level: {args.hashes}")
+    print(f"{'rounds':>6} {'hashes/s':>10} {'ms/hash':>8}")
+    for rounds in range(args.min_rounds, args.max_rounds + 1):
+        per_second, per_hash = bench_rounds(rounds, args.hashes, args.workers)
+        current = rounds == config.settings.PASSWORD_HASH_ROUNDS
+        print(
+            f"{rounds:>6} {per_second:>10.1f} {per_hash * 1000:>8.1f}"
+            + (" <- PASSWORD_HASH_ROUNDS" if current else "")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Reference counting of blob store content.
+
+Identical uploads share one blob (same digest), every `image` row holds
+a reference on the `blob` row of its digest. When the last reference goes,
+the blob is only marked released, the content is deleted later by
+`collect_garbage`. Writers reserve the blob row (`reserve_blobs`, which
+restarts the grace period of released content) before they rely on content
+already in the blob store, the grace period then covers them until they
+commit their reference.
+
+Run `python -m app.blobs` periodically (e.g. from cron) to collect garbage.
+"""
+
+import asyncio
+from collections import Counter
+from datetime import timedelta
+
+from sqlalchemy import case, delete, func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import config
+from app.core.storage import BlobStore, StoredBlob, get_blob_store
+from app.models import Blob
+from app.session import async_session
+
+
+async def add_references(session: AsyncSession, blobs: list[StoredBlob]) -> None:
+    """
+    Take one reference per item of `blobs`, creating missing blob rows
+    """
+    counts = Counter(blob.digest for blob in blobs)
+    sizes = {blob.digest: blob.size for blob in blobs}
+    statement = insert(Blob).values(
+        # Sorted, so concurrent uploads lock the rows in the same order
+        [
+            {"digest": digest, "size": sizes[digest], "refcount": counts[digest]}
+            for digest in sorted(counts)
+        ]
+    )
+    await session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[Blob.digest],
+            set_={
+                "refcount": Blob.refcount + statement.excluded.refcount,
+                "released_at": None,
+            },
+        )
+    )
+
+
+async def reserve_blobs(session: AsyncSession, blobs: list[StoredBlob]) -> None:
+    """
+    Create blob rows without references, released now, ahead of writing
+    their content, so content a crash leaves unreferenced is collected too
+    """
+    statement = insert(Blob).values(
+        [
+            {"digest": blob.digest, "size": blob.size, "released_at": func.now()}
+            for blob in sorted(blobs, key=lambda blob: blob.digest)
+        ]
+    )
+    await session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[Blob.digest],
+            # Restarts the grace period of content about to be written again
+            set_={"released_at": func.now()},
+            where=Blob.refcount == 0,
+        )
+    )
+
+
+async def reserve_blob(blob: StoredBlob) -> None:
+    """
+    `reserve_blobs` in a transaction of its own, for `BlobStore.put(reserve=)`
+    """
+    async with async_session() as session:
+        await reserve_blobs(session, [blob])
+        await session.commit()
+
+
+async def release_reference(session: AsyncSession, digest: str) -> None:
+    await session.execute(
+        update(Blob)
+        .where(Blob.digest == digest)
+        .values(
+            refcount=Blob.refcount - 1,
+            released_at=case((Blob.refcount == 1, func.now()), else_=Blob.released_at),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def collect_garbage(
+    session: AsyncSession, store: BlobStore, grace_seconds: int
+) -> int:
+    """
+    Delete blobs unreferenced for longer than `grace_seconds`
+    """
+    result = await session.execute(
+        delete(Blob)
+        .where(
+            Blob.refcount == 0,
+            Blob.released_at < func.now() - timedelta(seconds=grace_seconds),
+        )
+        .returning(Blob.digest)
+        .execution_options(synchronize_session=False)
+    )
+    digests = result.scalars().all()
+    # Deleted under the row locks, an upload of the same content waits in
+    # `reserve_blobs` and then finds the content gone and writes it again
+    for digest in digests:
+        await store.delete(digest)
+    await session.commit()
+    return len(digests)
+
+
+async def main() -> None:
+    async with async_session() as session:
+        collected = await collect_garbage(
+            session, get_blob_store(), config.settings.BLOB_GC_GRACE_SECONDS
+        )
+    print(f"Deleted {collected} unreferenced blobs")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
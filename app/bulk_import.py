@@ -0,0 +1,426 @@
+"""
+Bulk import of users from CSV or NDJSON.
+
+    python -m app.bulk_import users.csv
+    python -m app.bulk_import users.ndjson --batch-size 5000 --workers 8
+
+Every record has `email` and either `password` (hashed here, across
+`--workers` processes) or `hashed_password` (a bcrypt hash, taken as is),
+optionally `id`, `is_active`, `is_superuser` and `is_verified`. CSV needs a
+header row.
+
+Batches are loaded with `COPY` into a temporary table and merged into `user`
+with one `INSERT .. ON CONFLICT (lower(email))`: new emails are inserted,
+existing users, whatever the case of their email, get the password and
+flags of the record (`--skip-existing` leaves them alone). The next batch
+is hashed while the previous one loads.
+
+After every batch the number of records done is written to the checkpoint
+file (`<input>.checkpoint` by default), a rerun continues from there.
+Loading is idempotent, so a batch done twice after a crash does no harm.
+Invalid records, lines that are not a JSON object included, are skipped and
+reported with their record and line number, as are
+records whose `id` belongs to a user with another email (or to an earlier
+record of the batch with another email), emails are taken in lower case.
+
+bcrypt is slow on purpose, hashing dominates an import of plain passwords
+(about `PASSWORD_HASH_ROUNDS` cost times records / workers); importing
+existing bcrypt hashes avoids it entirely.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import IO, Any, Iterator, Optional, Union
+
+from passlib.context import CryptContext
+from passlib.hash import bcrypt
+from pydantic import EmailStr, ValidationError, parse_obj_as
+
+from app.core import config
+from app.core.passwords import make_context
+from app.session import dispose_engine, get_engine
+
+COLUMNS = ("id", "email", "hashed_password", "is_active", "is_superuser", "is_verified")
+
+CREATE_STAGING_TABLE = """
+CREATE TEMPORARY TABLE IF NOT EXISTS user_import (
+    record bigint NOT NULL,
+    id uuid NOT NULL,
+    email varchar(320) NOT NULL,
+    hashed_password varchar(72) NOT NULL,
+    is_active boolean NOT NULL,
+    is_superuser boolean NOT NULL,
+    is_verified boolean NOT NULL
+) ON COMMIT DELETE ROWS
+"""
+
+# Records taking the id of another email, either a user already there or an
+# earlier record of the batch, are not merged, the id is the primary key
+REJECT_TAKEN_IDS = """
+DELETE FROM user_import i
+WHERE EXISTS (
+       SELECT 1 FROM "user" u WHERE u.id = i.id AND lower(u.email) <> i.email
+   )
+   OR EXISTS (
+       SELECT 1 FROM user_import o
+       WHERE o.id = i.id AND o.email <> i.email AND o.record < i.record
+         AND NOT EXISTS (
+             SELECT 1 FROM "user" u WHERE u.id = o.id AND lower(u.email) <> o.email
+         )
+   )
+RETURNING record, id
+"""
+
+# Last record wins when a batch has an email twice, ON CONFLICT can not
+# update a row twice in one statement
+MERGE = """
+INSERT INTO "user" (id, email, hashed_password, is_active, is_superuser, is_verified)
+SELECT DISTINCT ON (email)
+    id, email, hashed_password, is_active, is_superuser, is_verified
+FROM user_import
+ORDER BY email, record DESC
+ON CONFLICT (lower(email)) DO {action}
+"""
+
+UPSERT = """UPDATE SET
+    hashed_password = excluded.hashed_password,
+    is_active = excluded.is_active,
+    is_superuser = excluded.is_superuser,
+    is_verified = excluded.is_verified"""
+
+
+@dataclass
+class Record:
+    number: int
+    id: uuid.UUID
+    email: str
+    password: Optional[str]
+    hashed_password: Optional[str]
+    is_active: bool
+    is_superuser: bool
+    is_verified: bool
+
+    def row(self) -> tuple:
+        return (
+            self.number,
+            self.id,
+            self.email,
+            self.hashed_password,
+            self.is_active,
+            self.is_superuser,
+            self.is_verified,
+        )
+
+
+class InvalidRecord(Exception):
+    pass
+
+
+class CountingReader:
+    """
+    Text lines of a binary file, counting the bytes read for progress
+    """
+
+    def __init__(self, file: IO[bytes]) -> None:
+        self.file = file
+        self.bytes_read = 0
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self.file:
+            # Spreadsheet exports start with a byte order mark
+            encoding = "utf-8" if self.bytes_read else "utf-8-sig"
+            self.bytes_read += len(line)
+            yield line.decode(encoding)
+
+
+def _flag(value: Any, default: bool) -> bool:
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("1", "true", "t", "yes", "y"):
+        return True
+    if text in ("0", "false", "f", "no", "n"):
+        return False
+    raise InvalidRecord(f"not a boolean: {value!r}")
+
+
+def parse_record(number: int, fields: Union[str, dict[str, Any]]) -> Record:
+    if isinstance(fields, str):
+        try:
+            fields = json.loads(fields)
+        except json.JSONDecodeError as e:
+            raise InvalidRecord(f"invalid JSON: {e}")
+    if not isinstance(fields, dict):
+        raise InvalidRecord(f"not an object: {type(fields).__name__}")
+
+    try:
+        email = parse_obj_as(EmailStr, (fields.get("email") or "").strip().lower())
+    except ValidationError:
+        raise InvalidRecord(f"invalid email: {fields.get('email')!r}")
+
+    password = fields.get("password") or None
+    hashed_password = fields.get("hashed_password") or None
+    if hashed_password is not None:
+        if not bcrypt.identify(hashed_password):
+            raise InvalidRecord("hashed_password is not a bcrypt hash")
+        password = None
+    elif password is None:
+        raise InvalidRecord("password or hashed_password is required")
+
+    try:
+        user_id = uuid.UUID(str(fields["id"])) if fields.get("id") else uuid.uuid4()
+    except ValueError:
+        raise InvalidRecord(f"invalid id: {fields['id']!r}")
+
+    return Record(
+        number=number,
+        id=user_id,
+        email=email,
+        password=password,
+        hashed_password=hashed_password,
+        is_active=_flag(fields.get("is_active"), True),
+        is_superuser=_flag(fields.get("is_superuser"), False),
+        is_verified=_flag(fields.get("is_verified"), False),
+    )
+
+
+def read_records(
+    lines: Iterator[str], format: str
+) -> Iterator[tuple[int, Union[str, dict[str, Any]]]]:
+    """
+    Line numbers and fields of the records, NDJSON lines are decoded by
+    `parse_record`, so a rerun does not decode those before the checkpoint
+    """
+    if format == "csv":
+        reader = csv.DictReader(lines)
+        for fields in reader:
+            yield reader.line_num, fields
+        return
+    for line_number, line in enumerate(lines, start=1):
+        if line.strip():
+            yield line_number, line
+
+
+@lru_cache()
+def _context(rounds: int) -> CryptContext:
+    return make_context(rounds)
+
+
+def hash_passwords(passwords: list[str], rounds: int) -> list[str]:
+    # Runs in the worker processes
+    context = _context(rounds)
+    return [context.hash(password) for password in passwords]
+
+
+async def hash_batch(
+    executor: ProcessPoolExecutor, records: list[Record], workers: int, rounds: int
+) -> None:
+    """
+    Fill in `hashed_password` of records with a plain password
+    """
+    plain = [record for record in records if record.hashed_password is None]
+    if not plain:
+        return
+    loop = asyncio.get_running_loop()
+    size = -(-len(plain) // workers)
+    slices = [plain[i : i + size] for i in range(0, len(plain), size)]
+    hashes = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                executor,
+                hash_passwords,
+                [record.password for record in part],
+                rounds,
+            )
+            for part in slices
+        )
+    )
+    for part, part_hashes in zip(slices, hashes):
+        for record, hashed_password in zip(part, part_hashes):
+            record.hashed_password = hashed_password
+            record.password = None
+
+
+async def load_batch(
+    connection: Any, records: list[Record], skip_existing: bool
+) -> tuple[int, list[tuple[int, uuid.UUID]]]:
+    """
+    COPY and merge one batch in its own transaction, returns rows written
+    and the record numbers and ids of records rejected for their id
+    """
+    async with connection.transaction():
+        await connection.copy_records_to_table(
+            "user_import",
+            records=[record.row() for record in records],
+            columns=("record", *COLUMNS),
+        )
+        rejected = await connection.fetch(REJECT_TAKEN_IDS)
+        status = await connection.execute(
+            MERGE.format(action="NOTHING" if skip_existing else UPSERT)
+        )
+    # "INSERT 0 <rows>"
+    return int(status.rsplit(" ", 1)[-1]), [(row[0], row[1]) for row in rejected]
+
+
+def read_checkpoint(path: Optional[Path]) -> int:
+    if path is None or not path.exists():
+        return 0
+    return int(path.read_text().strip() or 0)
+
+
+def write_checkpoint(path: Optional[Path], done: int) -> None:
+    if path is None:
+        return
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(f"{done}\n")
+    os.replace(tmp_path, path)
+
+
+@dataclass
+class Progress:
+    started: float
+    total_bytes: Optional[int]
+    done: int = 0
+    written: int = 0
+    invalid: int = 0
+
+    def report(self, reader: CountingReader, imported: int) -> None:
+        seconds = time.monotonic() - self.started
+        line = (
+            f"{self.done} records, {self.written} written, {self.invalid} invalid,"
+            f" {imported / seconds if seconds else 0:.0f} records/s"
+        )
+        if self.total_bytes:
+            share = reader.bytes_read / self.total_bytes
+            line += f", {share:.1%}"
+            if share and imported:
+                line += f", {seconds / share * (1 - share):.0f}s left"
+        print(line, file=sys.stderr)
+
+
+async def run(args: argparse.Namespace, file: IO[bytes]) -> Progress:
+    checkpoint = args.checkpoint
+    start = read_checkpoint(checkpoint)
+    if start:
+        print(f"Resuming after record {start}", file=sys.stderr)
+
+    reader = CountingReader(file)
+    # Zero for pipes, no percentage then
+    total_bytes = os.fstat(file.fileno()).st_size or None
+    progress = Progress(started=time.monotonic(), total_bytes=total_bytes, done=start)
+    records = read_records(iter(reader), args.format)
+
+    def batches() -> Iterator[tuple[int, list[Record]]]:
+        batch: list[Record] = []
+        number = 0
+        for number, (line_number, fields) in enumerate(records, start=1):
+            if number <= start:
+                continue
+            try:
+                batch.append(parse_record(number, fields))
+            except InvalidRecord as e:
+                progress.invalid += 1
+                print(f"record {number} (line {line_number}): {e}", file=sys.stderr)
+            if len(batch) >= args.batch_size:
+                yield number, batch
+                batch = []
+        if number > start:
+            # Possibly empty, still moves the checkpoint past invalid records
+            yield number, batch
+
+    executor = ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")
+    )
+    try:
+        async with get_engine().connect() as conn:
+            connection = (await conn.get_raw_connection()).driver_connection
+            await connection.execute(CREATE_STAGING_TABLE)
+
+            loading: Optional[asyncio.Task] = None
+            loading_end = start
+
+            async def finish_loading() -> None:
+                if loading is None:
+                    return
+                written, rejected = await loading
+                progress.written += written
+                progress.invalid += len(rejected)
+                for number, user_id in sorted(rejected):
+                    print(
+                        f"record {number}: id {user_id} belongs to another email",
+                        file=sys.stderr,
+                    )
+                progress.done = loading_end
+                write_checkpoint(checkpoint, loading_end)
+                progress.report(reader, progress.done - start)
+
+            for end, batch in batches():
+                # Hash this batch while the previous one is being loaded
+                await hash_batch(executor, batch, args.workers, args.rounds)
+                await finish_loading()
+                loading = asyncio.create_task(
+                    load_batch(connection, batch, args.skip_existing)
+                )
+                loading_end = end
+            await finish_loading()
+    finally:
+        executor.shutdown()
+    return progress
+
+
+async def run_file(args: argparse.Namespace, file: IO[bytes]) -> Progress:
+    try:
+        return await run(args, file)
+    finally:
+        await dispose_engine()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="CSV or NDJSON file, - for stdin")
+    parser.add_argument("--format", choices=["csv", "ndjson"])
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--rounds", type=int, default=config.settings.PASSWORD_HASH_ROUNDS
+    )
+    parser.add_argument(
+        "--skip-existing", action="store_true", help="do not update users already there"
+    )
+    parser.add_argument(
+        "--checkpoint", type=Path, help="default: <input>.checkpoint, none for stdin"
+    )
+    args = parser.parse_args()
+
+    if args.format is None:
+        suffix = Path(args.input).suffix.lower()
+        args.format = "csv" if suffix == ".csv" else "ndjson"
+    if args.checkpoint is None and args.input != "-":
+        args.checkpoint = Path(args.input + ".checkpoint")
+
+    if args.input == "-":
+        progress = asyncio.run(run_file(args, sys.stdin.buffer))
+    else:
+        with open(args.input, "rb") as file:
+            progress = asyncio.run(run_file(args, file))
+    print(
+        f"Imported {progress.done} records, {progress.written} users written,"
+        f" {progress.invalid} invalid"
+    )
+
+
+if __name__ == "__main__":
+    main()
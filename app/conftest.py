@@ -6,6 +6,15 @@ Put here any Pytest related code (it will be executed before `app/tests/...`)
 """
 
 import os
+import tempfile
 
 # This will ensure using test database
 os.environ["ENVIRONMENT"] = "PYTEST"
+
+# Minimal bcrypt cost, tests do not need slow hashes
+os.environ["PASSWORD_HASH_ROUNDS"] = "4"
+
+# Keep uploaded test blobs out of the project folder
+os.environ["BLOB_STORE_PATH"] = tempfile.mkdtemp(prefix="test_blobs_")
+os.environ["TRANSFORM_DISK_CACHE_PATH"] = tempfile.mkdtemp(prefix="test_derivatives_")
+os.environ["UPLOAD_STAGING_PATH"] = tempfile.mkdtemp(prefix="test_staging_")
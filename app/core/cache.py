@@ -0,0 +1,195 @@
+"""
+Small in-process and on-disk caches.
+
+`TTLCache` is a bounded LRU mapping whose entries also expire after a time
+to live. It is not shared between processes, so anything cached here can be
+stale in other workers for up to the TTL.
+
+`BytesLRUCache` and `DiskCache` hold immutable byte strings (e.g. encoded
+images) and are bounded by the total size of what they store.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[K, tuple[float, V]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        """
+        Store `value`, `ttl` can only shorten the cache wide time to live
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._data.pop(key, None)
+
+    def discard_where(self, predicate: Callable[[V], bool]) -> None:
+        """
+        Drop all entries whose value matches, linear in the cache size
+        """
+        for key in [key for key, (_, value) in self._data.items() if predicate(value)]:
+            del self._data[key]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class BytesLRUCache:
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: "OrderedDict[str, bytes]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        self.size += len(value) - len(self._data.pop(key, b""))
+        self._data[key] = value
+        while self.size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class DiskCache:
+    """
+    Files under `root`, least recently used ones are deleted once their total
+    size goes over `max_bytes`. Methods block, call them from a thread pool.
+
+    The recency index is built from file mtimes on first use and then kept in
+    memory, other processes sharing the directory may delete files under it,
+    which is treated as a miss.
+    """
+
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._index: Optional["OrderedDict[str, int]"] = None
+        self._lock = threading.Lock()
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def _load_index(self) -> "OrderedDict[str, int]":
+        if self._index is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            files = sorted(
+                (entry.stat().st_mtime, entry.name, entry.stat().st_size)
+                for entry in self.root.glob("*/*")
+                if entry.is_file()
+            )
+            self._index = OrderedDict((name, size) for _, name, size in files)
+            self.size = sum(self._index.values())
+        return self._index
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.size -= self._load_index().pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            index = self._load_index()
+            if key in index:
+                index.move_to_end(key)
+            self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{key}.{uuid.uuid4().hex}")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        evicted = []
+        with self._lock:
+            index = self._load_index()
+            self.size += len(data) - index.pop(key, 0)
+            index[key] = len(data)
+            while self.size > self.max_bytes and index:
+                evicted_key, evicted_size = index.popitem(last=False)
+                self.size -= evicted_size
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            self.path(evicted_key).unlink(missing_ok=True)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
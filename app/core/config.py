@@ -8,7 +8,10 @@ Pydantic priority ordering:
 2. `.env` file in root folder of project
 3. Default values
 
-For project name, version, description we use pyproject.toml
+For project name, version, description we use pyproject.toml, unless they
+are set in the environment or `.env` (saves parsing it on every process
+start). The Docker image reads them from pyproject.toml into its `.env`
+when it is built.
 For the rest, we use file `.env` (gitignored), see `.env.example`
 
 `DEFAULT_SQLALCHEMY_DATABASE_URI` and `TEST_SQLALCHEMY_DATABASE_URI`:
@@ -19,14 +22,20 @@ to databases to avoid typo bugs.
 See https://pydantic-docs.helpmanual.io/usage/settings/
 """
 
+from functools import lru_cache
 from pathlib import Path
-from typing import Literal, Union
+from typing import Any, Literal, Union
 
-import toml
-from pydantic import AnyHttpUrl, AnyUrl, BaseSettings, EmailStr, validator
+from pydantic import AnyHttpUrl, AnyUrl, BaseSettings, EmailStr, Field, validator
 
 PROJECT_DIR = Path(__file__).parent.parent.parent
-PYPROJECT_CONTENT = toml.load(f"{PROJECT_DIR}/pyproject.toml")["tool"]["poetry"]
+
+
+@lru_cache(maxsize=None)
+def pyproject_content() -> dict[str, Any]:
+    import toml
+
+    return toml.load(f"{PROJECT_DIR}/pyproject.toml")["tool"]["poetry"]
 
 
 class Settings(BaseSettings):
@@ -37,9 +46,9 @@ class Settings(BaseSettings):
     BACKEND_CORS_ORIGINS: Union[str, list[AnyHttpUrl]]
 
     # PROJECT NAME, VERSION AND DESCRIPTION
-    PROJECT_NAME: str = PYPROJECT_CONTENT["name"]
-    VERSION: str = PYPROJECT_CONTENT["version"]
-    DESCRIPTION: str = PYPROJECT_CONTENT["description"]
+    PROJECT_NAME: str = Field(default_factory=lambda: pyproject_content()["name"])
+    VERSION: str = Field(default_factory=lambda: pyproject_content()["version"])
+    DESCRIPTION: str = Field(default_factory=lambda: pyproject_content()["description"])
 
     # POSTGRESQL DEFAULT DATABASE
     DEFAULT_DATABASE_HOSTNAME: str
@@ -57,10 +66,86 @@ class Settings(BaseSettings):
     TEST_DATABASE_DB: str
     TEST_SQLALCHEMY_DATABASE_URI: str = ""
 
+    # CONNECTION POOL AND DRIVER (shared by both databases above)
+    # Pre-ping costs a round-trip on every checkout, recycling stale
+    # connections is usually enough unless something in between drops them
+    DATABASE_POOL_SIZE: int = 5
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: float = 30
+    DATABASE_POOL_RECYCLE: int = 1800
+    DATABASE_POOL_PRE_PING: bool = False
+    DATABASE_STATEMENT_CACHE_SIZE: int = 100
+
+    # READ REPLICAS (see app/session.py)
+    # "host" or "host:port" of streaming replicas of the database in use,
+    # e.g. '["replica-1", "replica-2:5433"]', empty sends everything to it
+    DATABASE_REPLICA_HOSTS: list[str] = []
+    # Clients read from the primary for this long after they wrote, carried
+    # in a cookie, clients ignoring cookies read from replicas right away
+    DATABASE_READ_YOUR_WRITES_SECONDS: float = 5
+
     # FIRST SUPERUSER
     FIRST_SUPERUSER_EMAIL: EmailStr
     FIRST_SUPERUSER_PASSWORD: str
 
+    # CACHE OF USERS RESOLVED FROM ACCESS TOKENS (per process, 0 size disables)
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_CACHE_TTL_SECONDS: int = 60
+
+    # PASSWORD HASHING (bcrypt, see app/core/passwords.py)
+    PASSWORD_HASH_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+
+    # BLOB STORAGE (image bytes, see app/core/storage.py)
+    BLOB_STORE_BACKEND: Literal["local"] = "local"
+    BLOB_STORE_PATH: Path = PROJECT_DIR / "blobs"
+    # Files of one upload request written to the blob store concurrently
+    UPLOAD_CONCURRENCY: int = 4
+    # Unreferenced blobs are deleted by `python -m app.blobs` after this long
+    BLOB_GC_GRACE_SECONDS: int = 3600
+
+    # RESUMABLE UPLOADS (see app/api/endpoints/uploads.py)
+    UPLOAD_STAGING_PATH: Path = PROJECT_DIR / "staging"
+    UPLOAD_RESUMABLE_MAX_BYTES: int = 1024 * 1024 * 1024
+    # Idle uploads are deleted by `python -m app.uploads` after this long
+    UPLOAD_EXPIRE_SECONDS: int = 24 * 3600
+
+    # UPLOAD ADMISSION CONTROL (per process, see app/api/admission.py)
+    UPLOAD_MAX_BODY_BYTES: int = 100 * 1024 * 1024
+    UPLOAD_MAX_CONCURRENT: int = 32
+    UPLOAD_MAX_QUEUED: int = 32
+    UPLOAD_QUEUE_TIMEOUT_SECONDS: float = 5
+    UPLOAD_MAX_CONCURRENT_PER_USER: int = 4
+    UPLOAD_USER_BYTES_PER_SECOND: int = 10 * 1024 * 1024
+    UPLOAD_USER_BURST_BYTES: int = 200 * 1024 * 1024
+
+    # PROMETHEUS METRICS (GET /metrics, see app/api/endpoints/metrics.py)
+    # Off by default, it exposes pool, cache and admission internals. With a
+    # token set, scrapes need "Authorization: Bearer <token>"
+    METRICS_ENABLED: bool = False
+    METRICS_TOKEN: str = ""
+
+    # IMAGE TRANSFORMS (resized variants, see app/core/transform.py)
+    TRANSFORM_WORKERS: int = 2
+    TRANSFORM_MEMORY_CACHE_BYTES: int = 64 * 1024 * 1024
+    TRANSFORM_DISK_CACHE_PATH: Path = PROJECT_DIR / "derivatives"
+    TRANSFORM_DISK_CACHE_BYTES: int = 1024 * 1024 * 1024
+    # Widths rendered (webp, contain) by a job after every upload
+    TRANSFORM_PRERENDER_WIDTHS: list[int] = [256]
+
+    # BACKGROUND JOBS (see app/jobs.py, run with python -m app.worker)
+    # Uploads enqueue jobs, every app process runs a worker unless this is
+    # turned off for deployments with dedicated worker processes
+    JOB_WORKER_IN_APP: bool = True
+    JOB_WORKER_CONCURRENCY: int = 4
+    JOB_BATCH_SIZE: int = 10
+    JOB_POLL_INTERVAL_SECONDS: float = 1
+    JOB_VISIBILITY_TIMEOUT_SECONDS: float = 300
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BASE_SECONDS: float = 5
+    JOB_RETRY_MAX_SECONDS: float = 3600
+
     # VALIDATORS
     @validator("BACKEND_CORS_ORIGINS")
     def _assemble_cors_origins(cls, cors_origins: Union[str, list[AnyHttpUrl]]):
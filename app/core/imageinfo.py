@@ -0,0 +1,214 @@
+"""
+Image metadata read from container headers, without decoding pixels.
+
+Supports JPEG (SOF segment, EXIF orientation and capture time from APP1),
+PNG (IHDR), GIF (logical screen descriptor) and WebP (VP8 / VP8L / VP8X,
+EXIF chunk of extended files). Only the first `HEADER_LIMIT` bytes of a file
+are looked at, `HeaderSniffer` collects them while the upload streams past.
+"""
+
+import struct
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+
+# JPEG files may carry large EXIF thumbnails before the frame header
+HEADER_LIMIT = 256 * 1024
+
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_IFD_POINTER = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_OFFSET_TIME_ORIGINAL = 0x9011
+
+# SOFn markers carrying frame dimensions (not DHT, JPG or DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+@dataclass
+class ImageInfo:
+    mime_type: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    # EXIF orientation, 1 (upright) to 8, width and height are as displayed
+    orientation: Optional[int] = None
+    # Capture time from EXIF, UTC when the file does not state an offset
+    taken_at: Optional[datetime] = None
+
+
+def _parse_exif_datetime(value: str, offset: Optional[str]) -> Optional[datetime]:
+    try:
+        taken_at = datetime.strptime(value.strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    tz = timezone.utc
+    if offset and len(offset) >= 6 and offset[0] in "+-":
+        try:
+            hours, minutes = int(offset[1:3]), int(offset[4:6])
+        except ValueError:
+            pass
+        else:
+            sign = -1 if offset[0] == "-" else 1
+            tz = timezone(sign * timedelta(hours=hours, minutes=minutes))
+    return taken_at.replace(tzinfo=tz)
+
+
+def parse_exif(data: bytes) -> tuple[Optional[int], Optional[datetime]]:
+    """
+    Orientation and capture time from a TIFF structured EXIF block
+    """
+    if len(data) < 8 or data[:2] not in (b"II", b"MM"):
+        return None, None
+    endian = "<" if data[:2] == b"II" else ">"
+
+    def read_ifd(offset: int) -> dict[int, tuple[int, int, bytes]]:
+        entries: dict[int, tuple[int, int, bytes]] = {}
+        if offset + 2 > len(data):
+            return entries
+        (count,) = struct.unpack_from(endian + "H", data, offset)
+        for i in range(count):
+            position = offset + 2 + i * 12
+            if position + 12 > len(data):
+                break
+            tag, kind, length = struct.unpack_from(endian + "HHI", data, position)
+            entries[tag] = (kind, length, data[position + 8 : position + 12])
+        return entries
+
+    def integer(entry: tuple[int, int, bytes]) -> int:
+        kind, _, value = entry
+        return struct.unpack_from(endian + ("H" if kind == 3 else "I"), value)[0]
+
+    def text(entry: tuple[int, int, bytes]) -> str:
+        kind, length, value = entry
+        if length > 4:
+            (offset,) = struct.unpack(endian + "I", value)
+            value = data[offset : offset + length]
+        return value[:length].decode("ascii", "replace")
+
+    (ifd0_offset,) = struct.unpack_from(endian + "I", data, 4)
+    ifd0 = read_ifd(ifd0_offset)
+
+    orientation = None
+    if EXIF_ORIENTATION in ifd0:
+        orientation = integer(ifd0[EXIF_ORIENTATION])
+        if not 1 <= orientation <= 8:
+            orientation = None
+
+    exif_ifd = (
+        read_ifd(integer(ifd0[EXIF_IFD_POINTER])) if EXIF_IFD_POINTER in ifd0 else {}
+    )
+    offset = (
+        text(exif_ifd[EXIF_OFFSET_TIME_ORIGINAL])
+        if EXIF_OFFSET_TIME_ORIGINAL in exif_ifd
+        else None
+    )
+    if EXIF_DATETIME_ORIGINAL in exif_ifd:
+        taken_at = _parse_exif_datetime(text(exif_ifd[EXIF_DATETIME_ORIGINAL]), offset)
+    elif EXIF_DATETIME in ifd0:
+        taken_at = _parse_exif_datetime(text(ifd0[EXIF_DATETIME]), None)
+    else:
+        taken_at = None
+    return orientation, taken_at
+
+
+def _parse_jpeg(data: bytes) -> ImageInfo:
+    info = ImageInfo("image/jpeg")
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            break
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte
+            position += 1
+            continue
+        if marker in (0x01, *range(0xD0, 0xD8)):
+            # Standalone markers without a length
+            position += 2
+            continue
+        (length,) = struct.unpack_from(">H", data, position + 2)
+        segment = data[position + 4 : position + 2 + length]
+        if marker == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            info.orientation, info.taken_at = parse_exif(segment[6:])
+        elif marker in JPEG_SOF_MARKERS and len(segment) >= 5:
+            info.height, info.width = struct.unpack_from(">HH", segment, 1)
+            break
+        elif marker == 0xDA:
+            # Start of scan, no frame header before it
+            break
+        position += 2 + length
+    return info
+
+
+def _parse_webp(data: bytes) -> ImageInfo:
+    info = ImageInfo("image/webp")
+    position = 12
+    while position + 8 <= len(data):
+        kind = data[position : position + 4]
+        (length,) = struct.unpack_from("<I", data, position + 4)
+        chunk = data[position + 8 : position + 8 + length]
+        if kind == b"VP8X" and len(chunk) >= 10:
+            info.width = int.from_bytes(chunk[4:7], "little") + 1
+            info.height = int.from_bytes(chunk[7:10], "little") + 1
+        elif kind == b"VP8 " and info.width is None and len(chunk) >= 10:
+            width, height = struct.unpack_from("<HH", chunk, 6)
+            info.width, info.height = width & 0x3FFF, height & 0x3FFF
+            break
+        elif kind == b"VP8L" and info.width is None and len(chunk) >= 5:
+            (bits,) = struct.unpack_from("<I", chunk, 1)
+            info.width = (bits & 0x3FFF) + 1
+            info.height = ((bits >> 14) & 0x3FFF) + 1
+            break
+        elif kind == b"EXIF":
+            exif = chunk[6:] if chunk.startswith(b"Exif\x00\x00") else chunk
+            info.orientation, info.taken_at = parse_exif(exif)
+        # Chunks are padded to an even size
+        position += 8 + length + (length & 1)
+    return info
+
+
+def parse_header(data: bytes) -> Optional[ImageInfo]:
+    """
+    Metadata from the first bytes of a file, None for unknown formats
+    """
+    if data.startswith(b"\xff\xd8\xff"):
+        info = _parse_jpeg(data)
+    elif data.startswith(b"\x89PNG\r\n\x1a\n") and data[12:16] == b"IHDR":
+        info = ImageInfo("image/png")
+        if len(data) >= 24:
+            info.width, info.height = struct.unpack_from(">II", data, 16)
+    elif data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        width, height = struct.unpack_from("<HH", data, 6)
+        info = ImageInfo("image/gif", width, height)
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        info = _parse_webp(data)
+    else:
+        return None
+
+    if info.orientation is not None and info.orientation >= 5:
+        # Rotated by 90 degrees when displayed
+        info.width, info.height = info.height, info.width
+    return info
+
+
+class HeaderSniffer:
+    """
+    Pass-through for a chunk stream keeping its first `limit` bytes:
+
+        sniffer = HeaderSniffer()
+        blob = await store.put(sniffer.tap(chunks))
+        info = sniffer.info()
+    """
+
+    def __init__(self, limit: int = HEADER_LIMIT) -> None:
+        self.limit = limit
+        self._head = bytearray()
+
+    async def tap(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in chunks:
+            if len(self._head) < self.limit:
+                self._head += chunk[: self.limit - len(self._head)]
+            yield chunk
+
+    def info(self) -> Optional[ImageInfo]:
+        return parse_header(bytes(self._head))
@@ -0,0 +1,277 @@
+"""
+Request timing and Prometheus metrics of this process.
+
+`RequestTiming` collects how long the current request spent per phase:
+`auth` (token and password checks, including their queries), `db` (every
+cursor execute, see `instrument_engine`) and `serialization` (JSON
+encoding). It lives in a context variable set by `TimingMiddleware`
+(`app/api/middleware.py`), code anywhere in the request adds to it with:
+
+    with measure("auth"):
+        ...
+
+`REGISTRY` holds the counters, gauges and histograms served in the
+Prometheus text format by `GET /metrics`. Values are per process, Prometheus
+aggregates the workers of a host.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+PHASES = ("auth", "db", "serialization")
+
+# Prometheus client defaults, in seconds
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.075,
+    0.1,
+    0.25,
+    0.5,
+    0.75,
+    1.0,
+    2.5,
+    5.0,
+    7.5,
+    10.0,
+)
+
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Labels = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class _Value(Metric):
+    """
+    One value per label set, changed directly, or read from `function`
+    (no labels) on every scrape
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Labels = (),
+        function: Optional[Callable[[], float]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.function = function
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        values = {(): self.function()} if self.function is not None else self._values
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Counter(_Value):
+    """
+    Counter incremented directly, or read from `function` (a total kept
+    elsewhere, that only grows) on every scrape
+    """
+
+    kind = "counter"
+
+
+class Gauge(_Value):
+    """
+    Gauge set directly, or read from `function` on every scrape
+    """
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Labels = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = (*buckets, float("inf"))
+        # Per label values: count per bucket (not cumulative), sum
+        self._values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts, total = self._values.setdefault(
+            labels, ([0] * len(self.buckets), [0.0])
+        )
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        total[0] += value
+
+    def samples(self) -> Iterator[str]:
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield (
+                    f"{self.name}_bucket{_format_labels(self.labels, labels, le)}"
+                    f" {cumulative}"
+                )
+            label_text = _format_labels(self.labels, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(total[0])}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self.metrics.values())
+
+
+REGISTRY = Registry()
+
+requests_total = REGISTRY.register(
+    Counter(
+        "http_requests_total",
+        "HTTP requests by route and status",
+        ("method", "route", "status"),
+    )
+)
+requests_in_progress = REGISTRY.register(
+    Gauge("http_requests_in_progress", "HTTP requests being handled", ("method",))
+)
+request_duration = REGISTRY.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time until the response starts, by route",
+        ("method", "route"),
+    )
+)
+request_phase_duration = REGISTRY.register(
+    Histogram(
+        "http_request_phase_seconds",
+        "Time spent per request in auth, db and serialization, by route",
+        ("route", "phase"),
+    )
+)
+
+
+class RequestTiming:
+    def __init__(self) -> None:
+        self.phases: dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self._active: set[str] = set()
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        # Nested measures of a phase (e.g. hashing inside authenticate) count once
+        if phase in self._active:
+            yield
+            return
+        self._active.add(phase)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] += time.perf_counter() - start
+            self._active.discard(phase)
+
+    def server_timing(self, total: float) -> str:
+        entries = [
+            f"{phase};dur={seconds * 1000:.1f}"
+            for phase, seconds in self.phases.items()
+            if seconds
+        ]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+current_timing: ContextVar[Optional[RequestTiming]] = ContextVar(
+    "current_timing", default=None
+)
+
+
+@contextmanager
+def measure(phase: str) -> Iterator[None]:
+    timing = current_timing.get()
+    if timing is None:
+        yield
+        return
+    with timing.measure(phase):
+        yield
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Add the duration of every statement to the `db` phase of the request
+    """
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        timing = current_timing.get()
+        if timing is not None:
+            timing.phases["db"] += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_start"):
+            connection.info["query_start"].pop()
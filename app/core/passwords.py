@@ -0,0 +1,127 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is slow on purpose (100-250 ms per call at the default cost), running it
+in a coroutine freezes every other request of the process for that long.
+Hashing and verification are sent to a dedicated thread pool of
+`PASSWORD_HASH_WORKERS` threads instead (bcrypt releases the GIL), so the
+event loop keeps serving while a login storm is hashed.
+
+Callers waiting for a worker are counted, once `PASSWORD_HASH_MAX_QUEUE` of them
+are queued new ones are rejected with 503 rather than piling up.
+Cost factor is `PASSWORD_HASH_ROUNDS`, see `app/benchmarks/password_hashing.py`
+to pick it for given hardware.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from app.core import config
+from app.core.metrics import measure
+
+T = TypeVar("T")
+
+
+def make_context(rounds: int) -> CryptContext:
+    return CryptContext(
+        schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=rounds
+    )
+
+
+pwd_context = make_context(config.settings.PASSWORD_HASH_ROUNDS)
+
+
+def get_password_hash(password: str) -> str:
+    """
+    Blocking variant, for scripts and tests that do not run on the event loop
+    """
+    return pwd_context.hash(password)
+
+
+class PasswordHasher:
+    def __init__(self, max_workers: int, max_queue: int) -> None:
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Maintained on the event loop thread only
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="password-hash"
+            )
+        return self._executor
+
+    @property
+    def queued(self) -> int:
+        return max(self.in_flight - self.max_workers, 0)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "running": min(self.in_flight, self.max_workers),
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_seconds_total": self.wait_seconds_total,
+        }
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent password operations",
+                headers={"Retry-After": "1"},
+            )
+
+        submitted = time.perf_counter()
+        self.in_flight += 1
+        try:
+            started, result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _timed, func, *args
+            )
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self.wait_seconds_total += started - submitted
+        return result
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def _timed(func: Callable[..., T], *args: Any) -> tuple[float, T]:
+    return time.perf_counter(), func(*args)
+
+
+hasher = PasswordHasher(
+    max_workers=config.settings.PASSWORD_HASH_WORKERS,
+    max_queue=config.settings.PASSWORD_HASH_MAX_QUEUE,
+)
+
+
+async def hash_password(password: str) -> str:
+    with measure("auth"):
+        return await hasher.run(pwd_context.hash, password)
+
+
+async def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, Optional[str]]:
+    with measure("auth"):
+        return await hasher.run(
+            pwd_context.verify_and_update, plain_password, hashed_password
+        )
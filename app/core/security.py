@@ -11,25 +11,84 @@ https://fastapi-users.github.io/fastapi-users/configuration/authentication/
 
 UserManager class is core fastapi users class with customizable attrs and methods
 https://fastapi-users.github.io/fastapi-users/configuration/user-manager/
-"""
+Password hashing is overridden to run in the pool from `app/core/passwords.py`.
 
+Users resolved from tokens are kept in `user_cache` (bounded, expiring no later
+than the token), so authenticated requests skip the JWT decoding and user
+SELECT. `UserManager` drops the entries of users it updates or deletes.
+"""
 
-from typing import Optional
+import time
+from typing import Any, Dict, Optional
 
+import jwt
 from fastapi import Request
+from fastapi.security import OAuth2PasswordRequestForm
 from fastapi_users.authentication import (
     AuthenticationBackend,
     BearerTransport,
     JWTStrategy,
 )
-from fastapi_users.manager import BaseUserManager
+from fastapi_users.jwt import decode_jwt
+from fastapi_users.manager import BaseUserManager, UserAlreadyExists, UserNotExists
+from pydantic import UUID4
 
 from app import schemas
-from app.core import config
+from app.core import config, passwords
+from app.core.cache import TTLCache
+from app.core.metrics import measure
+
+user_cache: TTLCache[str, schemas.UserDB] = TTLCache(
+    maxsize=config.settings.AUTH_CACHE_SIZE,
+    ttl=config.settings.AUTH_CACHE_TTL_SECONDS,
+)
+
+
+def invalidate_cached_user(user_id: UUID4) -> None:
+    user_cache.discard_where(lambda user: user.id == user_id)
+
+
+class CachedJWTStrategy(JWTStrategy):
+    async def read_token(
+        self, token: Optional[str], user_manager: BaseUserManager
+    ) -> Optional[schemas.UserDB]:
+        with measure("auth"):
+            return await self._read_token(token, user_manager)
+
+    async def _read_token(
+        self, token: Optional[str], user_manager: BaseUserManager
+    ) -> Optional[schemas.UserDB]:
+        if token is None:
+            return None
+
+        cached_user = user_cache.get(token)
+        if cached_user is not None:
+            return cached_user.copy()
+
+        try:
+            data = decode_jwt(token, self.secret, self.token_audience)
+            user_id = data.get("user_id")
+            if user_id is None:
+                return None
+        except jwt.PyJWTError:
+            return None
+
+        try:
+            user = await user_manager.get(UUID4(user_id))
+        except (ValueError, UserNotExists):
+            return None
+
+        expires_at = data.get("exp")
+        user_cache.set(
+            token,
+            user.copy(),
+            ttl=None if expires_at is None else expires_at - time.time(),
+        )
+        return user
 
 
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(
+    return CachedJWTStrategy(
         secret=config.settings.SECRET_KEY,
         lifetime_seconds=config.settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
     )
@@ -48,6 +107,76 @@ class UserManager(BaseUserManager[schemas.UserCreate, schemas.UserDB]):
     reset_password_token_secret = config.settings.SECRET_KEY
     verification_token_secret = config.settings.SECRET_KEY
 
+    async def create(
+        self,
+        user: schemas.UserCreate,
+        safe: bool = False,
+        request: Optional[Request] = None,
+    ) -> schemas.UserDB:
+        await self.validate_password(user.password, user)
+
+        existing_user = await self.user_db.get_by_email(user.email)
+        if existing_user is not None:
+            raise UserAlreadyExists()
+
+        hashed_password = await passwords.hash_password(user.password)
+        user_dict = (
+            user.create_update_dict() if safe else user.create_update_dict_superuser()
+        )
+        db_user = self.user_db_model(**user_dict, hashed_password=hashed_password)
+
+        created_user = await self.user_db.create(db_user)
+
+        await self.on_after_register(created_user, request)
+
+        return created_user
+
+    async def authenticate(
+        self, credentials: OAuth2PasswordRequestForm
+    ) -> Optional[schemas.UserDB]:
+        with measure("auth"):
+            return await self._authenticate(credentials)
+
+    async def _authenticate(
+        self, credentials: OAuth2PasswordRequestForm
+    ) -> Optional[schemas.UserDB]:
+        try:
+            user = await self.get_by_email(credentials.username)
+        except UserNotExists:
+            # Run the hasher to mitigate timing attack
+            await passwords.hash_password(credentials.password)
+            return None
+
+        verified, updated_password_hash = await passwords.verify_and_update_password(
+            credentials.password, user.hashed_password
+        )
+        if not verified:
+            return None
+        # Update password hash to a more robust one if needed
+        if updated_password_hash is not None:
+            user.hashed_password = updated_password_hash
+            await self.user_db.update(user)
+            invalidate_cached_user(user.id)
+
+        return user
+
+    async def _update(
+        self, user: schemas.UserDB, update_dict: Dict[str, Any]
+    ) -> schemas.UserDB:
+        if "password" in update_dict:
+            update_dict = dict(update_dict)
+            password = update_dict.pop("password")
+            await self.validate_password(password, user)
+            user.hashed_password = await passwords.hash_password(password)
+        updated_user = await super()._update(user, update_dict)
+        # Covers update, verify and reset password flows
+        invalidate_cached_user(user.id)
+        return updated_user
+
+    async def delete(self, user: schemas.UserDB) -> None:
+        await super().delete(user)
+        invalidate_cached_user(user.id)
+
     async def on_after_register(
         self, user: schemas.UserDB, request: Optional[Request] = None
     ):
@@ -0,0 +1,296 @@
+"""
+Content-addressed blob storage for image bytes.
+
+Blobs are stored under the hex SHA-256 digest of their content, database
+rows only keep the digest. `BlobStore.put` consumes an async iterable of
+chunks, hashing and writing them as they arrive, so memory use per upload
+is bounded by `WRITE_BUFFER_SIZE` regardless of the blob size. Its
+`reserve` callback runs once the digest is known, before the content is put
+in place, so a blob row (`app.blobs.reserve_blob`) exists for anything that
+ends up in the store, even if the upload fails afterwards.
+
+Backend is chosen with `BLOB_STORE_BACKEND` setting, see `get_blob_store`.
+Only the local filesystem backend exists for now.
+
+`UploadStaging` keeps the partial content of resumable uploads
+(`app/api/endpoints/uploads.py`) until they are finalized into the blob store.
+"""
+
+import fcntl
+import hashlib
+import os
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Optional,
+)
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core import config
+
+
+@dataclass(frozen=True)
+class StoredBlob:
+    digest: str
+    size: int
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class BlobStore(ABC):
+    @abstractmethod
+    async def put(
+        self,
+        chunks: AsyncIterable[bytes],
+        expected_digest: Optional[str] = None,
+        reserve: Optional[Callable[[StoredBlob], Awaitable[None]]] = None,
+    ) -> StoredBlob:
+        """
+        Store streamed content and return its digest and size, content not
+        matching `expected_digest` is not stored and raises `ChecksumMismatch`.
+        `reserve` is awaited with the digest and size before the content is
+        put in place
+        """
+
+    @abstractmethod
+    def stream(self, digest: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """
+        Yield bytes `start` (inclusive) to `end` (exclusive) of a blob
+        """
+
+    @abstractmethod
+    async def exists(self, digest: str) -> bool:
+        """
+        Whether content with this digest is stored
+        """
+
+    @abstractmethod
+    async def delete(self, digest: str) -> None:
+        """
+        Remove a blob, no error if it is not there
+        """
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blobs live in `<root>/<digest[:2]>/<digest[2:4]>/<digest>`.
+    Uploads are written to `<root>/tmp` first and renamed into place
+    once the digest is known, so a blob path never holds partial content.
+    """
+
+    WRITE_BUFFER_SIZE = 1024 * 1024
+    READ_CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+        self.tmp_dir = self.root / "tmp"
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    async def put(
+        self,
+        chunks: AsyncIterable[bytes],
+        expected_digest: Optional[str] = None,
+        reserve: Optional[Callable[[StoredBlob], Awaitable[None]]] = None,
+    ) -> StoredBlob:
+        hasher = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        tmp_path = self.tmp_dir / uuid.uuid4().hex
+        file = await run_in_threadpool(open, tmp_path, "wb")
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+                if len(buffer) >= self.WRITE_BUFFER_SIZE:
+                    await run_in_threadpool(_write, file, hasher, bytes(buffer))
+                    buffer.clear()
+            await run_in_threadpool(_write, file, hasher, bytes(buffer))
+            await run_in_threadpool(_sync_and_close, file)
+            digest = hasher.hexdigest()
+            if expected_digest is not None and digest != expected_digest:
+                raise ChecksumMismatch(digest)
+            blob = StoredBlob(digest=digest, size=size)
+            if reserve is not None:
+                await reserve(blob)
+            await run_in_threadpool(self._commit, tmp_path, digest)
+        except BaseException:
+            file.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return blob
+
+    def _commit(self, tmp_path: Path, digest: str) -> None:
+        path = self.path(digest)
+        if path.exists():
+            # Same digest, same bytes, nothing to do
+            tmp_path.unlink()
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def stream(self, digest: str, start: int, end: int) -> AsyncIterator[bytes]:
+        return _read(self.path(digest), start, end, self.READ_CHUNK_SIZE)
+
+    async def exists(self, digest: str) -> bool:
+        return await run_in_threadpool(self.path(digest).exists)
+
+    async def delete(self, digest: str) -> None:
+        await run_in_threadpool(self.path(digest).unlink, missing_ok=True)
+
+
+class StagingLocked(Exception):
+    pass
+
+
+class StagedFile:
+    """
+    Partial upload opened for appending, see `UploadStaging.open`
+    """
+
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+        self.offset = 0
+        self.hasher = hashlib.sha256()
+        self._buffer = bytearray()
+
+    async def seek(self, offset: int) -> None:
+        """
+        Continue at `offset`, dropping anything after it, restarts `hasher`
+        """
+        self._buffer.clear()
+        await run_in_threadpool(self.file.truncate, offset)
+        self.file.seek(offset)
+        self.offset = offset
+        self.hasher = hashlib.sha256()
+
+    async def write(self, chunk: bytes) -> None:
+        self._buffer += chunk
+        self.offset += len(chunk)
+        if len(self._buffer) >= UploadStaging.WRITE_BUFFER_SIZE:
+            await run_in_threadpool(_write, self.file, self.hasher, bytes(self._buffer))
+            self._buffer.clear()
+
+    async def flush(self) -> None:
+        await run_in_threadpool(_write, self.file, self.hasher, bytes(self._buffer))
+        self._buffer.clear()
+        await run_in_threadpool(_sync, self.file)
+
+
+class UploadStaging:
+    """
+    Partial uploads live in `<root>/<upload_id>`, on the local filesystem,
+    so every process handling an upload's requests must share `root`.
+    Appends take an exclusive `flock` on the file.
+    """
+
+    WRITE_BUFFER_SIZE = 1024 * 1024
+    READ_CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, upload_id: str) -> Path:
+        return self.root / upload_id
+
+    async def create(self, upload_id: str) -> None:
+        await run_in_threadpool(self.path(upload_id).touch, exist_ok=False)
+
+    @asynccontextmanager
+    async def open(self, upload_id: str) -> AsyncIterator[StagedFile]:
+        """
+        Staged file for appending, `StagingLocked` if another request
+        is appending to it
+        """
+        file = await run_in_threadpool(open, self.path(upload_id), "r+b")
+        try:
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise StagingLocked(upload_id)
+            # Closing the file releases the lock
+            yield StagedFile(file)
+        finally:
+            await run_in_threadpool(file.close)
+
+    def stream(self, upload_id: str, size: int) -> AsyncIterator[bytes]:
+        return _read(self.path(upload_id), 0, size, self.READ_CHUNK_SIZE)
+
+    async def delete(self, upload_id: str) -> None:
+        await run_in_threadpool(self.path(upload_id).unlink, missing_ok=True)
+
+    def _modified_before(self, before: float) -> list[str]:
+        upload_ids = []
+        for path in self.root.iterdir():
+            try:
+                if path.stat().st_mtime < before:
+                    upload_ids.append(path.name)
+            except FileNotFoundError:
+                pass
+        return upload_ids
+
+    async def modified_before(self, before: float) -> list[str]:
+        """
+        Uploads not written to since `before` (a timestamp)
+        """
+        return await run_in_threadpool(self._modified_before, before)
+
+
+async def _read(
+    path: Path, start: int, end: int, chunk_size: int
+) -> AsyncIterator[bytes]:
+    fd = await run_in_threadpool(os.open, path, os.O_RDONLY)
+    try:
+        offset = start
+        while offset < end:
+            count = min(chunk_size, end - offset)
+            chunk = await run_in_threadpool(os.pread, fd, count, offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+    finally:
+        os.close(fd)
+
+
+def _write(file: BinaryIO, hasher, data: bytes) -> None:
+    # hashlib releases the GIL for large buffers, keep it off the event loop
+    hasher.update(data)
+    file.write(data)
+
+
+def _sync(file: BinaryIO) -> None:
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def _sync_and_close(file: BinaryIO) -> None:
+    _sync(file)
+    file.close()
+
+
+@lru_cache()
+def get_blob_store() -> BlobStore:
+    if config.settings.BLOB_STORE_BACKEND == "local":
+        return LocalBlobStore(config.settings.BLOB_STORE_PATH)
+    raise ValueError(f"Unknown blob store {config.settings.BLOB_STORE_BACKEND}")
+
+
+@lru_cache()
+def get_upload_staging() -> UploadStaging:
+    return UploadStaging(config.settings.UPLOAD_STAGING_PATH)
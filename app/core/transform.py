@@ -0,0 +1,257 @@
+"""
+Resized / transcoded variants ("derivatives") of stored images.
+
+Decoding and encoding are CPU bound and hold the GIL, they run in a process
+pool of `TRANSFORM_WORKERS` processes so the event loop keeps serving.
+
+A derivative is fully determined by the source digest and the
+`TransformSpec`, so it is cached under that key forever:
+
+1. `BytesLRUCache` in memory, bounded by `TRANSFORM_MEMORY_CACHE_BYTES`
+2. `DiskCache` under `TRANSFORM_DISK_CACHE_PATH`, bounded by
+   `TRANSFORM_DISK_CACHE_BYTES` and shared by the workers of one host
+
+Concurrent requests for a derivative that is in neither tier wait for the
+one render already in progress instead of starting their own.
+"""
+
+import asyncio
+import hashlib
+import io
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Optional, Union
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core import config
+from app.core.cache import BytesLRUCache, DiskCache
+from app.core.imageinfo import EXIF_ORIENTATION
+from app.core.storage import BlobStore, LocalBlobStore
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+MAX_DIMENSION = 4096
+# Largest source decoded, guards the workers against decompression bombs
+MAX_SOURCE_PIXELS = 64_000_000
+
+
+class Fit(str, Enum):
+    contain = "contain"  # fit inside the box, keep aspect ratio
+    cover = "cover"  # fill the box, keep aspect ratio, crop the overflow
+    fill = "fill"  # stretch to the box
+
+
+class OutputFormat(str, Enum):
+    webp = "webp"
+    jpeg = "jpeg"
+    png = "png"
+
+    @property
+    def media_type(self) -> str:
+        return f"image/{self.value}"
+
+
+@dataclass(frozen=True)
+class TransformSpec:
+    width: Optional[int]
+    height: Optional[int]
+    fit: Fit
+    format: OutputFormat
+    quality: int = 80
+
+    def cache_key(self, digest: str) -> str:
+        spec = f"{self.width}x{self.height}-{self.fit.value}-q{self.quality}"
+        key = hashlib.sha256(f"{digest}:{spec}".encode()).hexdigest()
+        return f"{key}.{self.format.value}"
+
+
+class TransformError(Exception):
+    """
+    Source could not be decoded as an image
+    """
+
+
+def negotiate_format(accept: str, source_mime: Optional[str]) -> Optional[OutputFormat]:
+    """
+    Pick the output format from the `Accept` header, WebP when the client takes
+    it, otherwise the format of the source if possible. None when the client
+    accepts none of the formats.
+    """
+    accepted: dict[str, float] = {}
+    for item in (accept or "*/*").split(","):
+        media_range, *params = [value.strip() for value in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[media_range.lower()] = quality
+
+    def q(media_type: str) -> float:
+        for media_range in (media_type, "image/*", "*/*"):
+            if media_range in accepted:
+                return accepted[media_range]
+        return 0.0
+
+    preferred = [OutputFormat.webp]
+    if source_mime == OutputFormat.png.media_type:
+        preferred += [OutputFormat.png, OutputFormat.jpeg]
+    else:
+        preferred += [OutputFormat.jpeg, OutputFormat.png]
+    best = max(preferred, key=lambda fmt: q(fmt.media_type))
+    return best if q(best.media_type) > 0 else None
+
+
+def render(source: Union[Path, bytes], spec: TransformSpec) -> bytes:
+    """
+    Decode `source` (file path or content), resize and encode it,
+    runs in a worker process
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+    try:
+        image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+        # Orientations 5 to 8 are stored rotated by 90 degrees
+        rotated = image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8)
+        width, height = image.size[::-1] if rotated else image.size
+        if spec.width and spec.height:
+            box = (spec.width, spec.height)
+        else:
+            ratio = width / height
+            box = (
+                spec.width or max(round(spec.height * ratio), 1),
+                spec.height or max(round(spec.width / ratio), 1),
+            )
+        # Let JPEG decode at a reduced scale when much larger than the target,
+        # before the transpose, in the stored orientation
+        image.draft("RGB", box[::-1] if rotated else box)
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise TransformError(str(e)) from e
+
+    if spec.format == OutputFormat.jpeg:
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert("RGBA")
+
+    resample = Image.Resampling.LANCZOS
+    if spec.fit == Fit.cover:
+        image = ImageOps.fit(image, box, method=resample)
+    elif spec.fit == Fit.fill:
+        image = image.resize(box, resample=resample)
+    else:
+        image.thumbnail(box, resample=resample)
+
+    output = io.BytesIO()
+    options: dict[str, Any] = {}
+    if spec.format in (OutputFormat.webp, OutputFormat.jpeg):
+        options["quality"] = spec.quality
+    if spec.format == OutputFormat.jpeg:
+        options["progressive"] = True
+    image.save(output, format=spec.format.value.upper(), **options)
+    return output.getvalue()
+
+
+class DerivativeCache:
+    def __init__(
+        self,
+        memory: BytesLRUCache,
+        disk: DiskCache,
+        workers: int,
+    ) -> None:
+        self.memory = memory
+        self.disk = disk
+        self.workers = workers
+        self.renders = 0
+        self._executor: Optional["ProcessPoolExecutor"] = None
+        self._pending: dict[str, asyncio.Task] = {}
+
+    @property
+    def executor(self) -> "ProcessPoolExecutor":
+        if self._executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Forking a process running the event loop and the DB pool is unsafe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def get(self, key: str, produce: Callable[[], Awaitable[bytes]]) -> bytes:
+        """
+        Derivative under `key`, calling `produce` only if no tier has it
+        and no other request is producing it already
+        """
+        data = self.memory.get(key)
+        if data is not None:
+            return data
+
+        task = self._pending.get(key)
+        if task is None:
+            # Own task, a client going away must not cancel the others' render
+            task = asyncio.create_task(self._load(key, produce))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._done(key))
+        return await asyncio.shield(task)
+
+    def _done(self, key: str) -> None:
+        task = self._pending.pop(key)
+        if not task.cancelled():
+            # Every waiter may be gone, mark the exception as retrieved
+            task.exception()
+
+    async def _load(self, key: str, produce: Callable[[], Awaitable[bytes]]) -> bytes:
+        data = await run_in_threadpool(self.disk.get, key)
+        if data is None:
+            data = await produce()
+            self.renders += 1
+            await run_in_threadpool(self.disk.set, key, data)
+        self.memory.set(key, data)
+        return data
+
+    async def render(self, source: Union[Path, bytes], spec: TransformSpec) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, render, source, spec
+        )
+
+    async def render_blob(
+        self, store: BlobStore, digest: str, size: int, spec: TransformSpec
+    ) -> bytes:
+        if isinstance(store, LocalBlobStore):
+            # Workers read the file themselves, no bytes through the pipe
+            return await self.render(store.path(digest), spec)
+        chunks = [chunk async for chunk in store.stream(digest, 0, size)]
+        return await self.render(b"".join(chunks), spec)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "renders": self.renders,
+            "in_progress": len(self._pending),
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats(),
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+derivatives = DerivativeCache(
+    memory=BytesLRUCache(config.settings.TRANSFORM_MEMORY_CACHE_BYTES),
+    disk=DiskCache(
+        config.settings.TRANSFORM_DISK_CACHE_PATH,
+        config.settings.TRANSFORM_DISK_CACHE_BYTES,
+    ),
+    workers=config.settings.TRANSFORM_WORKERS,
+)
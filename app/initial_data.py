@@ -8,12 +8,12 @@ By default `main` create a superuser if it does not exist.
 import asyncio
 from typing import Optional
 
-from fastapi_users.password import get_password_hash
 from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
 from sqlalchemy import select
 
 from app import schemas
 from app.core import config
+from app.core.passwords import hash_password
 from app.models import UserTable
 from app.session import async_session
 
@@ -35,7 +35,7 @@ async def main() -> None:
                     email=config.settings.FIRST_SUPERUSER_EMAIL,
                     is_superuser=True,
                     is_verified=True,
-                    hashed_password=get_password_hash(
+                    hashed_password=await hash_password(
                         config.settings.FIRST_SUPERUSER_PASSWORD
                     ),
                 )
@@ -0,0 +1,176 @@
+"""
+Durable background jobs in the `job` table.
+
+Jobs are enqueued with `enqueue` in the caller's transaction, so a job
+exists if and only if the change that needs it was committed. Workers
+(`app/worker.py`) claim batches with `SELECT ... FOR UPDATE SKIP LOCKED`,
+so concurrent workers never block on or claim each other's jobs.
+
+Delivery is at least once: a claim hides the job for
+`JOB_VISIBILITY_TIMEOUT_SECONDS`, a job the worker did not finish or fail
+by then (crash, deploy) is claimed again. Failed jobs are retried with
+exponential backoff until they run out of attempts. Handlers must
+therefore be idempotent.
+
+Handlers are registered by kind, see `app/tasks.py`:
+
+    @handler("image.prerender")
+    async def prerender(payload: dict) -> None:
+        ...
+"""
+
+import random
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import config
+from app.models import Job
+
+Handler = Callable[[dict[str, Any]], Awaitable[None]]
+
+HANDLERS: dict[str, Handler] = {}
+
+
+def handler(kind: str) -> Callable[[Handler], Handler]:
+    def register(func: Handler) -> Handler:
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+@dataclass
+class ClaimedJob:
+    id: int
+    kind: str
+    payload: dict[str, Any]
+    # Attempt number of this claim, 1 for the first run
+    attempts: int
+    max_attempts: int
+
+
+async def enqueue(
+    session: AsyncSession,
+    jobs: list[tuple[str, dict[str, Any]]],
+    delay_seconds: float = 0,
+) -> None:
+    """
+    Add (kind, payload) jobs, committed with the caller's transaction
+    """
+    if not jobs:
+        return
+    await session.execute(
+        insert(Job).values(
+            [
+                {
+                    "kind": kind,
+                    "payload": payload,
+                    "max_attempts": config.settings.JOB_MAX_ATTEMPTS,
+                    "run_at": func.now() + timedelta(seconds=delay_seconds),
+                }
+                for kind, payload in jobs
+            ]
+        )
+    )
+
+
+async def claim(
+    session: AsyncSession, limit: int, visibility_timeout: float
+) -> list[ClaimedJob]:
+    """
+    Claim up to `limit` due jobs, oldest first, and commit the claim.
+
+    Due jobs already claimed `max_attempts` times were lost by their workers
+    on the last attempt (e.g. the job killed its worker), they are marked
+    failed instead.
+    """
+    await session.execute(
+        update(Job)
+        .where(
+            Job.status == "pending",
+            Job.run_at <= func.now(),
+            Job.attempts >= Job.max_attempts,
+        )
+        .values(
+            status="failed",
+            last_error=func.coalesce(Job.last_error + "\n", "")
+            + "Not finished by its worker on the last attempt",
+        )
+        .execution_options(synchronize_session=False)
+    )
+    due = (
+        select(Job.id)
+        .where(
+            Job.status == "pending",
+            Job.run_at <= func.now(),
+            Job.attempts < Job.max_attempts,
+        )
+        .order_by(Job.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(Job)
+        .where(Job.id.in_(due))
+        .values(
+            attempts=Job.attempts + 1,
+            run_at=func.now() + timedelta(seconds=visibility_timeout),
+        )
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+        .execution_options(synchronize_session=False)
+    )
+    jobs = [ClaimedJob(**row._mapping) for row in result.all()]
+    await session.commit()
+    return jobs
+
+
+async def complete(session: AsyncSession, job: ClaimedJob) -> None:
+    # A job claimed again after its visibility timeout belongs to the new claim
+    await session.execute(
+        delete(Job)
+        .where(Job.id == job.id, Job.attempts == job.attempts)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+
+
+def backoff_seconds(attempts: int) -> float:
+    """
+    Exponential, with jitter so failed batches do not retry in lockstep
+    """
+    delay = min(
+        config.settings.JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+        config.settings.JOB_RETRY_MAX_SECONDS,
+    )
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def fail(
+    session: AsyncSession, job: ClaimedJob, error: str, retry: bool = True
+) -> None:
+    """
+    Schedule a retry, or mark the job failed when it is out of attempts
+    """
+    values: dict[str, Any] = {"last_error": error}
+    if retry and job.attempts < job.max_attempts:
+        values["run_at"] = func.now() + timedelta(seconds=backoff_seconds(job.attempts))
+    else:
+        values["status"] = "failed"
+    await session.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.attempts == job.attempts)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+
+
+class PermanentJobError(Exception):
+    """
+    Raised by handlers for jobs that can never succeed, no retries
+    """
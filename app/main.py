@@ -1,13 +1,22 @@
 """
 Main FastAPI app instance declaration
+
+Importing this module only declares routes, the database engine and the
+rendered pages are created on startup and released on shutdown, see
+`app/benchmarks/cold_start.py`. With `JOB_WORKER_IN_APP` a job worker
+(`app/worker.py`) runs alongside the app as well.
 """
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.api import api_router
-from app.api.pages import page_router
+from app.api.middleware import ReadYourWritesMiddleware, TimingMiddleware
+from app.api.pages import page_router, render_pages
 from app.core import config
+from app.core.passwords import hasher
+from app.core.transform import derivatives
+from app.session import dispose_engine, get_router
 
 app = FastAPI(
     title=config.settings.PROJECT_NAME,
@@ -27,5 +36,34 @@ if config.settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+app.add_middleware(ReadYourWritesMiddleware)
+
+# Outermost, so the timing covers the other middleware too
+app.add_middleware(TimingMiddleware)
+
 app.include_router(api_router)
 app.include_router(page_router)
+
+
+@app.on_event("startup")
+async def startup() -> None:
+    get_router()
+    render_pages()
+    if config.settings.JOB_WORKER_IN_APP:
+        from app.worker import get_worker
+
+        app.state.worker = get_worker()
+        app.state.worker.start()
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    worker = getattr(app.state, "worker", None)
+    if worker is not None:
+        # Lets the running jobs finish, unclaimed ones stay queued
+        worker.stop()
+        await worker.join()
+        del app.state.worker
+    hasher.shutdown()
+    derivatives.shutdown()
+    await dispose_engine()
@@ -7,18 +7,25 @@ Note, imported by alembic migrations logic, see `alembic/env.py`
 from typing import Any, cast
 
 from fastapi_users_db_sqlalchemy import SQLAlchemyBaseUserTable
+from fastapi_users_db_sqlalchemy.guid import GUID
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm.decl_api import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
+    DateTime,
     ForeignKey,
+    Index,
     Integer,
+    SmallInteger,
     String,
     Text,
     delete,
     func,
     select,
+    text,
     update,
 )
 
@@ -30,13 +37,107 @@ class UserTable(Base, SQLAlchemyBaseUserTable):
     images = relationship("Image", back_populates="user")
     pass
 
+
+# FastAPI Users compares emails without case, so do signups and imports
+Index("ix_user_email_lower", func.lower(UserTable.__table__.c.email), unique=True)
+
+
 class Image(Base):
 
     __tablename__ = "image"
+    __table_args__ = (
+        # Keyset pagination of user's images, see GET /images
+        Index("ix_image_user_id_id", "user_id", "id"),
+        Index("ix_image_user_id_taken_at", "user_id", "taken_at"),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     title = Column(String)
-    base64 = Column(Text)
 
-    user_id = Column(Integer, ForeignKey("user.id"))
+    # Hex SHA-256 of the content, key in the blob store (app/core/storage.py)
+    digest = Column(String(64), ForeignKey("blob.digest"))
+    size = Column(BigInteger)
+    mime_type = Column(String(255))
+    # Read from the file headers at upload, see app/core/imageinfo.py
+    width = Column(Integer)
+    height = Column(Integer)
+    orientation = Column(SmallInteger)
+    taken_at = Column(DateTime(timezone=True))
+
+    user_id = Column(GUID, ForeignKey("user.id"))
     user = relationship("UserTable", back_populates="images")
+
+
+class Blob(Base):
+    """
+    Blob store content shared by all images with the same digest,
+    `refcount` is the number of images pointing at it, see `app/blobs.py`.
+    """
+
+    __tablename__ = "blob"
+
+    digest = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    # When refcount dropped to zero, content is removed after a grace period
+    released_at = Column(DateTime(timezone=True))
+
+
+class Upload(Base):
+    """
+    Resumable upload in progress, see `app/api/endpoints/uploads.py`.
+    `received` bytes of `length` are in the upload staging area, the row
+    goes away when the upload is finalized into an image or collected as
+    stale by `app/uploads.py`.
+    """
+
+    __tablename__ = "upload"
+
+    # Random hex, also the name of the staged file
+    id = Column(String(32), primary_key=True)
+    user_id = Column(GUID, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    length = Column(BigInteger, nullable=False)
+    received = Column(BigInteger, nullable=False, server_default="0")
+    filename = Column(String)
+    mime_type = Column(String(255), nullable=False)
+    title = Column(String)
+    # Hex SHA-256 the client expects, checked when finalizing
+    checksum = Column(String(64))
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now(), index=True
+    )
+
+
+class Job(Base):
+    """
+    Background job, see `app/jobs.py`.
+
+    A pending job can be claimed once `run_at` has passed, claiming pushes
+    `run_at` by the visibility timeout, so jobs of a crashed worker are
+    claimed again. Finished jobs are deleted, jobs out of attempts are kept
+    as failed.
+    """
+
+    __tablename__ = "job"
+    __table_args__ = (
+        Index(
+            "ix_job_pending_run_at",
+            "run_at",
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    kind = Column(String(64), nullable=False)
+    payload = Column(JSONB, nullable=False, server_default=text("'{}'"))
+    status = Column(String(16), nullable=False, server_default="pending")
+    attempts = Column(Integer, nullable=False, server_default="0")
+    max_attempts = Column(Integer, nullable=False)
+    run_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_error = Column(Text)
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
@@ -0,0 +1,274 @@
+"""
+Online backfill of legacy inline image payloads into the blob store.
+
+Images uploaded before the blob store keep their bytes base64 encoded in
+`image_payload`, a third larger than the content and decoded on every read.
+This moves them into the blob store, batch by batch in `image_payload`
+key order, while the app keeps serving:
+
+    python -m app.payload_backfill --batch-size 100 --sleep 0.1
+
+Every batch is decoded, its blob rows are created without references (see
+`app.blobs.reserve_blobs`) and the content is written to the blob store,
+then one short transaction points the images at their blobs (filling in
+dimensions from the headers when unset) and deletes the payload rows. The transaction only
+takes row locks, and with `lock_timeout` set it gives up instead of queueing
+behind a busy image row. A batch that keeps timing out is skipped and left
+for the next run. Converted rows are gone from `image_payload`, so a rerun
+simply continues with what is left. Content written by a run that stopped
+before pointing images at it has its blob row and is deleted by the garbage
+collection (`python -m app.blobs`) after the grace period.
+
+Cutover: once this reports nothing left, `alembic upgrade head` drops
+`image_payload` (the migration refuses while rows remain). Run the backfill
+while the previous release still serves, then migrate and switch over.
+"""
+
+import argparse
+import asyncio
+import base64
+import binascii
+import hashlib
+import sys
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    Table,
+    Text,
+    bindparam,
+    delete,
+    func,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.blobs import add_references, release_reference, reserve_blobs
+from app.core.imageinfo import ImageInfo, parse_header
+from app.core.storage import BlobStore, StoredBlob, get_blob_store
+from app.models import Image
+from app.session import async_session, dispose_engine
+
+# Not in app.models, the table goes away at cutover
+metadata = MetaData()
+image_payload = Table(
+    "image_payload",
+    metadata,
+    Column("image_id", Integer, primary_key=True),
+    Column("base64", Text, nullable=False),
+)
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+@dataclass
+class Converted:
+    image_id: int
+    blob: StoredBlob
+    info: Optional[ImageInfo]
+
+
+@dataclass
+class Progress:
+    total: int
+    converted: int = 0
+    skipped: int = 0
+    invalid: int = 0
+    lock_timeouts: int = 0
+
+
+async def _single(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+async def store_batch(
+    session: AsyncSession, store: BlobStore, rows: list, progress: Progress
+) -> list[Converted]:
+    decoded = []
+    for row in rows:
+        try:
+            data = base64.b64decode(row.base64, validate=True)
+        except binascii.Error:
+            progress.invalid += 1
+            print(f"image {row.image_id}: invalid base64, left", file=sys.stderr)
+            continue
+        blob = StoredBlob(digest=hashlib.sha256(data).hexdigest(), size=len(data))
+        decoded.append((row.image_id, blob, data))
+    if not decoded:
+        return []
+
+    # Known to the garbage collection before any byte is written
+    await reserve_blobs(session, [blob for _, blob, _ in decoded])
+    await session.commit()
+    converted = []
+    for image_id, blob, data in decoded:
+        await store.put(_single(data), expected_digest=blob.digest)
+        converted.append(Converted(image_id, blob, parse_header(data)))
+    return converted
+
+
+async def apply_batch(
+    session: AsyncSession, batch: list[Converted], lock_timeout_ms: int
+) -> int:
+    """
+    Point images at their blobs and drop their payloads, returns images updated
+    """
+    await session.execute(text(f"SET LOCAL lock_timeout = {int(lock_timeout_ms)}"))
+    ids = [item.image_id for item in batch]
+    # Images deleted meanwhile, or already converted, are left out
+    result = await session.execute(
+        select(Image.id)
+        .where(Image.id.in_(ids), Image.digest.is_(None))
+        .order_by(Image.id)
+        .with_for_update()
+    )
+    locked = set(result.scalars().all())
+    targets = [item for item in batch if item.image_id in locked]
+
+    if targets:
+        await add_references(session, [item.blob for item in targets])
+        await session.execute(
+            update(Image)
+            .where(Image.id == bindparam("b_image_id"))
+            .values(
+                digest=bindparam("b_digest"),
+                size=bindparam("b_size"),
+                mime_type=func.coalesce(bindparam("b_mime_type"), Image.mime_type),
+                width=func.coalesce(Image.width, bindparam("b_width")),
+                height=func.coalesce(Image.height, bindparam("b_height")),
+                orientation=func.coalesce(
+                    Image.orientation, bindparam("b_orientation")
+                ),
+                taken_at=func.coalesce(Image.taken_at, bindparam("b_taken_at")),
+            )
+            .execution_options(synchronize_session=False),
+            [
+                {
+                    "b_image_id": item.image_id,
+                    "b_digest": item.blob.digest,
+                    "b_size": item.blob.size,
+                    "b_mime_type": item.info.mime_type if item.info else None,
+                    "b_width": item.info.width if item.info else None,
+                    "b_height": item.info.height if item.info else None,
+                    "b_orientation": item.info.orientation if item.info else None,
+                    "b_taken_at": item.info.taken_at if item.info else None,
+                }
+                for item in targets
+            ],
+        )
+    await release_blobs(
+        session, [item.blob for item in batch if item.image_id not in locked]
+    )
+    await session.execute(
+        delete(image_payload).where(image_payload.c.image_id.in_(ids))
+    )
+    await session.commit()
+    return len(targets)
+
+
+async def release_blobs(session: AsyncSession, blobs: list[StoredBlob]) -> None:
+    """
+    Hand blobs stored for nothing to the garbage collection
+    """
+    if not blobs:
+        return
+    await add_references(session, blobs)
+    for blob in blobs:
+        await release_reference(session, blob.digest)
+
+
+def _lock_timed_out(error: DBAPIError) -> bool:
+    return getattr(error.orig, "sqlstate", None) == LOCK_NOT_AVAILABLE
+
+
+async def backfill(
+    store: BlobStore,
+    batch_size: int,
+    sleep: float,
+    lock_timeout_ms: int,
+    max_retries: int,
+) -> Progress:
+    async with async_session() as session:
+        result = await session.execute(select(func.count()).select_from(image_payload))
+        progress = Progress(total=result.scalar())
+        await session.release()
+
+        started = time.monotonic()
+        last_id = 0
+        while True:
+            result = await session.execute(
+                select(image_payload.c.image_id, image_payload.c.base64)
+                .where(image_payload.c.image_id > last_id)
+                .order_by(image_payload.c.image_id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+            # No transaction is held while blobs are written
+            await session.release()
+            if not rows:
+                break
+            last_id = rows[-1].image_id
+
+            batch = await store_batch(session, store, rows, progress)
+            for attempt in range(max_retries + 1):
+                try:
+                    progress.converted += await apply_batch(
+                        session, batch, lock_timeout_ms
+                    )
+                    break
+                except DBAPIError as e:
+                    await session.rollback()
+                    if not _lock_timed_out(e):
+                        raise
+                    progress.lock_timeouts += 1
+                    await asyncio.sleep(sleep * 2**attempt)
+            else:
+                progress.skipped += len(batch)
+                await release_blobs(session, [item.blob for item in batch])
+                await session.commit()
+
+            seconds = time.monotonic() - started
+            print(
+                f"{progress.converted}/{progress.total} converted,"
+                f" {progress.skipped} skipped, {progress.invalid} invalid,"
+                f" {progress.lock_timeouts} lock timeouts,"
+                f" {progress.converted / seconds if seconds else 0:.0f} images/s",
+                file=sys.stderr,
+            )
+            await asyncio.sleep(sleep)
+    return progress
+
+
+async def main(args: argparse.Namespace) -> None:
+    try:
+        progress = await backfill(
+            get_blob_store(),
+            batch_size=args.batch_size,
+            sleep=args.sleep,
+            lock_timeout_ms=args.lock_timeout_ms,
+            max_retries=args.max_retries,
+        )
+    finally:
+        await dispose_engine()
+    left = progress.skipped + progress.invalid
+    print(f"Converted {progress.converted} images, {left} left")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--sleep", type=float, default=0.1, help="seconds between batches"
+    )
+    parser.add_argument("--lock-timeout-ms", type=int, default=2000)
+    parser.add_argument(
+        "--max-retries", type=int, default=5, help="per batch, on lock timeouts"
+    )
+    asyncio.run(main(parser.parse_args()))
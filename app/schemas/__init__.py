@@ -1,2 +1,2 @@
 from .user import User, UserCreate, UserDB, UserUpdate
-from .image import ImageCreate, Image
\ No newline at end of file
+from .image import ImageCreate, Image, ImagePage
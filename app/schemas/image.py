@@ -1,17 +1,42 @@
 from re import I
 import uuid
+from datetime import datetime
 from typing import Optional
 
 from fastapi_users import models
 from pydantic import UUID4, EmailStr, Field, BaseModel
 
-class ImageCreate(BaseModel):    
+
+class ImageCreate(BaseModel):
     title: Optional[str]
-    timestamp: str 
-    data: bytes
+    # Capture time, from the file's EXIF data when present
+    timestamp: Optional[datetime]
+    digest: str
+    size: int
+    mime_type: str
+    width: Optional[int]
+    height: Optional[int]
+    orientation: Optional[int]
+
 
-class Image(ImageCreate):
-    id: UUID4
+class Image(BaseModel):
+    id: int
     user_id: UUID4
-    title: str
-    base64: str
+    title: Optional[str]
+    # Unset for images without content, see app/payload_backfill.py
+    digest: Optional[str]
+    size: Optional[int]
+    mime_type: Optional[str]
+    width: Optional[int]
+    height: Optional[int]
+    orientation: Optional[int]
+    taken_at: Optional[datetime]
+
+    class Config:
+        orm_mode = True
+
+
+class ImagePage(BaseModel):
+    items: list[Image]
+    # Pass as `before` to get the next page, None on the last one
+    next_cursor: Optional[int]
@@ -1,13 +1,209 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+"""
+Async engine and session factory.
+
+Pool size, overflow, timeout, recycle, pre-ping and the asyncpg prepared
+statement cache come from `config.Settings` (`DATABASE_*`).
+`pool_stats` reports live usage of the pool, including how long requests
+waited for a connection, to size the pool against the worker count, for
+the primary and every replica separately.
+
+Sessions check a connection out on their first statement and give it back
+when the transaction ends. `ReleasingSession.release` ends a transaction that
+only read, so endpoints that go on streaming do not keep the connection.
+
+The engine (and the asyncpg driver) is created by `get_engine` on first use,
+not on import, `app.main` creates it on startup.
+
+With `DATABASE_REPLICA_HOSTS` set, `EngineRouter` (`get_router`) hands out
+replica engines in turn for read-only work, `app.api.deps.get_session` binds
+sessions of GET and HEAD requests to them. Replicas lag behind the primary,
+so a client that wrote recently (`DATABASE_READ_YOUR_WRITES_SECONDS`) reads
+from the primary until the window has passed. The window travels with the
+client in a cookie (see `app/api/middleware.py`), so it holds whichever
+process serves the next request. Everything else, including
+`async_session()` without a `bind`, uses the primary.
+"""
+
+import itertools
+import time
+from functools import lru_cache
+from typing import Any
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm.session import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from app.core import config
+from app.core.metrics import instrument_engine
 
 if config.settings.ENVIRONMENT == "PYTEST":
     sqlalchemy_database_uri = config.settings.TEST_SQLALCHEMY_DATABASE_URI
 else:
     sqlalchemy_database_uri = config.settings.DEFAULT_SQLALCHEMY_DATABASE_URI
 
-import pdb; pdb.set_trace()
-async_engine = create_async_engine(sqlalchemy_database_uri, pool_pre_ping=True)
-async_session = sessionmaker(async_engine, expire_on_commit=False, class_=AsyncSession)
+
+class CheckoutStats:
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool measuring how long checkouts wait for a free connection
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = CheckoutStats()
+
+    def recreate(self) -> "TimedQueuePool":
+        # `engine.dispose()` replaces the pool, the stats carry on
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.stats.checkouts += 1
+            self.stats.wait_seconds_total += waited
+            self.stats.wait_seconds_max = max(self.stats.wait_seconds_max, waited)
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    engine = create_async_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=config.settings.DATABASE_POOL_SIZE,
+        max_overflow=config.settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=config.settings.DATABASE_POOL_TIMEOUT,
+        pool_recycle=config.settings.DATABASE_POOL_RECYCLE,
+        pool_pre_ping=config.settings.DATABASE_POOL_PRE_PING,
+        connect_args={
+            "prepared_statement_cache_size": (
+                config.settings.DATABASE_STATEMENT_CACHE_SIZE
+            )
+        },
+    )
+    instrument_engine(engine)
+    return engine
+
+
+@lru_cache(maxsize=None)
+def get_engine() -> AsyncEngine:
+    return _create_engine(sqlalchemy_database_uri)
+
+
+def replica_uris() -> list[str]:
+    """
+    URIs of the replicas, same database and credentials as the primary
+    """
+    url = make_url(sqlalchemy_database_uri)
+    uris = []
+    for host in config.settings.DATABASE_REPLICA_HOSTS:
+        hostname, _, port = host.partition(":")
+        replica = url.set(host=hostname, port=int(port) if port else url.port)
+        uris.append(replica.render_as_string(hide_password=False))
+    return uris
+
+
+class EngineRouter:
+    """
+    Primary engine for writes, replicas in turn for reads
+    """
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: list[AsyncEngine],
+        read_your_writes_seconds: float,
+    ) -> None:
+        self.primary = primary
+        self.replicas = replicas
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self._replicas = itertools.cycle(replicas)
+
+    def reader(self, primary_until: float = 0) -> AsyncEngine:
+        """
+        Next replica, the primary until the `time.time()` of `primary_until`
+        """
+        if not self.replicas:
+            return self.primary
+        now = time.time()
+        # Not trusted beyond the window, the value comes from the client
+        if now < primary_until <= now + self.read_your_writes_seconds:
+            return self.primary
+        return next(self._replicas)
+
+
+@lru_cache(maxsize=None)
+def get_router() -> EngineRouter:
+    return EngineRouter(
+        get_engine(),
+        [_create_engine(uri) for uri in replica_uris()],
+        config.settings.DATABASE_READ_YOUR_WRITES_SECONDS,
+    )
+
+
+class ReleasingSession(AsyncSession):
+    async def release(self) -> None:
+        """
+        End the current transaction if it has nothing to write,
+        returning its connection to the pool
+        """
+        if self.in_transaction() and not (self.new or self.dirty or self.deleted):
+            await self.commit()
+
+
+class _LazySessionmaker(sessionmaker):
+    def __call__(self, **local_kw: Any) -> ReleasingSession:
+        local_kw.setdefault("bind", get_engine())
+        return super().__call__(**local_kw)
+
+
+async_session = _LazySessionmaker(expire_on_commit=False, class_=ReleasingSession)
+
+
+async def dispose_engine() -> None:
+    if get_router.cache_info().currsize:
+        for replica in get_router().replicas:
+            await replica.dispose()
+    if get_engine.cache_info().currsize:
+        await get_engine().dispose()
+
+
+def _engine_stats(engine: AsyncEngine) -> dict[str, Any]:
+    pool = engine.sync_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": config.settings.DATABASE_MAX_OVERFLOW,
+        "checkouts": pool.stats.checkouts,
+        "timeouts": pool.stats.timeouts,
+        "wait_seconds_total": pool.stats.wait_seconds_total,
+        "wait_seconds_max": pool.stats.wait_seconds_max,
+    }
+
+
+def pool_stats() -> dict[str, Any]:
+    """
+    Stats of the primary's pool, those of the replicas under `replicas`
+    """
+    router = get_router()
+    return {
+        **_engine_stats(router.primary),
+        "replicas": [_engine_stats(replica) for replica in router.replicas],
+    }
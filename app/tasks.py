@@ -0,0 +1,48 @@
+"""
+Job handlers, see `app/jobs.py`.
+
+Work that does not have to happen before an upload is answered runs here,
+enqueued in the upload's transaction and picked up by `app/worker.py`.
+"""
+
+from typing import Any
+
+from app.core import config
+from app.core.storage import get_blob_store
+from app.core.transform import (
+    Fit,
+    OutputFormat,
+    TransformError,
+    TransformSpec,
+    derivatives,
+)
+from app.jobs import PermanentJobError, handler
+
+PRERENDER = "image.prerender"
+
+
+def prerender_specs() -> list[TransformSpec]:
+    return [
+        TransformSpec(
+            width=width, height=None, fit=Fit.contain, format=OutputFormat.webp
+        )
+        for width in config.settings.TRANSFORM_PRERENDER_WIDTHS
+    ]
+
+
+@handler(PRERENDER)
+async def prerender(payload: dict[str, Any]) -> None:
+    """
+    Render the `TRANSFORM_PRERENDER_WIDTHS` variants of a blob into the
+    derivative cache, so the first `GET /image/{id}/transform` is a hit
+    """
+    store = get_blob_store()
+    digest, size = payload["digest"], payload["size"]
+    for spec in prerender_specs():
+        try:
+            await derivatives.get(
+                spec.cache_key(digest),
+                lambda: derivatives.render_blob(store, digest, size, spec),
+            )
+        except TransformError as e:
+            raise PermanentJobError(str(e)) from e
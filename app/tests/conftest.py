@@ -2,19 +2,19 @@ import asyncio
 from typing import AsyncGenerator
 
 import pytest
-from fastapi_users.password import get_password_hash
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core import config
+from app.core.passwords import get_password_hash
 from app.main import app
 from app.models import Base
-from app.session import async_engine, async_session
+from app.session import async_session, get_engine
 from app.tests import utils
 
 default_user_email = "garg@garghouse.co.in"
 default_user_hash = get_password_hash("garg")
-superuser_user_email = "contact@@garghouse.co.in"
+superuser_user_email = "contact@garghouse.co.in"
 superuser_user_hash = get_password_hash("contact")
 
 
@@ -35,10 +35,10 @@ async def client():
 async def test_db_setup_sessionmaker():
     # assert if we use TEST_DB URL for 100%
     assert config.settings.ENVIRONMENT == "PYTEST"
-    assert str(async_engine.url) == config.settings.TEST_SQLALCHEMY_DATABASE_URI
+    assert str(get_engine().url) == config.settings.TEST_SQLALCHEMY_DATABASE_URI
 
     # always drop and create test db tables between tests session
-    async with async_engine.begin() as conn:
+    async with get_engine().begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
     return async_session
@@ -60,3 +60,10 @@ async def superuser_user(session: AsyncSession):
     return await utils.create_db_user(
         superuser_user_email, superuser_user_hash, session, is_superuser=True
     )
+
+
+@pytest.fixture
+async def user_token_headers(client: AsyncClient, session: AsyncSession):
+    email = utils.random_email()
+    await utils.create_db_user(email, default_user_hash, session)
+    return await utils.user_authentication_headers(client, email, "garg")
@@ -0,0 +1,134 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+from httpx import AsyncClient
+
+from app.api.admission import UploadAdmission, admission
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+
+def make_admission(**limits) -> UploadAdmission:
+    defaults = dict(
+        max_concurrent=10,
+        max_queued=0,
+        queue_timeout=0.05,
+        max_per_user=10,
+        user_bytes_per_second=1000,
+        user_burst_bytes=1000,
+        max_body_bytes=1000,
+    )
+    return UploadAdmission(**{**defaults, **limits})
+
+
+async def test_user_concurrency_limit():
+    limits = make_admission(max_per_user=1)
+    await limits.acquire("alice")
+    with pytest.raises(HTTPException) as e:
+        await limits.acquire("alice")
+    assert e.value.status_code == 429
+    assert e.value.headers["Retry-After"] == "1"
+    await limits.acquire("bob")
+
+    await limits.release("alice")
+    await limits.acquire("alice")
+
+
+async def test_user_rate_limit():
+    limits = make_admission(user_bytes_per_second=100, user_burst_bytes=100)
+    await limits.acquire("alice")
+    limits.bucket("alice").take(350)
+    await limits.release("alice")
+
+    with pytest.raises(HTTPException) as e:
+        await limits.acquire("alice")
+    assert e.value.status_code == 429
+    assert e.value.headers["Retry-After"] == "3"
+
+
+async def test_global_limit_queues_then_rejects():
+    limits = make_admission(max_concurrent=1, max_queued=1)
+    await limits.acquire("alice")
+
+    waiting = asyncio.create_task(limits.acquire("bob"))
+    await asyncio.sleep(0)
+    assert limits.queued == 1
+    # Queue is full
+    with pytest.raises(HTTPException) as e:
+        await limits.acquire("carol")
+    assert e.value.status_code == 503
+    assert "Retry-After" in e.value.headers
+
+    await limits.release("alice")
+    await waiting
+    assert (limits.active, limits.queued) == (1, 0)
+
+    # Nobody releases, the wait times out
+    with pytest.raises(HTTPException) as e:
+        await limits.acquire("carol")
+    assert e.value.status_code == 503
+    assert limits.queued == 0
+
+
+async def test_user_concurrency_limit_counts_queued_requests():
+    limits = make_admission(max_concurrent=1, max_queued=5, max_per_user=2)
+    await limits.acquire("bob")
+
+    # The pool is full, alice's requests all wait for it
+    first = asyncio.create_task(limits.acquire("alice"))
+    second = asyncio.create_task(limits.acquire("alice"))
+    await asyncio.sleep(0)
+    assert limits.queued == 2
+    with pytest.raises(HTTPException) as e:
+        await limits.acquire("alice")
+    assert e.value.status_code == 429
+    assert limits.queued == 2
+
+    # Both time out in the queue and give their slots back
+    for waiting in (first, second):
+        with pytest.raises(HTTPException) as e:
+            await waiting
+        assert e.value.status_code == 503
+    assert limits.queued == 0
+    await limits.release("bob")
+    await limits.acquire("alice")
+
+
+async def test_upload_body_limit(
+    client: AsyncClient, user_token_headers: dict[str, str], monkeypatch
+):
+    monkeypatch.setattr(admission, "max_body_bytes", 64 * 1024)
+    content = os.urandom(100 * 1024)
+
+    res = await client.post(
+        "/image",
+        files={"file": ("big.png", content, "image/png")},
+        headers=user_token_headers,
+    )
+    assert res.status_code == 413
+
+    boundary = "limit-test"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="big.png"\r\n'
+        "Content-Type: image/png\r\n\r\n"
+    ).encode() + content
+
+    async def chunked():
+        # No Content-Length, the limit applies while streaming
+        for i in range(0, len(body), 8192):
+            yield body[i : i + 8192]
+
+    res = await client.post(
+        "/image",
+        content=chunked(),
+        headers={
+            **user_token_headers,
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+        },
+    )
+    assert res.status_code == 413
+    assert admission.active == 0
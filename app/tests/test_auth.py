@@ -4,8 +4,12 @@ Testing FastAPI Users makes no sense, its just an example to remove.
 
 import pytest
 from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.security import user_cache
 from app.schemas import UserDB
+from app.tests import utils
+from app.tests.conftest import default_user_hash
 
 # All test coroutines in file will be treated as marked (async allowed).
 pytestmark = pytest.mark.asyncio
@@ -35,3 +39,98 @@ async def test_login_endpoints(client: AsyncClient, default_user: UserDB):
     assert test_token.status_code == 200
     response_user = test_token.json()
     assert response_user["email"] == default_user.email
+
+
+async def test_signup(client: AsyncClient, session: AsyncSession):
+    email = utils.random_email()
+
+    signup_res = await client.post(
+        "/signup", data={"email": email, "password": "secret"}
+    )
+    assert signup_res.status_code == 303
+    location = signup_res.headers["location"]
+    assert location.startswith("/home?token=")
+    access_token = location.split("token=", 1)[1]
+
+    test_token = await client.get(
+        "/users/me", headers={"Authorization": f"Bearer {access_token}"}
+    )
+    assert test_token.status_code == 200
+    assert test_token.json()["email"] == email
+
+    signup_res = await client.post(
+        "/signup", data={"email": email, "password": "other"}
+    )
+    assert signup_res.status_code == 400
+
+
+async def test_signup_email_taken_in_other_case(client: AsyncClient):
+    email = utils.random_email()
+    res = await client.post("/signup", data={"email": email, "password": "first"})
+    assert res.status_code == 303
+
+    local, domain = email.split("@")
+    res = await client.post(
+        "/signup", data={"email": f"{local.upper()}@{domain}", "password": "second"}
+    )
+    assert res.status_code == 400
+    res = await client.post(
+        "/login", data={"email": f"{local.upper()}@{domain}", "password": "first"}
+    )
+    assert res.status_code == 303
+
+
+async def test_login_form(client: AsyncClient, session: AsyncSession):
+    email = utils.random_email()
+    await utils.create_db_user(email, default_user_hash, session)
+
+    res = await client.post("/login", data={"email": email, "password": "garg"})
+    assert res.status_code == 303
+    access_token = res.headers["location"].split("token=", 1)[1]
+    me = await client.get(
+        "/users/me", headers={"Authorization": f"Bearer {access_token}"}
+    )
+    assert me.json()["email"] == email
+
+    res = await client.post("/login", data={"email": email, "password": "wrong"})
+    assert res.status_code == 400
+
+
+async def test_current_user_is_cached(
+    client: AsyncClient, user_token_headers: dict[str, str]
+):
+    hits = user_cache.hits
+
+    for _ in range(3):
+        me = await client.get("/users/me", headers=user_token_headers)
+        assert me.status_code == 200
+    assert user_cache.hits >= hits + 2
+
+    # updates drop the cached user
+    new_email = utils.random_email()
+    update = await client.patch(
+        "/users/me", json={"email": new_email}, headers=user_token_headers
+    )
+    assert update.status_code == 200
+    me = await client.get("/users/me", headers=user_token_headers)
+    assert me.json()["email"] == new_email
+
+
+async def test_stats(client: AsyncClient, superuser_user: UserDB):
+    headers = await utils.user_authentication_headers(
+        client, superuser_user.email, "contact"
+    )
+
+    stats_res = await client.get("/stats", headers=headers)
+    assert stats_res.status_code == 200
+    stats = stats_res.json()
+    assert stats["db_pool"]["checked_out"] >= 0
+    assert stats["db_pool"]["checkouts"] > 0
+    assert stats["password_hasher"]["completed"] > 0
+
+
+async def test_stats_requires_superuser(
+    client: AsyncClient, user_token_headers: dict[str, str]
+):
+    stats_res = await client.get("/stats", headers=user_token_headers)
+    assert stats_res.status_code == 403
@@ -0,0 +1,156 @@
+import argparse
+import json
+import uuid
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.bulk_import import run
+from app.core.passwords import get_password_hash, pwd_context
+from app.models import UserTable
+from app.tests import utils
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+
+def import_args(tmp_path, format: str, **options) -> argparse.Namespace:
+    defaults = dict(
+        format=format,
+        batch_size=2,
+        workers=2,
+        rounds=4,
+        skip_existing=False,
+        checkpoint=tmp_path / "users.checkpoint",
+    )
+    return argparse.Namespace(**{**defaults, **options})
+
+
+async def get_users(session: AsyncSession, emails: list[str]) -> dict[str, UserTable]:
+    result = await session.execute(select(UserTable).where(UserTable.email.in_(emails)))
+    return {user.email: user for user in result.scalars().all()}
+
+
+async def test_import_csv(tmp_path, session: AsyncSession):
+    existing = utils.random_email()
+    await utils.create_db_user(existing, get_password_hash("old"), session)
+    plain, hashed, duplicate = (utils.random_email() for _ in range(3))
+    path = tmp_path / "users.csv"
+    path.write_text(
+        "email,password,hashed_password,is_superuser\n"
+        f"{plain},secret,,\n"
+        f"{hashed},,{get_password_hash('prehashed')},true\n"
+        "not-an-email,secret,,\n"
+        f"{existing},new,,\n"
+        f"{duplicate},first,,\n"
+        f"{duplicate},second,,\n"
+    )
+
+    with open(path, "rb") as file:
+        progress = await run(import_args(tmp_path, "csv"), file)
+
+    assert progress.done == 6
+    assert progress.invalid == 1
+    assert (tmp_path / "users.checkpoint").read_text().strip() == "6"
+    session.expire_all()
+    users = await get_users(session, [plain, hashed, existing, duplicate])
+    assert pwd_context.verify("secret", users[plain].hashed_password)
+    assert not users[plain].is_superuser
+    assert pwd_context.verify("prehashed", users[hashed].hashed_password)
+    assert users[hashed].is_superuser
+    assert pwd_context.verify("new", users[existing].hashed_password)
+    assert pwd_context.verify("second", users[duplicate].hashed_password)
+
+
+async def test_import_resumes_after_checkpoint(tmp_path, session: AsyncSession):
+    emails = [utils.random_email() for _ in range(5)]
+    path = tmp_path / "users.ndjson"
+    path.write_text(
+        "\n".join(
+            json.dumps({"email": email, "hashed_password": get_password_hash("x")})
+            for email in emails
+        )
+    )
+    (tmp_path / "users.checkpoint").write_text("3\n")
+
+    with open(path, "rb") as file:
+        progress = await run(import_args(tmp_path, "ndjson"), file)
+
+    assert progress.done == 5
+    assert progress.written == 2
+    assert set(await get_users(session, emails)) == set(emails[3:])
+
+
+async def test_import_rejects_ids_of_other_emails(tmp_path, session: AsyncSession):
+    existing = await utils.create_db_user(
+        utils.random_email(), get_password_hash("old"), session
+    )
+    taken, first, second, mixed_case = (utils.random_email() for _ in range(4))
+    new_id = uuid.uuid4()
+    path = tmp_path / "users.ndjson"
+    path.write_text(
+        "\n".join(
+            json.dumps({"email": email, "id": str(user_id), "password": password})
+            for email, user_id, password in [
+                (taken, existing.id, "x"),
+                (existing.email, existing.id, "new"),
+                (first, new_id, "x"),
+                (second, new_id, "x"),
+                (mixed_case.upper(), "", "x"),
+            ]
+        )
+    )
+
+    with open(path, "rb") as file:
+        progress = await run(import_args(tmp_path, "ndjson", batch_size=10), file)
+
+    assert progress.done == 5
+    assert progress.invalid == 2
+    assert progress.written == 3
+    session.expire_all()
+    users = await get_users(session, [taken, existing.email, first, second, mixed_case])
+    assert set(users) == {existing.email, first, mixed_case}
+    assert pwd_context.verify("new", users[existing.email].hashed_password)
+    assert users[first].id == new_id
+
+
+async def test_import_skips_malformed_lines(tmp_path, session: AsyncSession, capsys):
+    first, last = utils.random_email(), utils.random_email()
+    path = tmp_path / "users.ndjson"
+    path.write_text(
+        json.dumps({"email": first, "password": "x"})
+        + "\nnot json\n\n[1]\n"
+        + json.dumps({"email": last, "password": "x"})
+    )
+
+    with open(path, "rb") as file:
+        progress = await run(import_args(tmp_path, "ndjson"), file)
+
+    assert progress.done == 4
+    assert progress.invalid == 2
+    assert (tmp_path / "users.checkpoint").read_text().strip() == "4"
+    assert set(await get_users(session, [first, last])) == {first, last}
+    errors = capsys.readouterr().err
+    assert "record 2 (line 2): invalid JSON" in errors
+    assert "record 3 (line 4): not an object" in errors
+
+
+async def test_import_matches_emails_without_case(tmp_path, session: AsyncSession):
+    local, domain = utils.random_email().split("@")
+    existing = await utils.create_db_user(
+        f"{local.title()}@{domain}", get_password_hash("old"), session
+    )
+    path = tmp_path / "users.ndjson"
+    path.write_text(
+        json.dumps({"email": existing.email, "id": str(existing.id), "password": "new"})
+    )
+
+    with open(path, "rb") as file:
+        progress = await run(import_args(tmp_path, "ndjson"), file)
+
+    assert (progress.invalid, progress.written) == (0, 1)
+    session.expire_all()
+    users = await get_users(session, [existing.email, existing.email.lower()])
+    assert list(users) == [existing.email]
+    assert pwd_context.verify("new", users[existing.email].hashed_password)
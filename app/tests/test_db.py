@@ -2,9 +2,10 @@ import pytest
 
 from app.schemas import UserDB
 from app.tests import utils
-from app.api.deps import get_user_manager, get_user_db
+from app.api.deps import ReleasingUserDatabase, get_user_manager, get_user_db
+from app.core.passwords import get_password_hash
+from app.models import UserTable
 
-from fastapi_users.password import get_password_hash
 from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
 from fastapi import Depends
 from sqlalchemy.sql import select
@@ -21,3 +22,18 @@ async def test_create_new_user(session: AsyncSession):
     results = [u for (u, ) in await session.execute(stmt)]
 
     assert user.id in {u.id for u in results}
+
+
+async def test_user_lookup_releases_connection(session: AsyncSession):
+    user = await utils.create_db_user(utils.random_email(), "hash", session)
+    user_db = ReleasingUserDatabase(UserDB, session, UserTable)
+
+    assert (await user_db.get(user.id)).email == user.email
+    assert not session.in_transaction()
+
+    # lookups inside a unit of work started by the caller leave it open
+    await session.execute(select(UserTable.id))
+    await user_db.get_by_email(user.email)
+    assert session.in_transaction()
+    await session.release()
+    assert not session.in_transaction()
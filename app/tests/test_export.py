@@ -0,0 +1,78 @@
+import io
+import json
+import os
+import zipfile
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.endpoints import export
+from app.tests import utils
+from app.tests.conftest import default_user_hash
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+
+async def post_images(
+    client: AsyncClient, headers: dict[str, str], contents: list[bytes]
+) -> list[dict]:
+    res = await client.post(
+        "/image",
+        files=[
+            ("file", (f"{i}.png", content, "image/png"))
+            for i, content in enumerate(contents)
+        ],
+        headers=headers,
+    )
+    assert res.status_code == 200
+    return res.json()
+
+
+@pytest.fixture
+async def library(
+    client: AsyncClient,
+    session: AsyncSession,
+    user_token_headers: dict[str, str],
+    monkeypatch,
+):
+    # More rows than one fetch from the cursor
+    monkeypatch.setattr(export, "EXPORT_FETCH_ROWS", 2)
+    contents = [os.urandom(size) for size in (0, 10, 2 * 1024 * 1024, 12345, 7)]
+    images = await post_images(client, user_token_headers, contents)
+
+    email = utils.random_email()
+    await utils.create_db_user(email, default_user_hash, session)
+    other_headers = await utils.user_authentication_headers(client, email, "garg")
+    await post_images(client, other_headers, [b"not yours"])
+    return images, contents
+
+
+async def test_export_ndjson(
+    client: AsyncClient, user_token_headers: dict[str, str], library
+):
+    images, _ = library
+
+    res = await client.get("/images/export", headers=user_token_headers)
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/x-ndjson"
+    exported = [json.loads(line) for line in res.text.splitlines()]
+    assert exported == images
+
+
+async def test_export_zip(
+    client: AsyncClient, user_token_headers: dict[str, str], library
+):
+    images, contents = library
+
+    res = await client.get(
+        "/images/export", params={"format": "zip"}, headers=user_token_headers
+    )
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(res.content)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [f"{image['id']}.png" for image in images]
+        for image, content in zip(images, contents):
+            assert archive.read(f"{image['id']}.png") == content
@@ -0,0 +1,78 @@
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from PIL import Image
+
+from app.core.imageinfo import HeaderSniffer, parse_header
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+
+def encode(format: str, size: tuple[int, int], **options) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", size).save(output, format=format, **options)
+    return output.getvalue()
+
+
+def exif(orientation: int, taken_at: str, offset: str = "") -> Image.Exif:
+    data = Image.Exif()
+    data[0x0112] = orientation
+    data.get_ifd(0x8769)[0x9003] = taken_at
+    if offset:
+        data.get_ifd(0x8769)[0x9011] = offset
+    return data
+
+
+@pytest.mark.parametrize(
+    "format,mime_type,options",
+    [
+        ("PNG", "image/png", {}),
+        ("GIF", "image/gif", {}),
+        ("JPEG", "image/jpeg", {}),
+        ("JPEG", "image/jpeg", {"progressive": True}),
+        ("WEBP", "image/webp", {}),
+        ("WEBP", "image/webp", {"lossless": True}),
+        ("WEBP", "image/webp", {"exif": exif(1, "2020:01:01 00:00:00")}),
+    ],
+)
+def test_parse_dimensions(format: str, mime_type: str, options: dict):
+    info = parse_header(encode(format, (321, 123), **options))
+    assert info is not None
+    assert (info.mime_type, info.width, info.height) == (mime_type, 321, 123)
+
+
+def test_parse_jpeg_exif():
+    data = encode("JPEG", (300, 200), exif=exif(6, "2024:03:05 10:20:30", "+02:00"))
+
+    info = parse_header(data)
+    # Orientation 6 is rotated by 90 degrees, displayed as portrait
+    assert (info.width, info.height, info.orientation) == (200, 300, 6)
+    assert info.taken_at == datetime(
+        2024, 3, 5, 10, 20, 30, tzinfo=timezone(timedelta(hours=2))
+    )
+
+
+def test_parse_unknown_or_truncated():
+    assert parse_header(b"") is None
+    assert parse_header(b"not an image") is None
+    info = parse_header(encode("JPEG", (10, 10))[:20])
+    assert info.mime_type == "image/jpeg"
+    assert info.width is None
+    for length in (16, 20, 23):
+        info = parse_header(encode("PNG", (10, 10))[:length])
+        assert info.mime_type == "image/png"
+        assert info.width is None
+
+
+async def test_header_sniffer():
+    data = encode("PNG", (64, 32))
+
+    async def chunks():
+        for i in range(0, len(data), 7):
+            yield data[i : i + 7]
+
+    sniffer = HeaderSniffer(limit=30)
+    assert b"".join([chunk async for chunk in sniffer.tap(chunks())]) == data
+    assert (sniffer.info().width, sniffer.info().height) == (64, 32)
@@ -0,0 +1,479 @@
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import types
+from datetime import timedelta
+
+import pytest
+from httpx import AsyncClient
+from PIL import Image as PILImage
+from sqlalchemy import func, select, text, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import payload_backfill
+from app.blobs import collect_garbage, reserve_blob
+from app.core.passwords import get_password_hash
+from app.core.storage import LocalBlobStore, StoredBlob, get_blob_store
+from app.core.transform import Fit, OutputFormat, TransformSpec, derivatives, render
+from app.models import Blob, Image
+from app.session import async_session
+from app.tests import utils
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+
+async def test_post_image(client: AsyncClient, user_token_headers: dict[str, str]):
+    content = b"\x89PNG\r\n\x1a\n" + os.urandom(3 * 1024 * 1024)
+
+    res = await client.post(
+        "/image",
+        files={"file": ("cat.png", content, "image/png")},
+        data={"title": "cat"},
+        headers=user_token_headers,
+    )
+    assert res.status_code == 200
+    [image] = res.json()
+    assert image["title"] == "cat"
+    assert image["digest"] == hashlib.sha256(content).hexdigest()
+    assert image["size"] == len(content)
+    assert image["mime_type"] == "image/png"
+    assert get_blob_store().path(image["digest"]).read_bytes() == content
+
+
+async def test_post_many_images(
+    client: AsyncClient, user_token_headers: dict[str, str]
+):
+    contents = [os.urandom(size) for size in (0, 10, 2 * 1024 * 1024, 10, 12345)]
+
+    res = await client.post(
+        "/image",
+        files=[
+            ("file", (f"{i}.png", content, "image/png"))
+            for i, content in enumerate(contents)
+        ],
+        headers=user_token_headers,
+    )
+    assert res.status_code == 200
+    images = res.json()
+    assert [image["title"] for image in images] == [f"{i}.png" for i in range(5)]
+    assert [image["size"] for image in images] == [len(c) for c in contents]
+    assert len({image["id"] for image in images}) == 5
+    for image, content in zip(images, contents):
+        res = await client.get(f"/image/{image['id']}", headers=user_token_headers)
+        assert res.content == content
+
+
+async def test_post_image_requires_auth(client: AsyncClient):
+    res = await client.post("/image", files={"file": ("cat.png", b"data", "image/png")})
+    assert res.status_code == 401
+
+
+async def test_post_image_without_file(
+    client: AsyncClient, user_token_headers: dict[str, str]
+):
+    res = await client.post(
+        "/image", files={"title": (None, b"cat")}, headers=user_token_headers
+    )
+    assert res.status_code == 400
+
+
+async def test_failed_upload_leaves_stored_parts_to_collect(
+    client: AsyncClient, user_token_headers: dict[str, str], session: AsyncSession
+):
+    content = os.urandom(2 * 1024 * 1024)
+    digest = hashlib.sha256(content).hexdigest()
+    store = get_blob_store()
+    boundary = "b0undary"
+
+    async def body():
+        yield (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file";'
+            ' filename="cat.png"\r\nContent-Type: image/png\r\n\r\n'
+        ).encode() + content + f"\r\n--{boundary}\r\n".encode()
+        # The first file is in the blob store before the second one arrives
+        for _ in range(500):
+            if await store.exists(digest):
+                break
+            await asyncio.sleep(0.01)
+        yield (
+            'Content-Disposition: form-data; name="file"; filename="notes.txt"'
+            f"\r\nContent-Type: text/plain\r\n\r\nnot an image\r\n--{boundary}--\r\n"
+        ).encode()
+
+    res = await client.post(
+        "/image",
+        content=body(),
+        headers={
+            **user_token_headers,
+            "content-type": f"multipart/form-data; boundary={boundary}",
+        },
+    )
+    assert res.status_code == 415
+
+    assert await store.exists(digest)
+    blob = await session.get(Blob, digest)
+    assert blob.refcount == 0 and blob.released_at is not None
+    await session.commit()
+    assert await collect_garbage(session, store, grace_seconds=0) >= 1
+    assert not await store.exists(digest)
+
+
+async def test_get_image(client: AsyncClient, user_token_headers: dict[str, str]):
+    content = os.urandom(600 * 1024)
+    res = await client.post(
+        "/image",
+        files={"file": ("dog.jpg", content, "image/jpeg")},
+        headers=user_token_headers,
+    )
+    [image] = res.json()
+    url = f"/image/{image['id']}"
+
+    res = await client.get(url, headers=user_token_headers)
+    assert res.status_code == 200
+    assert res.content == content
+    assert res.headers["content-type"] == "image/jpeg"
+    etag = res.headers["etag"]
+    assert etag == f'"{image["digest"]}"'
+
+    res = await client.get(url, headers={**user_token_headers, "If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+
+    res = await client.get(url, headers={**user_token_headers, "Range": "bytes=10-19"})
+    assert res.status_code == 206
+    assert res.content == content[10:20]
+    assert res.headers["content-range"] == f"bytes 10-19/{len(content)}"
+
+    res = await client.get(url, headers={**user_token_headers, "Range": "bytes=-5"})
+    assert res.status_code == 206
+    assert res.content == content[-5:]
+
+    res = await client.get(
+        url, headers={**user_token_headers, "Range": f"bytes={len(content)}-"}
+    )
+    assert res.status_code == 416
+
+
+async def test_get_image_of_other_user(
+    client: AsyncClient, user_token_headers: dict[str, str], session: AsyncSession
+):
+    res = await client.post(
+        "/image",
+        files={"file": ("dog.jpg", b"private", "image/jpeg")},
+        headers=user_token_headers,
+    )
+    email = utils.random_email()
+    await utils.create_db_user(email, get_password_hash("other"), session)
+    other_headers = await utils.user_authentication_headers(client, email, "other")
+
+    res = await client.get(f"/image/{res.json()[0]['id']}", headers=other_headers)
+    assert res.status_code == 404
+
+
+async def test_list_images(client: AsyncClient, user_token_headers: dict[str, str]):
+    res = await client.post(
+        "/image",
+        files=[("file", (f"{i}.png", b"%d" % i, "image/png")) for i in range(5)],
+        headers=user_token_headers,
+    )
+    uploaded = [image["id"] for image in reversed(res.json())]
+
+    listed = []
+    next_cursor = None
+    for _ in range(3):
+        params = {"limit": 2}
+        if next_cursor is not None:
+            params["before"] = next_cursor
+        res = await client.get("/images", params=params, headers=user_token_headers)
+        assert res.status_code == 200
+        page = res.json()
+        listed += [image["id"] for image in page["items"]]
+        next_cursor = page["next_cursor"]
+    assert listed == uploaded
+    assert next_cursor is None
+
+
+@pytest.fixture
+async def legacy_payloads(session: AsyncSession):
+    # Gone from app.models, created here the way the old schema had it
+    async with session.bind.begin() as conn:
+        await conn.run_sync(payload_backfill.metadata.drop_all)
+        await conn.run_sync(payload_backfill.metadata.create_all)
+    yield payload_backfill.image_payload
+    await session.rollback()
+    async with session.bind.begin() as conn:
+        await conn.run_sync(payload_backfill.metadata.drop_all)
+
+
+async def test_backfill_legacy_payloads(
+    client: AsyncClient,
+    user_token_headers: dict[str, str],
+    session: AsyncSession,
+    legacy_payloads,
+):
+    me = await client.get("/users/me", headers=user_token_headers)
+    output = io.BytesIO()
+    PILImage.new("RGB", (30, 20)).save(output, format="PNG")
+    content = output.getvalue()
+    images = [
+        Image(title="old", mime_type="image/png", user_id=me.json()["id"])
+        for _ in range(3)
+    ]
+    session.add_all(images)
+    await session.commit()
+    converted, invalid, locked = (image.id for image in images)
+    await session.execute(
+        legacy_payloads.insert(),
+        [
+            {"image_id": converted, "base64": base64.b64encode(content).decode()},
+            {"image_id": invalid, "base64": "not base64!"},
+            {"image_id": locked, "base64": base64.b64encode(b"locked").decode()},
+        ],
+    )
+    await session.commit()
+
+    # A long transaction holds one of the images
+    async with async_session() as other:
+        await other.execute(
+            select(Image.id).where(Image.id == locked).with_for_update()
+        )
+        progress = await payload_backfill.backfill(
+            get_blob_store(), batch_size=1, sleep=0, lock_timeout_ms=50, max_retries=1
+        )
+        await other.rollback()
+
+    assert (progress.total, progress.converted) == (3, 1)
+    assert (progress.invalid, progress.skipped) == (1, 1)
+    res = await client.get(f"/image/{converted}", headers=user_token_headers)
+    assert res.content == content
+    session.expire_all()
+    image = await session.get(Image, converted)
+    assert (image.width, image.height) == (30, 20)
+
+    result = await session.execute(select(legacy_payloads.c.image_id))
+    assert sorted(result.scalars().all()) == [invalid, locked]
+    # The skipped batch's blob is left to the garbage collection
+    blob = await session.get(Blob, hashlib.sha256(b"locked").hexdigest())
+    assert blob.refcount == 0 and blob.released_at is not None
+    await session.commit()
+    assert await collect_garbage(session, get_blob_store(), grace_seconds=0) == 1
+
+
+async def test_backfill_crash_leaves_blobs_to_collect(session: AsyncSession):
+    content = os.urandom(1024)
+    digest = hashlib.sha256(content).hexdigest()
+    row = types.SimpleNamespace(image_id=0, base64=base64.b64encode(content))
+    store = get_blob_store()
+
+    # Stopped after writing the content, before pointing images at it
+    progress = payload_backfill.Progress(total=1)
+    await payload_backfill.store_batch(session, store, [row], progress)
+    assert await store.exists(digest)
+
+    blob = await session.get(Blob, digest)
+    assert blob.refcount == 0 and blob.released_at is not None
+    await session.commit()
+    assert await collect_garbage(session, store, grace_seconds=0) == 1
+    assert not await store.exists(digest)
+
+
+async def test_identical_images_share_blob(
+    client: AsyncClient, user_token_headers: dict[str, str], session: AsyncSession
+):
+    content = os.urandom(1024)
+    digest = hashlib.sha256(content).hexdigest()
+
+    res = await client.post(
+        "/image",
+        files=[("file", (f"{i}.png", content, "image/png")) for i in range(3)],
+        headers=user_token_headers,
+    )
+    images = res.json()
+    assert {image["digest"] for image in images} == {digest}
+    blob = await session.get(Blob, digest)
+    assert blob.refcount == 3
+
+    for image in images:
+        res = await client.delete(f"/image/{image['id']}", headers=user_token_headers)
+        assert res.status_code == 204
+    await session.refresh(blob)
+    assert blob.refcount == 0
+    assert blob.released_at is not None
+
+    store = get_blob_store()
+    assert await collect_garbage(session, store, grace_seconds=3600) == 0
+    assert await store.exists(digest)
+    assert await collect_garbage(session, store, grace_seconds=0) == 1
+    assert not await store.exists(digest)
+    remaining = await session.execute(select(Blob).where(Blob.digest == digest))
+    assert remaining.first() is None
+
+
+async def test_upload_restarts_grace_period_of_released_blob(
+    session: AsyncSession,
+):
+    content = os.urandom(1024)
+    digest = hashlib.sha256(content).hexdigest()
+    store = get_blob_store()
+
+    async def chunks():
+        yield content
+
+    await store.put(chunks())
+    session.add(Blob(digest=digest, size=len(content), refcount=0))
+    await session.execute(
+        update(Blob)
+        .where(Blob.digest == digest)
+        .values(released_at=func.now() - timedelta(hours=2))
+    )
+    await session.commit()
+
+    # Found in the blob store, the reference is not committed yet
+    await store.put(chunks(), reserve=reserve_blob)
+    assert await collect_garbage(session, store, grace_seconds=3600) == 0
+    assert await store.exists(digest)
+
+
+async def test_garbage_deleted_under_row_lock(session: AsyncSession):
+    content = os.urandom(1024)
+    digest = hashlib.sha256(content).hexdigest()
+    store = get_blob_store()
+    await reserve_blob(StoredBlob(digest=digest, size=len(content)))
+    locked = []
+
+    class CheckingStore(LocalBlobStore):
+        async def delete(self, digest: str) -> None:
+            async with async_session() as other:
+                await other.execute(text("SET LOCAL lock_timeout = 50"))
+                try:
+                    await other.execute(
+                        select(Blob).where(Blob.digest == digest).with_for_update()
+                    )
+                except DBAPIError:
+                    locked.append(digest)
+            await super().delete(digest)
+
+    checking = CheckingStore(store.root)
+    assert await collect_garbage(session, checking, grace_seconds=0) >= 1
+    assert digest in locked
+
+
+async def test_transform_image(client: AsyncClient, user_token_headers: dict[str, str]):
+    source = io.BytesIO()
+    PILImage.new("RGB", (400, 200), color=(200, 30, 30)).save(source, format="PNG")
+    res = await client.post(
+        "/image",
+        files={"file": ("red.png", source.getvalue(), "image/png")},
+        headers=user_token_headers,
+    )
+    url = f"/image/{res.json()[0]['id']}/transform"
+    renders = derivatives.renders
+
+    responses = await asyncio.gather(
+        *(
+            client.get(
+                url,
+                params={"width": 100},
+                headers={**user_token_headers, "Accept": "image/webp,*/*"},
+            )
+            for _ in range(5)
+        )
+    )
+    assert derivatives.renders == renders + 1
+    for res in responses:
+        assert res.status_code == 200
+        assert res.headers["content-type"] == "image/webp"
+        assert res.headers["vary"] == "Accept"
+        with PILImage.open(io.BytesIO(res.content)) as image:
+            assert (image.format, image.size) == ("WEBP", (100, 50))
+
+    etag = responses[0].headers["etag"]
+    res = await client.get(
+        url,
+        params={"width": 100},
+        headers={
+            **user_token_headers,
+            "Accept": "image/webp,*/*",
+            "If-None-Match": etag,
+        },
+    )
+    assert res.status_code == 304
+
+    res = await client.get(
+        url,
+        params={"width": 50, "height": 50, "fit": "cover"},
+        headers={**user_token_headers, "Accept": "image/jpeg"},
+    )
+    assert res.headers["content-type"] == "image/jpeg"
+    with PILImage.open(io.BytesIO(res.content)) as image:
+        assert image.size == (50, 50)
+
+    res = await client.get(
+        url, params={"height": 20, "format": "png"}, headers=user_token_headers
+    )
+    with PILImage.open(io.BytesIO(res.content)) as image:
+        assert (image.format, image.size) == ("PNG", (40, 20))
+
+    res = await client.get(url, headers=user_token_headers)
+    assert res.status_code == 400
+    res = await client.get(
+        url, params={"width": 10}, headers={**user_token_headers, "Accept": "text/html"}
+    )
+    assert res.status_code == 406
+
+
+async def test_render_rotated_by_exif():
+    # Stored 800x600, displayed 600x800 (orientation 6, rotate 90 clockwise)
+    exif = PILImage.Exif()
+    exif[0x0112] = 6
+    source = io.BytesIO()
+    PILImage.new("RGB", (800, 600)).save(source, format="JPEG", exif=exif)
+
+    for width, height, fit, size in [
+        (30, None, Fit.contain, (30, 40)),
+        (None, 80, Fit.contain, (60, 80)),
+        (30, 40, Fit.fill, (30, 40)),
+    ]:
+        spec = TransformSpec(width, height, fit, OutputFormat.png)
+        with PILImage.open(io.BytesIO(render(source.getvalue(), spec))) as image:
+            assert image.size == size
+
+
+async def test_image_header_metadata(
+    client: AsyncClient, user_token_headers: dict[str, str]
+):
+    exif = PILImage.Exif()
+    exif.get_ifd(0x8769)[0x9003] = "2024:03:05 10:20:30"
+    landscape, portrait = io.BytesIO(), io.BytesIO()
+    PILImage.new("RGB", (300, 200)).save(landscape, format="JPEG", exif=exif)
+    PILImage.new("RGB", (20, 40)).save(portrait, format="PNG")
+
+    res = await client.post(
+        "/image",
+        files=[
+            # Declared type is corrected from the content
+            ("file", ("a.jpg", landscape.getvalue(), "image/png")),
+            ("file", ("b.png", portrait.getvalue(), "image/png")),
+        ],
+        headers=user_token_headers,
+    )
+    a, b = res.json()
+    assert (a["mime_type"], a["width"], a["height"]) == ("image/jpeg", 300, 200)
+    assert a["taken_at"] == "2024-03-05T10:20:30+00:00"
+    assert (b["mime_type"], b["width"], b["height"]) == ("image/png", 20, 40)
+    assert b["taken_at"] is None
+
+    res = await client.get(
+        "/images",
+        params={"shape": "landscape", "taken_since": "2024-03-01T00:00:00Z"},
+        headers=user_token_headers,
+    )
+    assert [image["id"] for image in res.json()["items"]] == [a["id"]]
+    res = await client.get(
+        "/images", params={"shape": "portrait"}, headers=user_token_headers
+    )
+    assert [image["id"] for image in res.json()["items"]] == [b["id"]]
@@ -0,0 +1,231 @@
+import asyncio
+import io
+from datetime import timedelta
+
+import pytest
+from httpx import AsyncClient
+from PIL import Image as PILImage
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import config
+from app.core.transform import derivatives
+from app.jobs import (
+    ClaimedJob,
+    PermanentJobError,
+    claim,
+    complete,
+    enqueue,
+    fail,
+    handler,
+)
+from app.models import Job
+from app.session import async_session
+from app.tasks import prerender_specs
+from app.worker import Worker
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+done: list[dict] = []
+
+
+@handler("test.record")
+async def record(payload: dict) -> None:
+    done.append(payload)
+
+
+@handler("test.broken")
+async def broken(payload: dict) -> None:
+    raise ValueError("broken")
+
+
+@handler("test.invalid")
+async def invalid(payload: dict) -> None:
+    raise PermanentJobError("invalid")
+
+
+@pytest.fixture
+async def queue(session: AsyncSession) -> AsyncSession:
+    # Other tests enqueue jobs too, start from an empty queue
+    await session.execute(delete(Job))
+    await session.commit()
+    done.clear()
+    return session
+
+
+class CountingWorker(Worker):
+    runs = 0
+
+    async def run_job(self, job: ClaimedJob) -> None:
+        await super().run_job(job)
+        self.runs += 1
+
+
+async def run_worker(runs: int) -> None:
+    worker = CountingWorker(
+        concurrency=2, batch_size=2, poll_interval=0.01, visibility_timeout=10
+    )
+    worker.start()
+    try:
+        for _ in range(1000):
+            if worker.runs >= runs:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        worker.stop()
+        await worker.join()
+    assert worker.runs == runs
+
+
+async def test_claim_batches_and_skips_locked_jobs(queue: AsyncSession):
+    await enqueue(queue, [("test.record", {"n": n}) for n in range(3)])
+    await queue.commit()
+    first = (await queue.execute(select(Job.id).order_by(Job.id))).scalars().first()
+
+    # Another worker holds the first job, the claim must not wait for it
+    async with async_session() as other:
+        await other.execute(select(Job).where(Job.id == first).with_for_update())
+        async with async_session() as worker:
+            jobs = await asyncio.wait_for(claim(worker, 5, 60), 5)
+        await other.rollback()
+
+    assert sorted(job.payload["n"] for job in jobs) == [1, 2]
+    assert all(job.attempts == 1 for job in jobs)
+
+    async with async_session() as worker:
+        jobs = await claim(worker, 5, 60)
+    assert [job.id for job in jobs] == [first]
+
+
+async def test_claimed_job_is_hidden_until_visibility_timeout(queue: AsyncSession):
+    await enqueue(queue, [("test.record", {})])
+    await queue.commit()
+
+    async with async_session() as worker:
+        [job] = await claim(worker, 5, 60)
+        assert await claim(worker, 5, 60) == []
+
+    # Worker died, the job becomes due again once the timeout is up
+    await queue.execute(update(Job).values(run_at=Job.run_at - timedelta(hours=1)))
+    await queue.commit()
+    async with async_session() as worker:
+        [again] = await claim(worker, 5, 60)
+        assert again.id == job.id
+        assert again.attempts == 2
+
+        # The stale claim can no longer complete it
+        await complete(worker, job)
+        assert (await worker.execute(select(Job.id))).scalars().all() == [job.id]
+        await complete(worker, again)
+        assert (await worker.execute(select(Job.id))).scalars().all() == []
+
+
+async def test_job_lost_on_last_attempt_fails(queue: AsyncSession, monkeypatch):
+    monkeypatch.setattr(config.settings, "JOB_MAX_ATTEMPTS", 1)
+    await enqueue(queue, [("test.record", {})])
+    await queue.commit()
+
+    async with async_session() as worker:
+        [job] = await claim(worker, 5, 60)
+
+    # Its worker died without recording anything
+    await queue.execute(update(Job).values(run_at=Job.run_at - timedelta(hours=1)))
+    await queue.commit()
+    async with async_session() as worker:
+        assert await claim(worker, 5, 60) == []
+        row = (await worker.execute(select(Job))).scalar_one()
+        assert row.status == "failed"
+        assert row.attempts == 1
+        assert row.last_error == "Not finished by its worker on the last attempt"
+
+
+async def test_failed_job_retries_with_backoff(queue: AsyncSession, monkeypatch):
+    monkeypatch.setattr(config.settings, "JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(config.settings, "JOB_RETRY_BASE_SECONDS", 100)
+    await enqueue(queue, [("test.broken", {})])
+    await queue.commit()
+
+    async with async_session() as worker:
+        [job] = await claim(worker, 5, 60)
+        await fail(worker, job, "broken")
+        # Backing off, not due yet
+        assert await claim(worker, 5, 60) == []
+
+        row = (await worker.execute(select(Job))).scalar_one()
+        delay = (row.run_at - row.created_at).total_seconds()
+        assert row.status == "pending"
+        assert row.last_error == "broken"
+        assert 50 <= delay <= 101
+
+        await worker.execute(update(Job).values(run_at=Job.run_at - timedelta(hours=1)))
+        await worker.commit()
+        [job] = await claim(worker, 5, 60)
+        await fail(worker, job, "broken")
+
+        # Out of attempts
+        await worker.execute(update(Job).values(run_at=Job.run_at - timedelta(hours=1)))
+        await worker.commit()
+        assert await claim(worker, 5, 60) == []
+        worker.expire_all()
+        row = (await worker.execute(select(Job))).scalar_one()
+        assert row.status == "failed"
+        assert row.attempts == 2
+
+
+async def test_worker_runs_retries_and_fails_jobs(queue: AsyncSession):
+    await enqueue(
+        queue,
+        [
+            ("test.record", {"n": 1}),
+            ("test.record", {"n": 2}),
+            ("test.broken", {}),
+            ("test.invalid", {}),
+            ("test.unknown", {}),
+        ],
+    )
+    await queue.commit()
+
+    await run_worker(5)
+
+    assert sorted(payload["n"] for payload in done) == [1, 2]
+    result = await queue.execute(
+        select(Job.kind, Job.status, Job.attempts).order_by(Job.kind)
+    )
+    assert result.all() == [
+        ("test.broken", "pending", 1),
+        ("test.invalid", "failed", 1),
+        ("test.unknown", "failed", 1),
+    ]
+
+
+async def test_upload_prerenders_in_the_background(
+    client: AsyncClient, queue: AsyncSession, user_token_headers: dict[str, str]
+):
+    output = io.BytesIO()
+    PILImage.new("RGB", (640, 480), "teal").save(output, format="PNG")
+
+    res = await client.post(
+        "/image",
+        files={"file": ("teal.png", output.getvalue(), "image/png")},
+        headers=user_token_headers,
+    )
+    assert res.status_code == 200
+    digest = res.json()[0]["digest"]
+    [job] = (await queue.execute(select(Job))).scalars().all()
+    assert job.kind == "image.prerender"
+    assert job.payload["digest"] == digest
+
+    renders = derivatives.renders
+    await run_worker(1)
+    assert derivatives.renders == renders + len(prerender_specs())
+    assert (await queue.execute(select(Job.id))).first() is None
+
+    spec = prerender_specs()[0]
+    res = await client.get(
+        f"/image/{res.json()[0]['id']}/transform",
+        params={"width": spec.width, "format": spec.format.value},
+        headers=user_token_headers,
+    )
+    assert res.status_code == 200
+    assert derivatives.renders == renders + len(prerender_specs())
@@ -0,0 +1,71 @@
+import pytest
+from httpx import AsyncClient
+
+from app.core import config
+from app.core.metrics import Histogram
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+
+def test_histogram_render():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(3, "/a")
+
+    assert histogram.render().splitlines() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 3.55',
+        'latency_seconds_count{route="/a"} 3',
+    ]
+
+
+@pytest.fixture
+def metrics_enabled(monkeypatch):
+    monkeypatch.setattr(config.settings, "METRICS_ENABLED", True)
+
+
+async def test_server_timing_and_metrics(
+    client: AsyncClient, user_token_headers: dict[str, str], metrics_enabled
+):
+    res = await client.get("/images", headers=user_token_headers)
+    entries = dict(
+        entry.split(";dur=") for entry in res.headers["server-timing"].split(", ")
+    )
+    assert {"db", "serialization", "total"} <= set(entries)
+    assert float(entries["total"]) >= float(entries["db"])
+
+    await client.get("/no/such/path")
+    res = await client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = res.text
+    assert 'http_requests_total{method="GET",route="/images",status="200"}' in text
+    assert 'http_request_phase_seconds_count{route="/images",phase="db"}' in text
+    assert "db_pool_checked_out " in text
+    assert "# TYPE auth_cache_hits_total counter" in text
+    assert "db_pool_checkout_timeouts_total 0" in text
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"}' in text
+
+
+async def test_metrics_off_by_default(client: AsyncClient):
+    res = await client.get("/metrics")
+    assert res.status_code == 404
+
+
+async def test_metrics_token(client: AsyncClient, metrics_enabled, monkeypatch):
+    monkeypatch.setattr(config.settings, "METRICS_TOKEN", "scrape-secret")
+
+    res = await client.get("/metrics")
+    assert res.status_code == 401
+    res = await client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+    assert res.status_code == 401
+    res = await client.get(
+        "/metrics", headers={"Authorization": "Bearer scrape-secret"}
+    )
+    assert res.status_code == 200
@@ -0,0 +1,51 @@
+import gzip
+
+import pytest
+from httpx import AsyncClient
+
+from app.api.pages import get_page
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+
+async def test_login_page(client: AsyncClient):
+    body = get_page("login.html").variants["identity"]
+
+    res = await client.get("/login-page", headers={"Accept-Encoding": "identity"})
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/html")
+    assert res.headers["cache-control"] == "public, max-age=300"
+    assert res.headers["vary"] == "Accept-Encoding"
+    assert "content-encoding" not in res.headers
+    assert res.content == body
+    etag = res.headers["etag"]
+
+    res = await client.get(
+        "/login-page",
+        headers={"Accept-Encoding": "identity", "If-None-Match": etag},
+    )
+    assert res.status_code == 304
+    assert res.content == b""
+
+
+async def test_compressed_pages(client: AsyncClient):
+    page = get_page("image_upload.html")
+
+    res = await client.get("/home", headers={"Accept-Encoding": "gzip, br"})
+    assert res.headers["content-encoding"] == "br"
+    assert res.headers["content-length"] == str(len(page.variants["br"]))
+    # httpx decodes the body
+    assert res.content == page.variants["identity"]
+    br_etag = res.headers["etag"]
+
+    res = await client.get("/home", headers={"Accept-Encoding": "br;q=0.5, gzip"})
+    assert res.headers["content-encoding"] == "gzip"
+    assert res.headers["etag"] != br_etag
+    assert res.headers["content-length"] == str(len(page.variants["gzip"]))
+    assert gzip.decompress(page.variants["gzip"]) == page.variants["identity"]
+
+    res = await client.get(
+        "/home", headers={"Accept-Encoding": "br", "If-None-Match": br_etag}
+    )
+    assert res.status_code == 304
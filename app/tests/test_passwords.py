@@ -0,0 +1,40 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.core import passwords
+from app.core.passwords import PasswordHasher
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+
+async def test_hash_and_verify():
+    hashed = await passwords.hash_password("secret")
+
+    assert await passwords.verify_and_update_password("secret", hashed) == (True, None)
+    verified, _ = await passwords.verify_and_update_password("wrong", hashed)
+    assert not verified
+
+
+async def test_hasher_rejects_when_queue_is_full():
+    hasher = PasswordHasher(max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    # one call running, one waiting for the worker
+    calls = [asyncio.create_task(hasher.run(release.wait)) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert hasher.stats()["running"] == 1
+    assert hasher.stats()["queued"] == 1
+
+    with pytest.raises(HTTPException) as exc_info:
+        await hasher.run(release.wait)
+    assert exc_info.value.status_code == 503
+
+    release.set()
+    assert await asyncio.gather(*calls) == [True, True]
+    assert hasher.stats()["completed"] == 2
+    assert hasher.stats()["rejected"] == 1
+    hasher.shutdown()
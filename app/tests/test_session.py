@@ -0,0 +1,102 @@
+import time
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.requests import Request
+
+from app.api.deps import get_session
+from app.api.middleware import PRIMARY_UNTIL_COOKIE
+from app.core import config
+from app.main import app
+from app.session import EngineRouter, get_engine, get_router, pool_stats
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+
+def request(method: str, primary_until: float = 0) -> Request:
+    headers = []
+    if primary_until:
+        cookie = f"{PRIMARY_UNTIL_COOKIE}={primary_until}"
+        headers.append((b"cookie", cookie.encode()))
+    return Request({"type": "http", "method": method, "headers": headers})
+
+
+async def current_database(method: str, router: EngineRouter, **kwargs):
+    sessions = get_session(request(method, **kwargs), router)
+    session = await sessions.__anext__()
+    result = await session.execute(text("SELECT current_database()"))
+    database = result.scalar()
+    await sessions.aclose()
+    return session.bind, database
+
+
+@pytest.fixture
+async def router(client: AsyncClient, test_db_setup_sessionmaker):
+    # The default database stands in for a replica of the test database
+    replicas = [
+        create_async_engine(config.settings.DEFAULT_SQLALCHEMY_DATABASE_URI)
+        for _ in range(2)
+    ]
+    try:
+        async with replicas[0].connect():
+            pass
+    except OSError:
+        pytest.skip("default database is not running")
+    router = EngineRouter(get_engine(), replicas, read_your_writes_seconds=60)
+    app.dependency_overrides[get_router] = lambda: router
+    yield router
+    del app.dependency_overrides[get_router]
+    client.cookies.clear()
+    for replica in replicas:
+        await replica.dispose()
+
+
+async def test_reads_go_to_replicas_in_turn(router: EngineRouter):
+    first, database = await current_database("GET", router)
+    assert database == config.settings.DEFAULT_DATABASE_DB
+    second, _ = await current_database("HEAD", router)
+    third, _ = await current_database("GET", router)
+    assert [first, second, third] == [*router.replicas, router.replicas[0]]
+
+    bind, database = await current_database("POST", router)
+    assert bind is router.primary
+    assert database == config.settings.TEST_DATABASE_DB
+
+
+async def test_recent_writers_read_from_primary(router: EngineRouter):
+    now = time.time()
+    bind, _ = await current_database("GET", router, primary_until=now + 30)
+    assert bind is router.primary
+    bind, _ = await current_database("GET", router, primary_until=now - 1)
+    assert bind in router.replicas
+    # Past the window, not from this app
+    bind, _ = await current_database("GET", router, primary_until=now + 3600)
+    assert bind in router.replicas
+
+
+async def test_requests_after_a_write_see_new_user(
+    client: AsyncClient, user_token_headers: dict[str, str], router: EngineRouter
+):
+    # Not on the stand-in replica, the lookup of the token's user fails there
+    res = await client.get("/images", headers=user_token_headers)
+    assert res.status_code == 401
+    assert PRIMARY_UNTIL_COOKIE not in res.cookies
+
+    res = await client.delete("/image/0", headers=user_token_headers)
+    assert res.status_code == 404
+    assert float(res.cookies[PRIMARY_UNTIL_COOKIE]) > time.time() + 50
+    # Any process serving the next request sees the cookie
+    res = await client.get("/images", headers=user_token_headers)
+    assert res.status_code == 200
+
+
+async def test_pool_stats_per_engine(session):
+    checkouts = pool_stats()["checkouts"]
+    await session.execute(text("SELECT 1"))
+    await session.release()
+    stats = pool_stats()
+    assert stats["checkouts"] == checkouts + 1
+    assert stats["replicas"] == []
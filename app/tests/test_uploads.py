@@ -0,0 +1,208 @@
+import base64
+import hashlib
+import io
+import os
+import time
+from datetime import timedelta
+
+import pytest
+from httpx import AsyncClient
+from PIL import Image as PILImage
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.storage import get_blob_store, get_upload_staging
+from app.models import Upload
+from app.tests import utils
+from app.tests.conftest import default_user_hash
+from app.uploads import collect_expired_uploads
+
+# All test coroutines in file will be treated as marked (async allowed).
+pytestmark = pytest.mark.asyncio
+
+
+def b64(value: bytes) -> str:
+    return base64.b64encode(value).decode()
+
+
+def png(size: tuple[int, int] = (64, 48)) -> bytes:
+    output = io.BytesIO()
+    PILImage.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(
+        output, format="PNG"
+    )
+    return output.getvalue()
+
+
+async def create_upload(
+    client: AsyncClient, headers: dict[str, str], content: bytes, **metadata: str
+) -> str:
+    metadata = {"filename": "cat.png", "filetype": "image/png", **metadata}
+    res = await client.post(
+        "/uploads",
+        headers={
+            **headers,
+            "Upload-Length": str(len(content)),
+            "Upload-Metadata": ",".join(
+                f"{key} {b64(value.encode())}" for key, value in metadata.items()
+            ),
+        },
+    )
+    assert res.status_code == 201
+    assert res.headers["Upload-Offset"] == "0"
+    return res.headers["Location"]
+
+
+async def append(
+    client: AsyncClient,
+    headers: dict[str, str],
+    location: str,
+    offset: int,
+    chunk: bytes,
+    checksum: bytes = b"",
+):
+    extra = {"Upload-Checksum": f"sha256 {b64(checksum)}"} if checksum else {}
+    return await client.patch(
+        location,
+        content=chunk,
+        headers={
+            **headers,
+            **extra,
+            "Content-Type": "application/offset+octet-stream",
+            "Upload-Offset": str(offset),
+        },
+    )
+
+
+async def test_resumable_upload(
+    client: AsyncClient, user_token_headers: dict[str, str]
+):
+    content = png()
+    digest = hashlib.sha256(content).hexdigest()
+    location = await create_upload(
+        client, user_token_headers, content, title="cat", sha256=digest
+    )
+    half = len(content) // 2
+
+    res = await append(client, user_token_headers, location, 0, content[:half])
+    assert res.status_code == 204
+    assert res.headers["Upload-Offset"] == str(half)
+
+    # Resending from the start conflicts, the client asks for the offset
+    res = await append(client, user_token_headers, location, 0, content)
+    assert res.status_code == 409
+    res = await client.head(location, headers=user_token_headers)
+    assert res.headers["Upload-Offset"] == str(half)
+    assert res.headers["Upload-Length"] == str(len(content))
+
+    res = await client.post(f"{location}/finalize", headers=user_token_headers)
+    assert res.status_code == 409
+
+    rest = content[half:]
+    res = await append(
+        client, user_token_headers, location, half, rest, hashlib.sha256(rest).digest()
+    )
+    assert res.status_code == 204
+    assert res.headers["Upload-Offset"] == str(len(content))
+
+    res = await client.post(f"{location}/finalize", headers=user_token_headers)
+    assert res.status_code == 200
+    image = res.json()
+    assert image["title"] == "cat"
+    assert image["digest"] == digest
+    assert (image["width"], image["height"]) == (64, 48)
+    assert get_blob_store().path(digest).read_bytes() == content
+
+    res = await client.get(f"/image/{image['id']}", headers=user_token_headers)
+    assert res.content == content
+    res = await client.head(location, headers=user_token_headers)
+    assert res.status_code == 404
+    assert not get_upload_staging().path(location.rsplit("/", 1)[1]).exists()
+
+
+async def test_chunk_checksum_mismatch_drops_chunk(
+    client: AsyncClient, user_token_headers: dict[str, str]
+):
+    content = png()
+    location = await create_upload(client, user_token_headers, content)
+
+    res = await append(
+        client, user_token_headers, location, 0, content, hashlib.sha256(b"").digest()
+    )
+    assert res.status_code == 460
+    res = await client.head(location, headers=user_token_headers)
+    assert res.headers["Upload-Offset"] == "0"
+
+    # Past Upload-Length
+    res = await append(client, user_token_headers, location, 0, content + b"x")
+    assert res.status_code == 413
+    res = await client.head(location, headers=user_token_headers)
+    assert res.headers["Upload-Offset"] == "0"
+
+
+async def test_finalize_checks_file_checksum(
+    client: AsyncClient, user_token_headers: dict[str, str]
+):
+    content = png()
+    location = await create_upload(
+        client, user_token_headers, content, sha256=hashlib.sha256(b"").hexdigest()
+    )
+    res = await append(client, user_token_headers, location, 0, content)
+    assert res.status_code == 204
+
+    res = await client.post(f"{location}/finalize", headers=user_token_headers)
+    assert res.status_code == 422
+    assert not get_blob_store().path(hashlib.sha256(content).hexdigest()).exists()
+    res = await client.head(location, headers=user_token_headers)
+    assert res.status_code == 404
+
+
+async def test_upload_belongs_to_its_user(
+    client: AsyncClient, session: AsyncSession, user_token_headers: dict[str, str]
+):
+    content = png()
+    location = await create_upload(client, user_token_headers, content)
+
+    email = utils.random_email()
+    await utils.create_db_user(email, default_user_hash, session)
+    other_headers = await utils.user_authentication_headers(client, email, "garg")
+    res = await append(client, other_headers, location, 0, content)
+    assert res.status_code == 404
+    res = await client.delete(location, headers=other_headers)
+    assert res.status_code == 404
+
+    res = await client.delete(location, headers=user_token_headers)
+    assert res.status_code == 204
+    res = await client.head(location, headers=user_token_headers)
+    assert res.status_code == 404
+
+
+async def test_collect_expired_uploads(
+    client: AsyncClient, session: AsyncSession, user_token_headers: dict[str, str]
+):
+    staging = get_upload_staging()
+    content = png()
+    idle = (await create_upload(client, user_token_headers, content)).rsplit("/")[-1]
+    active = (await create_upload(client, user_token_headers, content)).rsplit("/")[-1]
+    # Left by a crash before its row was inserted
+    orphan = "0" * 32
+    await staging.create(orphan)
+
+    day_ago = time.time() - 24 * 3600
+    for upload_id in (idle, orphan):
+        os.utime(staging.path(upload_id), (day_ago, day_ago))
+    await session.execute(
+        update(Upload)
+        .where(Upload.id == idle)
+        .values(updated_at=Upload.updated_at - timedelta(days=1))
+    )
+    await session.commit()
+
+    collected = await collect_expired_uploads(session, staging, 3600)
+    assert collected >= 2
+    assert not staging.path(idle).exists()
+    assert not staging.path(orphan).exists()
+    assert staging.path(active).exists()
+    result = await session.execute(
+        select(Upload.id).where(Upload.id.in_([idle, active]))
+    )
+    assert result.scalars().all() == [active]
@@ -2,6 +2,7 @@ import random
 import string
 
 from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
+from httpx import AsyncClient
 from pydantic.networks import EmailStr
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -34,3 +35,15 @@ async def create_db_user(
         )
     )
     return new_user
+
+
+async def user_authentication_headers(
+    client: AsyncClient, email: str, password: str
+) -> dict[str, str]:
+    access_token_res = await client.post(
+        "/auth/jwt/login",
+        data={"username": email, "password": password},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    access_token = access_token_res.json()["access_token"]
+    return {"Authorization": f"Bearer {access_token}"}
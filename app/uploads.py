@@ -0,0 +1,61 @@
+"""
+Expiry of resumable uploads (`app/api/endpoints/uploads.py`).
+
+An upload not written to for `UPLOAD_EXPIRE_SECONDS` is dropped together
+with its staged content. Staged files without an upload row (left by a
+crash while creating or finalizing an upload) go once they are as old.
+
+Run `python -m app.uploads` periodically (e.g. from cron), next to
+`python -m app.blobs`.
+"""
+
+import asyncio
+import time
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import config
+from app.core.storage import UploadStaging, get_upload_staging
+from app.models import Upload
+from app.session import async_session
+
+
+async def collect_expired_uploads(
+    session: AsyncSession, staging: UploadStaging, expire_seconds: int
+) -> int:
+    """
+    Delete uploads idle for longer than `expire_seconds` and their content
+    """
+    result = await session.execute(
+        delete(Upload)
+        .where(Upload.updated_at < func.now() - timedelta(seconds=expire_seconds))
+        .returning(Upload.id)
+        .execution_options(synchronize_session=False)
+    )
+    upload_ids = set(result.scalars().all())
+    await session.commit()
+
+    # Files only, no row
+    idle = await staging.modified_before(time.time() - expire_seconds)
+    if idle:
+        result = await session.execute(select(Upload.id).where(Upload.id.in_(idle)))
+        upload_ids.update(set(idle) - set(result.scalars().all()))
+        await session.commit()
+
+    for upload_id in upload_ids:
+        await staging.delete(upload_id)
+    return len(upload_ids)
+
+
+async def main() -> None:
+    async with async_session() as session:
+        collected = await collect_expired_uploads(
+            session, get_upload_staging(), config.settings.UPLOAD_EXPIRE_SECONDS
+        )
+    print(f"Deleted {collected} expired uploads")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+"""
+Worker running the jobs of `app/jobs.py`.
+
+    python -m app.worker
+
+runs a worker process until SIGINT / SIGTERM, any number of them can run
+side by side. With `JOB_WORKER_IN_APP` (the default) every app process runs
+one as well (see `app/main.py`), so the container, which only starts the app
+in NGINX Unit, runs jobs too. Turn it off where dedicated workers run.
+
+A worker keeps up to `JOB_WORKER_CONCURRENCY` jobs in flight, claiming up
+to `JOB_BATCH_SIZE` at a time whenever it has free slots, and polls every
+`JOB_POLL_INTERVAL_SECONDS` while the queue is empty.
+"""
+
+import asyncio
+import logging
+import signal
+from typing import Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import app.tasks  # noqa: F401 registers the handlers
+from app.core import config, metrics
+from app.core.transform import derivatives
+from app.jobs import HANDLERS, ClaimedJob, PermanentJobError, claim, complete, fail
+from app.session import async_session, dispose_engine
+
+logger = logging.getLogger(__name__)
+
+processed = metrics.REGISTRY.register(
+    metrics.Counter(
+        "jobs_processed_total",
+        "Jobs run by this process, by kind and outcome",
+        ("kind", "outcome"),
+    )
+)
+job_duration = metrics.REGISTRY.register(
+    metrics.Histogram("job_duration_seconds", "Job run time, by kind", ("kind",))
+)
+
+
+class Worker:
+    def __init__(
+        self,
+        concurrency: int,
+        batch_size: int,
+        poll_interval: float,
+        visibility_timeout: float,
+    ) -> None:
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.running: set[asyncio.Task] = set()
+        self._stopping: Optional[asyncio.Event] = None
+        self._slot_free: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self) -> None:
+        """
+        Claim and run jobs until `stop`, then wait for the running ones
+        """
+        if self._stopping is None:
+            self._stopping = asyncio.Event()
+        self._slot_free = asyncio.Event()
+        try:
+            while not self._stopping.is_set():
+                free = self.concurrency - len(self.running)
+                if not free:
+                    self._slot_free.clear()
+                    await self._wait(self._slot_free, None)
+                    continue
+                try:
+                    async with async_session() as session:
+                        jobs = await claim(
+                            session, min(free, self.batch_size), self.visibility_timeout
+                        )
+                except (OSError, SQLAlchemyError):
+                    # Database restarting or unreachable, try again after a poll
+                    logger.exception("Claiming jobs failed")
+                    jobs = []
+                for job in jobs:
+                    task = asyncio.create_task(self.run_job(job))
+                    self.running.add(task)
+                    task.add_done_callback(self._done)
+                if not jobs:
+                    await self._wait(self._stopping, self.poll_interval)
+        finally:
+            if self.running:
+                await asyncio.wait(self.running)
+
+    async def _wait(self, event: asyncio.Event, timeout: Optional[float]) -> None:
+        assert self._stopping is not None
+        waits = {asyncio.ensure_future(event.wait())}
+        if event is not self._stopping:
+            waits.add(asyncio.ensure_future(self._stopping.wait()))
+        _, pending = await asyncio.wait(
+            waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        for future in pending:
+            future.cancel()
+
+    def _done(self, task: asyncio.Task) -> None:
+        self.running.discard(task)
+        if self._slot_free is not None:
+            self._slot_free.set()
+
+    async def run_job(self, job: ClaimedJob) -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        handle = HANDLERS.get(job.kind)
+        error: Optional[Exception] = None
+        try:
+            if handle is None:
+                raise PermanentJobError(f"No handler for {job.kind}")
+            # Past the visibility timeout the job may run elsewhere already
+            await asyncio.wait_for(handle(job.payload), self.visibility_timeout)
+        except Exception as e:
+            error = e
+        job_duration.observe(loop.time() - start, job.kind)
+
+        retry = not isinstance(error, PermanentJobError)
+        if error is None:
+            outcome = "done"
+        elif retry and job.attempts < job.max_attempts:
+            outcome = "retried"
+        else:
+            outcome = "failed"
+        processed.inc(job.kind, outcome)
+
+        try:
+            async with async_session() as session:
+                if error is None:
+                    await complete(session, job)
+                else:
+                    await fail(session, job, repr(error), retry)
+        except (OSError, SQLAlchemyError):
+            # The job is claimed again once its visibility timeout is up
+            logger.exception("Recording the outcome of job %s failed", job.id)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self._stopping is None:
+            self._stopping = asyncio.Event()
+        self._stopping.set()
+
+    async def join(self) -> None:
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+
+def get_worker() -> Worker:
+    return Worker(
+        concurrency=config.settings.JOB_WORKER_CONCURRENCY,
+        batch_size=config.settings.JOB_BATCH_SIZE,
+        poll_interval=config.settings.JOB_POLL_INTERVAL_SECONDS,
+        visibility_timeout=config.settings.JOB_VISIBILITY_TIMEOUT_SECONDS,
+    )
+
+
+async def main() -> None:
+    worker = get_worker()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    print(f"Worker running {worker.concurrency} jobs at a time, Ctrl+C to stop")
+    try:
+        await worker.run()
+    finally:
+        derivatives.shutdown()
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())